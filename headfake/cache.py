@@ -0,0 +1,203 @@
+"""
+This package implements the on-disk cache of compiled templates
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+from headfake.util import locate_file
+
+CACHE_DIR_ENV = "HEADFAKE_CACHE_DIR"
+DEFAULT_MAX_ENTRIES = 32
+
+
+def default_cache_dir():
+    """
+    Gets the directory used for the cache: HEADFAKE_CACHE_DIR if it is set, otherwise headfake in the user cache
+    directory (e.g. ~/.cache/headfake).
+    """
+    directory = os.environ.get(CACHE_DIR_ENV)
+    if directory:
+        return directory
+
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "headfake")
+
+
+class TemplateCache:
+    """
+    Cache of compiled templates (the Fieldset created from a template along with the state of the random number
+    generators after creating it) stored as pickle files, so that later runs of the same template can skip loading and
+    compiling it. This includes loading the mapping files used by the template and expanding option pick lists.
+
+    Entries are keyed by a hash of the template file, the headfake version, the seed and the locale. The contents of the
+    files referenced by the template (e.g. mapping_file) are checked when an entry is loaded. At most max_entries
+    templates are kept, with the least recently used removed first.
+    """
+
+    def __init__(self, directory=None, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param directory: directory to store the cache in (by default from default_cache_dir)
+        :param max_entries: maximum number of compiled templates to keep
+        """
+        self.directory = Path(directory or default_cache_dir())
+        self.max_entries = max_entries
+
+    def key(self, template_file, seed=None, locale=None, **kwargs):
+        """
+        Creates the key for a template.
+        :param template_file: path of the template
+        :param seed: seed used to create the fieldset
+        :param locale: locale used for faker-based fields
+        :param kwargs: any other arguments used to create the fieldset
+        :return: hex digest
+        """
+        digest = hashlib.sha256()
+        options = (headfake_version(), sys.version_info[:2], seed, locale, sorted(kwargs.items()))
+        digest.update(repr(options).encode("utf-8"))
+        digest.update(file_digest(template_file).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Loads the entry for a key, marking it as recently used.
+        :param key: key from TemplateCache.key
+        :return: entry dictionary or None if it is not cached (or the files referenced by the template have changed)
+        """
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as fh:
+                files = pickle.load(fh)
+                if any(file_digest(file) != digest for file, digest in files.items()):
+                    return None
+
+                entry = pickle.load(fh)
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            logging.warning(f"Removing unreadable template cache entry {path}: {ex}")
+            self._remove(path)
+            return None
+
+        os.utime(path)
+        return entry
+
+    def put(self, key, entry, files=()):
+        """
+        Stores the entry for a key, removing the least recently used entries if there are more than max_entries.
+        :param key: key from TemplateCache.key
+        :param entry: picklable entry dictionary
+        :param files: files referenced by the template, which are checked when the entry is loaded
+        :return: True if the entry was stored, or False if it could not be pickled
+        """
+        try:
+            data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as ex:
+            logging.warning(f"Template cannot be cached: {ex}")
+            return False
+
+        files = {str(file): file_digest(file) for file in files}
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as fh:
+            pickle.dump(files, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            fh.write(data)
+
+        os.replace(fh.name, self._path(key))
+        self._evict()
+        return True
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        for path in self._entries():
+            self._remove(path)
+
+    def _path(self, key):
+        return self.directory / f"{key}.pickle"
+
+    def _entries(self):
+        if not self.directory.is_dir():
+            return []
+
+        return list(self.directory.glob("*.pickle"))
+
+    def _evict(self):
+        entries = []
+        for path in self._entries():
+            try:
+                entries.append((path.stat().st_mtime_ns, path))
+            except FileNotFoundError:
+                pass
+
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries:]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def find_template_files(params):
+    """
+    Finds the files referenced by template parameters (the values of any "..._file" parameters, e.g. mapping_file).
+    :param params: template parameters as a hierarchical dictionary
+    :return: list of paths
+    """
+    files = []
+
+    if isinstance(params, dict):
+        for name, value in params.items():
+            if isinstance(name, str) and name.endswith("_file") and isinstance(value, str):
+                try:
+                    files.append(locate_file(value))
+                except FileNotFoundError:
+                    pass
+            else:
+                files.extend(find_template_files(value))
+    elif isinstance(params, list):
+        for value in params:
+            files.extend(find_template_files(value))
+
+    return files
+
+
+def file_digest(file):
+    """
+    Gets a hash of the contents of a file (or an empty string if it does not exist).
+    """
+    try:
+        with open(file, "rb") as fh:
+            return hashlib.sha256(fh.read()).hexdigest()
+    except FileNotFoundError:
+        return ""
+
+
+def headfake_version():
+    """
+    Gets the version of headfake along with the size and modification time of its modules, so that the cache is not
+    used after the code changes (e.g. in a development checkout whose version does not change).
+    """
+    from importlib import metadata
+
+    try:
+        version = metadata.version("headfake")
+    except metadata.PackageNotFoundError:
+        version = None
+
+    package_dir = Path(__file__).parent
+    modules = sorted((str(path.relative_to(package_dir)), path.stat().st_size, path.stat().st_mtime_ns)
+                     for path in package_dir.rglob("*.py"))
+
+    return version, modules
@@ -3,8 +3,12 @@ This package implements the command line interface for headfake
 """
 
 import argparse
+import sys
 
 from headfake import output, HeadFake
+from headfake.cache import TemplateCache, CACHE_DIR_ENV
+from headfake.fieldset import DEFAULT_CHUNK_SIZE
+from headfake.headfake import DEFAULT_QUEUE_SIZE
 
 import os
 
@@ -22,7 +26,14 @@ class Command:
         Returns:
             None
         """
-        command = Command(args)
+        if args is None:
+            args = sys.argv[1:]
+
+        if args and args[0] == "serve":
+            command = ServeCommand(args[1:])
+        else:
+            command = Command(args)
+
         command.execute()
 
     def __init__(self, args=None):
@@ -51,6 +62,110 @@ class Command:
             help="Output data to file rather than STDOUT"
         )
 
+        parser.add_argument(
+            "-f",
+            "--format",
+            choices=list(output.FORMAT_OUTPUTS),
+            help="Format of the output data (by default inferred from the output file extension, otherwise csv)"
+        )
+
+        parser.add_argument(
+            "-z",
+            "--compress",
+            choices=sorted(output.COMPRESSION_EXTENSIONS.values()),
+            help="Compress the output data (by default inferred from the output file extension, e.g. .gz)"
+        )
+
+        parser.add_argument(
+            "--parquet-compression",
+            help="Compression codec to use for parquet output (e.g. snappy, gzip, zstd or none)",
+            default="snappy"
+        )
+
+        parser.add_argument(
+            "--table",
+            help="Name of the table to create for sqlite output (default data)",
+            default="data"
+        )
+
+        parser.add_argument(
+            "--if-exists",
+            choices=["fail", "replace", "append"],
+            help="What to do if the table for sqlite output already exists (default fail)",
+            default="fail"
+        )
+
+        parser.add_argument(
+            "--index",
+            action="append",
+            help="Column to index after loading sqlite output (can be given more than once)"
+        )
+
+        parser.add_argument(
+            "--keep-empty-strings",
+            action="store_true",
+            help="Write empty strings as empty values rather than NULL for pgcopy/pgcopy-binary output"
+        )
+
+        parser.add_argument(
+            "--fhir-mapping",
+            help="YAML/JSON file mapping fields onto parts of the resources for fhir-patient output"
+        )
+
+        parser.add_argument(
+            "--hl7-mapping",
+            help="YAML/JSON file mapping fields onto parts of the PID segment for hl7-adt output"
+        )
+
+        parser.add_argument(
+            "--hl7-event",
+            choices=output.Hl7AdtOutput.events,
+            help="ADT event of the messages for hl7-adt output (default A04)",
+            default="A04"
+        )
+
+        parser.add_argument(
+            "--hl7-framing",
+            choices=output.Hl7AdtOutput.framings,
+            help="Separate hl7-adt messages with newlines or wrap them in MLLP frames (default newline)",
+            default="newline"
+        )
+
+        parser.add_argument(
+            "--fixed-width-layout",
+            help="YAML/JSON file giving the width (and optionally align and fill) of each column for fixed-width output"
+        )
+
+        parser.add_argument(
+            "--preallocate",
+            action="store_true",
+            help="Preallocate the fixed-width output file for --no-rows records and write it through a memory map"
+        )
+
+        parser.add_argument(
+            "--partition-rows",
+            type=int,
+            help="Split the output into files of up to this number of rows"
+        )
+
+        parser.add_argument(
+            "--partition-by",
+            help="Split the output into a file for each value of this field"
+        )
+
+        parser.add_argument(
+            "--partition-count",
+            type=int,
+            help="Split the output into this number of files by hashing the values of the --partition-by field"
+        )
+
+        parser.add_argument(
+            "--max-partitions",
+            type=int,
+            help="Maximum number of files which --partition-by can split the output into (default 256)",
+            default=output.DEFAULT_MAX_PARTITIONS
+        )
+
         parser.add_argument(
             "-n",
             "--no-rows",
@@ -59,6 +174,38 @@ class Command:
             default=10
         )
 
+        parser.add_argument(
+            "-c",
+            "--chunk-size",
+            type=int,
+            help="Number of rows to generate and write at a time",
+            default=DEFAULT_CHUNK_SIZE
+        )
+
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            help="Number of processes used to format chunks for streamed output (every format except json, parquet "
+            "and sqlite, default 1)",
+            default=1
+        )
+
+        parser.add_argument(
+            "--queue-size",
+            type=int,
+            help="Number of generated chunks which can wait to be written in the background (0 to write each chunk "
+            "before generating the next)",
+            default=DEFAULT_QUEUE_SIZE
+        )
+
+        parser.add_argument(
+            "--cache",
+            action="store_true",
+            help="Cache the compiled template so that later runs can skip compiling it (also enabled by setting "
+            "HEADFAKE_CACHE_DIR, which is where the cache is kept)"
+        )
+
         parser.add_argument(
             "-s",
             "--seed",
@@ -69,6 +216,38 @@ class Command:
 
         self.args = parser.parse_args(args)
 
+        if not self.args.format:
+            self.args.format = output.infer_format(self.args.output_file)
+
+        output_class = output.FORMAT_OUTPUTS[self.args.format]
+
+        if self.args.partition_rows or self.args.partition_by or self.args.partition_count:
+            if self.args.partition_rows and self.args.partition_by:
+                parser.error("--partition-rows and --partition-by cannot be used together")
+
+            if self.args.partition_count and not self.args.partition_by:
+                parser.error("--partition-count needs a --partition-by field")
+
+            if not self.args.output_file:
+                parser.error("an --output-file is needed for partitioned output")
+
+        if self.args.format == "fixed-width" and not self.args.fixed_width_layout:
+            parser.error("a --fixed-width-layout is needed for fixed-width format")
+
+        if self.args.preallocate:
+            if self.args.format != "fixed-width":
+                parser.error("--preallocate can only be used with fixed-width format")
+
+            if not self.args.output_file or self.args.compress or output.infer_compression(self.args.output_file):
+                parser.error("--preallocate needs an uncompressed --output-file")
+
+        if not issubclass(output_class, output.StreamOutput):
+            if not self.args.output_file:
+                parser.error(f"an --output-file is needed for {self.args.format} format")
+
+            if self.args.compress:
+                parser.error(f"--compress cannot be used with {self.args.format} format")
+
     def execute(self):
         """
         Runs the app by loading the configuration and generating data
@@ -79,13 +258,95 @@ class Command:
 
         filename, file_ext = os.path.splitext(self.args.template)
 
-        hf_load_fn = HeadFake.from_json if file_ext == "json" else HeadFake.from_yaml
+        hf_load_fn = HeadFake.from_json if file_ext.lower() == ".json" else HeadFake.from_yaml
+
+        cache = None
+        if self.args.cache or os.environ.get(CACHE_DIR_ENV):
+            cache = TemplateCache()
+
+        headfake = hf_load_fn(self.args.template, cache=cache, seed=self.args.seed)
 
-        headfake = hf_load_fn(self.args.template, seed=self.args.seed)
+        output_class = output.FORMAT_OUTPUTS[self.args.format]
 
-        if self.args.output_file:
-            outfile = output.CsvFileOutput(self.args)
+        if self.args.partition_rows or self.args.partition_by:
+            outfile = output.PartitionedOutput(self.args, output_class)
         else:
-            outfile = output.StdoutOutput(self.args)
+            outfile = output_class(self.args)
+
+        headfake.write(outfile, self.args.no_rows, self.args.chunk_size, self.args.queue_size)
+
+
+class ServeCommand:
+    """
+    Class for the serve command (headfake serve), which runs a server generating data from the templates on request
+    """
+
+    def __init__(self, args=None):
+        parser = argparse.ArgumentParser(
+            prog="headfake serve",
+            description="Run an HTTP server which loads the templates once and streams generated data for "
+            "GET /generate?template=NAME&rows=N&seed=S&format=csv requests.")
+
+        parser.add_argument(
+            "templates",
+            nargs="+",
+            help="YAML-based template files to serve (requested by their file name without the extension)"
+        )
+
+        parser.add_argument(
+            "--host",
+            help="Host to listen on (default 127.0.0.1)",
+            default="127.0.0.1"
+        )
+
+        parser.add_argument(
+            "--port",
+            type=int,
+            help="Port to listen on (default 8000)",
+            default=8000
+        )
+
+        parser.add_argument(
+            "--socket",
+            help="Listen on this Unix socket rather than a TCP port"
+        )
+
+        parser.add_argument(
+            "-c",
+            "--chunk-size",
+            type=int,
+            help="Default number of rows to generate and send at a time",
+            default=DEFAULT_CHUNK_SIZE
+        )
+
+        parser.add_argument(
+            "--max-rows",
+            type=int,
+            help="Maximum number of rows for a request (default 10000000)",
+            default=10000000
+        )
+
+        parser.add_argument(
+            "--max-chunk-size",
+            type=int,
+            help="Maximum number of rows which a request can generate at a time (default 100000)",
+            default=100000
+        )
+
+        self.args = parser.parse_args(args)
+
+        if not 1 <= self.args.chunk_size <= self.args.max_chunk_size:
+            parser.error("--chunk-size should be between 1 and --max-chunk-size")
+
+    def execute(self):
+        """
+        Loads the templates and runs the server until it is interrupted
+
+        Returns:
+            None
+        """
+        from headfake.server import GenerationServer
 
-        outfile.write(headfake.generate(self.args.no_rows))
+        server = GenerationServer(self.args.templates, chunk_size=self.args.chunk_size, max_rows=self.args.max_rows,
+                                  max_chunk_size=self.args.max_chunk_size)
+        server.run(self.args.host, self.args.port, self.args.socket)
@@ -3,6 +3,7 @@ Fake/mock field generation logic
 """
 
 import csv
+import operator
 import random as rnd
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any, Optional, Union
@@ -10,17 +11,17 @@ from datetime import datetime as dt, timedelta as td
 import datetime
 
 import attr
-import faker
 
 from headfake.error import TransformerError
-from headfake.transformer import Transformer
-from headfake.util import create_package_class, locate_file, handle_missing_keyword, new_field_name
+from headfake.transformer import Transformer, fuse_transformers
+from headfake.util import create_package_class, locate_file, handle_missing_keyword, new_field_name, as_column, \
+    iter_rows, date_parser, date_formatter, DerivedAttributes
 
 import numpy as np
 from functools import partial
 
 @attr.s(kw_only=True)
-class Field(ABC):
+class Field(DerivedAttributes, ABC):
     """Acts as abstract Field class.
 
     Fields use the attrs module to handle available/required class attributes/defaults.
@@ -30,8 +31,8 @@ class Field(ABC):
         name (str): Optional name of field (defaults to incremental number)
 
     """
-    transformers: List[Transformer] = attr.ib(factory=list)
-    final_transformers: List[Transformer] = attr.ib(factory=list)
+    transformers: List[Transformer] = attr.ib(factory=list, converter=fuse_transformers)
+    final_transformers: List[Transformer] = attr.ib(factory=list, converter=fuse_transformers)
     name: Optional[str] = attr.ib(default=new_field_name())
     generate_after:bool = False # static property to force the value to be generated after other field values have been generated
     hidden:bool = attr.ib(default=False) # field which is hidden from the final output
@@ -39,12 +40,14 @@ class Field(ABC):
 
     _transform = attr.ib()
 
+    _derived_attributes = ("_transform",)
+
     @_transform.default
     def _default_transform(self):
         if self.transformers:
             return partial(transform_value, field=self, transformers=self.transformers)
         else:
-            return lambda row, value: value
+            return no_transform
 
     def after_init_params(self):
         [t.init_params(self) for t in self.transformers]
@@ -107,6 +110,171 @@ class Field(ABC):
         """
         pass
 
+    def next_batch(self, columns: Dict[str, np.ndarray], size: int) -> Union[np.ndarray, Dict[str, np.ndarray]]:
+        """Gets a batch of generated values for field.
+
+        This is the column-based counterpart of 'next_value'. Fields which over-ride '_next_batch' generate the whole
+        batch at once, other fields fall back to calling 'next_value' for each row. If 'transformers' have been provided
+        in the constructor they will act on the values after they have been generated.
+
+        If an error occurs and an 'error_value' has been provided, only the failing rows are replaced with the
+        'error_value'. If a transformer fails, the transformers are run again value by value over the generated batch,
+        and fields which combine values (e.g. ConcatField, OperationField) give the rows they cannot combine the
+        'error_value'. If generating the batch fails in any other way, it is generated again row by row, so the values
+        are generated twice (e.g. an IdField used by the field moves on by two sets of IDs).
+
+        Args:
+            columns: The data columns generated so far as a dictionary of arrays
+            size: The number of values to generate
+
+        Returns:
+            Dictionary containing multiple field arrays OR a single array of field values
+
+        """
+        if not self._has_batch_support():
+            return self._next_batch_by_row(columns, size)
+
+        try:
+            values = self._next_batch(columns, size)
+        except Exception as ex:
+            if self.error_value:
+                return self._next_batch_by_row(columns, size)
+
+            raise ex
+
+        try:
+            return self._transform_batch(columns, values, size)
+        except Exception as ex:
+            if self.error_value:
+                return self._transform_batch_by_row(columns, values)
+
+            raise ex
+
+    def _next_batch(self, columns: Dict[str, np.ndarray], size: int):
+        """Internal method that can be over-ridden in inheriting Field classes to generate a batch of values at once.
+
+        Args:
+            columns: The data columns generated so far as a dictionary of arrays
+            size: The number of values to generate
+
+        Returns:
+            Dictionary containing multiple field arrays OR a single array of field values
+        """
+        raise NotImplementedError
+
+    def _has_batch_support(self):
+        return type(self)._next_batch is not Field._next_batch
+
+    # whether the field accepts native typed values (e.g. dates) in the row/columns from fields which have them,
+    # rather than their formatted values
+    uses_typed_values = False
+
+    def has_typed_values(self) -> bool:
+        """Whether the field can generate native typed values (e.g. dates) which are only formatted for output later.
+
+        This is the case for fields which over-ride '_next_typed_batch' and have no transformers or error_value (as
+        these act on the formatted values).
+
+        Returns:
+            True if 'next_typed_batch' can be used
+        """
+        return type(self)._next_typed_batch is not Field._next_typed_batch and not self.transformers \
+            and not self.error_value
+
+    def next_typed_batch(self, columns: Dict[str, np.ndarray], size: int) -> np.ndarray:
+        """Gets a batch of values in their native type (e.g. datetime64 rather than date strings).
+
+        This allows fields which use the values (e.g. DeceasedField or AgeField) to avoid parsing them again. The
+        values are converted into their output form using 'format_batch'.
+
+        Args:
+            columns: The data columns generated so far as a dictionary of arrays
+            size: The number of values to generate
+
+        Returns:
+            Array of typed field values
+        """
+        return self._next_typed_batch(columns, size)
+
+    def _next_typed_batch(self, columns: Dict[str, np.ndarray], size: int):
+        """Internal method that can be over-ridden in inheriting Field classes which format their values (e.g. dates).
+
+        Args:
+            columns: The data columns generated so far as a dictionary of arrays
+            size: The number of values to generate
+
+        Returns:
+            Array of typed field values
+        """
+        raise NotImplementedError
+
+    def format_batch(self, values: np.ndarray) -> np.ndarray:
+        """Formats a batch of values from 'next_typed_batch' in the same way as 'next_value'.
+
+        Args:
+            values: Array of typed field values
+
+        Returns:
+            Array of formatted field values
+        """
+        return values
+
+    def _next_batch_by_row(self, columns, size):
+        values = [self.next_value(row) for row in iter_rows(columns, size)]
+
+        if not any(isinstance(value, dict) for value in values):
+            return as_column(values)
+
+        names = dict.fromkeys(name for value in values if isinstance(value, dict) for name in value)
+        return {
+            name: as_column([value.get(name) if isinstance(value, dict) else None for value in values])
+            for name in names
+        }
+
+    def _transform_batch(self, columns, values, size):
+        if not self.transformers:
+            return values
+
+        return transform_column(self, columns, values, self.transformers)
+
+    def _transform_batch_by_row(self, columns, values):
+        transformed = []
+        for row, value in zip(iter_rows(columns, len(values)), values.tolist()):
+            try:
+                transformed.append(self._transform(row=row, value=value))
+            except Exception:
+                transformed.append(self.error_value)
+
+        return as_column(transformed)
+
+    def _combine_by_row(self, fn, *values):
+        """Combines the values (arrays or scalars) of each row using fn.
+
+        If fn fails for a row and an 'error_value' has been provided, the row is given the 'error_value'.
+
+        Args:
+            fn: Function taking a value from each of the values
+            *values: Arrays of row values or scalars used for every row
+
+        Returns:
+            Array of combined values (or a scalar if all of the values are scalars)
+        """
+        if self.error_value:
+            fn = partial(apply_or_error_value, fn, self.error_value)
+
+        return np.frompyfunc(fn, len(values), 1)(*values)
+
+def no_transform(row, value):
+    return value
+
+
+def apply_or_error_value(fn, error_value, *args):
+    try:
+        return fn(*args)
+    except Exception:
+        return error_value
+
+
 def transform_value(field, row, value, transformers):
         for t in transformers:
             try:
@@ -117,17 +285,36 @@ def transform_value(field, row, value, transformers):
         return value
 
 
+def transform_column(field, columns, values, transformers):
+    """
+    Batch version of transform_value which runs each transformer over a whole column of values.
+
+    If a transformer fails on the batch, it is run again value by value so that the error is raised as a
+    TransformerError for the row concerned.
+    """
+    for t in transformers:
+        try:
+            values = t.transform_batch(field, columns, values)
+        except Exception:
+            values = as_column([
+                transform_value(field, row, value, [t])
+                for row, value in zip(iter_rows(columns, len(values)), values.tolist())
+            ])
+
+    return values
+
+
 @attr.s(kw_only=True)
 class FakerField(Field):
     """Abstract base field for Faker-based value creation.
     """
     _fake = attr.ib()
+    _derived_attributes = Field._derived_attributes + ("_fake",)
 
     @_fake.default
     def _default_faker(self):
         from headfake import HeadFake
-        fake = faker.Faker(HeadFake.locale)
-        return fake
+        return HeadFake.create_faker()
 
 
 @attr.s(kw_only=True)
@@ -214,6 +401,11 @@ class ConstantField(Field):
     def _next_value(self, row):
         return self.value
 
+    def _next_batch(self, columns, size):
+        values = np.empty(size, dtype=object)
+        values.fill(self.value)
+        return values
+
 
 @attr.s(kw_only=True)
 class ConcatField(Field):
@@ -233,6 +425,22 @@ class ConcatField(Field):
 
         return self.glue.join(vals)
 
+    def _next_batch(self, columns, size):
+        batches = [field.next_batch(columns, size) for field in self.fields]
+
+        try:
+            values = np.full(size, "", dtype=object)
+            for i, batch in enumerate(batches):
+                if i > 0:
+                    values = values + self.glue
+
+                values = values + as_str_column(batch)
+
+            return values
+        except TypeError:
+            # join each row instead, so that only the rows which are not strings fail
+            return self._combine_by_row(lambda *row_values: self.glue.join(row_values), *map(as_native, batches))
+
     def init_from_fieldset(self, fieldset):
         for field in self.fields:
             field.init_from_fieldset(fieldset)
@@ -304,6 +512,7 @@ class IfElseField(Field):
     true_value = attr.ib()
     false_value = attr.ib()
     _cond_obj = attr.ib()
+    _derived_attributes = Field._derived_attributes + ("_cond_obj",)
 
     @_cond_obj.default
     def _default_cond_obj(self):
@@ -317,9 +526,81 @@ class IfElseField(Field):
             return self.false_value.next_value(row) if hasattr(
                 self.false_value, "next_value") else self.false_value
 
+    def _next_batch(self, columns, size):
+        mask = self._cond_obj.is_true_batch(columns, size)
+
+        branches = [
+            (mask, self._branch_batch(self.true_value, columns, mask)),
+            (~mask, self._branch_batch(self.false_value, columns, ~mask))
+        ]
+
+        return self._scatter_branches(branches, size)
+
+    def _branch_batch(self, value, columns, mask):
+        """
+        Generates the values for a branch using only the rows selected by the mask (so nested IfElseFields work on
+        progressively smaller sub-batches).
+        """
+        num_rows = int(np.count_nonzero(mask))
+
+        if not hasattr(value, "next_batch"):
+            values = np.empty(num_rows, dtype=object)
+            values.fill(value)
+            return values
+
+        if num_rows == 0:
+            return np.empty(0, dtype=object)
+
+        return value.next_batch({name: column[mask] for name, column in columns.items()}, num_rows)
+
+    def _scatter_branches(self, branches, size):
+        """
+        Scatters the branch values back into full-sized columns. Branches which generate multiple fields are
+        combined into a dictionary of columns, with the other branch's values used for this field.
+        """
+        if not any(isinstance(values, dict) for mask, values in branches):
+            dtypes = set(values.dtype for mask, values in branches)
+            result = np.empty(size, dtype=dtypes.pop() if len(dtypes) == 1 else object)
+            for mask, values in branches:
+                result[mask] = values
+
+            return result
+
+        result = {}
+        for mask, values in branches:
+            if not isinstance(values, dict):
+                values = {self.name: values}
+
+            for name, branch_values in values.items():
+                result.setdefault(name, np.full(size, None, dtype=object))[mask] = branch_values
+
+        return result
+
+
+VECTORISED_OPERATORS = {
+    operator.add: np.add,
+    operator.sub: np.subtract,
+    operator.mul: np.multiply,
+    operator.truediv: np.true_divide,
+    operator.floordiv: np.floor_divide,
+    operator.mod: np.mod,
+    operator.pow: np.power,
+    operator.eq: np.equal,
+    operator.ne: np.not_equal,
+    operator.lt: np.less,
+    operator.le: np.less_equal,
+    operator.gt: np.greater,
+    operator.ge: np.greater_equal,
+    operator.and_: np.bitwise_and,
+    operator.or_: np.bitwise_or
+}
+
+# ufuncs whose integer results can overflow int64
+INTEGER_OVERFLOW_UFUNCS = {np.add, np.subtract, np.multiply, np.power}
+
 
 @attr.s(kw_only=True)
-class Condition:
+class Condition(DerivedAttributes):
     """
     Dependent field condition which compares the results of a field expression with a value, using an operator function.
 
@@ -332,6 +613,7 @@ class Condition:
     operator = attr.ib()
     value = attr.ib()
     _operator_fn = attr.ib()
+    _derived_attributes = ("_operator_fn",)
 
     @_operator_fn.default
     def _default_operator_fn(self):
@@ -340,6 +622,30 @@ class Condition:
     def is_true(self, row):
         return self._operator_fn(row.get(self.field), self.value)
 
+    def is_true_batch(self, columns, size):
+        """
+        Evaluates the condition over the whole column of the referenced field and returns a boolean mask. Builtin
+        comparison/bitwise operator functions are applied with the equivalent numpy function, other functions are called
+        once per value.
+        """
+        values = columns.get(self.field)
+        if values is None:
+            values = np.full(size, None, dtype=object)
+
+        result = None
+        batch_fn = VECTORISED_OPERATORS.get(self._operator_fn)
+        if batch_fn:
+            try:
+                result = batch_fn(values, self.value)
+            except TypeError:
+                # e.g. no numpy loop for comparing a string column with a number
+                pass
+
+        if result is None:
+            result = as_column([self._operator_fn(value, self.value) for value in values.tolist()])
+
+        return np.asarray(result).astype(bool)
+
 
 @attr.s(kw_only=True)
 class RepeatField(Field):
@@ -364,6 +670,38 @@ class RepeatField(Field):
 
         return self.glue.join(outputs) if self.glue else outputs
 
+    def _next_batch(self, columns, size):
+        min_values = extract_number_batch(self.min_repeats, columns, size)
+        max_values = extract_number_batch(self.max_repeats, columns, size)
+
+        num_values = np.random.randint(np.asarray(min_values).astype(np.int64),
+                                       np.asarray(max_values).astype(np.int64), size=size)
+
+        # generate the values for all rows in a single flattened batch, with each row's columns repeated so that the
+        # repeated field sees the same row values as it would when generated row by row.
+        repeated_columns = {name: np.repeat(column, num_values) for name, column in columns.items()}
+        outputs = self.field.next_batch(repeated_columns, int(num_values.sum()))
+
+        if isinstance(outputs, dict):
+            outputs = as_column(list(iter_rows(outputs, int(num_values.sum()))))
+
+        offsets = np.cumsum(num_values) - num_values
+
+        if not self.glue:
+            return as_column([outputs[offset:offset + num].tolist() for offset, num in zip(offsets, num_values)])
+
+        # append the glue to every value apart from the last in each row, then join each row's values with a
+        # segmented sum. Rows without any repeats cannot take part in the reduceat and are left blank.
+        suffixes = np.full(len(outputs), self.glue, dtype=object)
+        has_values = num_values > 0
+        suffixes[(offsets + num_values - 1)[has_values]] = ""
+
+        values = np.full(size, "", dtype=object)
+        if has_values.any():
+            values[has_values] = np.add.reduceat(as_str_column(outputs) + suffixes, offsets[has_values])
+
+        return values
+
 
 @attr.s(kw_only=True)
 class NumberField(Field):
@@ -387,6 +725,7 @@ class NumberField(Field):
     dp: int = attr.ib(default=None)
 
     _dist_cls = attr.ib()
+    _derived_attributes = Field._derived_attributes + ("_dist_cls",)
 
     @_dist_cls.default
     def _default_dist_cls(self):
@@ -456,6 +795,14 @@ class DateField(NumberField):
         return create_package_class(self.distribution)(loc=0, scale=self.sd)
 
     def _next_value(self, row):
+        date = self._next_date(row)
+
+        if self.format:
+            return date.strftime(self.format)
+
+        return date
+
+    def _next_date(self, row):
         min = extract_date(self.min, row, self.min_format)
         max = extract_date(self.max, row, self.max_format)
         mean = extract_date(self.mean, row, self.mean_format)
@@ -468,13 +815,19 @@ class DateField(NumberField):
         date = mean + td(days=num_to_mean)
 
         if (min and date < min) or (max and date > max):
-            return self.next_value(row)
-
-        if self.format:
-            return date.strftime(self.format)
+            return self._next_date(row)
 
         return date
 
+    def _next_typed_batch(self, columns, size):
+        return as_column([self._next_date(row) for row in iter_rows(columns, size)])
+
+    def format_batch(self, values):
+        if not self.format:
+            return values
+
+        return as_column(list(map(date_formatter(self.format), values.tolist())))
+
 @attr.s(kw_only=True)
 class OperationField(Field):
     """
@@ -482,13 +835,18 @@ class OperationField(Field):
     Like the 'Condition' used in IfElseField, it is easiest to use builtin Python "operator" functions such as
     `operator.add`, `operator.sub` but a custom function can be used if needed.
 
-    The first and second values can be field definitions or scalar values (e.g. strings, numbers, dates).
+    The first and second values can be field definitions or scalar values (e.g. strings, numbers, dates). Values of
+    other fields are used in their native type (e.g. dates rather than formatted date strings), so dates can be added
+    to or subtracted from as whole columns of datetime64 values.
 
     """
     operator = attr.ib()
     first_value = attr.ib()
     second_value = attr.ib()
     _operator_fn = attr.ib()
+    _derived_attributes = Field._derived_attributes + ("_operator_fn",)
+
+    uses_typed_values = True
 
     @_operator_fn.default
     def _default_operator_fn(self):
@@ -504,6 +862,35 @@ class OperationField(Field):
 
         return self._operator_fn(first_value, second_value)
 
+    def _determine_batch(self, columns, size, property):
+        values = property.next_batch(columns, size) if hasattr(property, "next_batch") else property
+
+        # dates and timedeltas are converted into datetime64/timedelta64 so that numpy can operate on them
+        return as_temporal(values)
+
+    def _next_batch(self, columns, size):
+        first_values = self._determine_batch(columns, size, self.first_value)
+        second_values = self._determine_batch(columns, size, self.second_value)
+
+        values = None
+        batch_fn = VECTORISED_OPERATORS.get(self._operator_fn)
+        if batch_fn:
+            try:
+                values = apply_checked_ufunc(batch_fn, first_values, second_values)
+            except (TypeError, ValueError, ArithmeticError):
+                # no numpy loop for these operands (e.g. subtracting strings) or the result would differ from the
+                # Python operator (e.g. dividing by zero or integer overflow), so use the Python operator instead
+                pass
+
+        if values is None:
+            values = self._combine_by_row(self._operator_fn, as_native(first_values), as_native(second_values))
+
+        if np.ndim(values) == 0:
+            return as_column([np.asarray(values).item()] * size)
+
+        # dates are given as date objects, as from the operator
+        return as_native(values) if values.dtype.kind in "mM" else values
+
 @attr.s(kw_only=True)
 class LookupField(Field):
     """
@@ -515,6 +902,12 @@ class LookupField(Field):
     def _next_value(self, row):
         return row.get(self.field)
 
+    def _next_batch(self, columns, size):
+        if self.field not in columns:
+            return np.full(size, None, dtype=object)
+
+        return columns[self.field]
+
 
 
 def extract_number(value, row):
@@ -544,6 +937,146 @@ def extract_number(value, row):
     return float(value)
 
 
+def extract_number_batch(value, columns, size):
+    """
+    Batch version of extract_number. Fields generate a batch of values which are returned as a numeric array,
+    other values are extracted once and returned as a scalar.
+
+    :param value:
+    :param columns:
+    :param size:
+    :return:
+    """
+
+    if isinstance(value, Field):
+        values = value.next_batch(columns, size)
+        return values.astype(float) if values.dtype == object else values
+
+    return extract_number(value, {})
+
+
+def as_native(values):
+    """
+    Converts a typed numpy array (e.g. datetime64) into an object array of native Python values (e.g. date objects),
+    as used by row-based generation. Other values are returned unchanged.
+
+    :param values:
+    :return:
+    """
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return values.astype(object)
+
+    return values
+
+
+def as_temporal(values):
+    """
+    Converts date, datetime or timedelta objects (either a single value or an object array) into the equivalent numpy
+    datetime64/timedelta64 values. Other values are returned unchanged.
+
+    :param values:
+    :return:
+    """
+    if isinstance(values, np.ndarray):
+        if values.dtype != object:
+            return values
+
+        # only convert values which all have the same type, as numpy would parse strings or truncate datetimes
+        value_types = set(map(type, values.tolist())) - {type(None)}
+        if len(value_types) != 1:
+            return values
+
+        sample = next(value for value in values if value is not None)
+    else:
+        sample = values
+
+    if isinstance(sample, dt):
+        if sample.tzinfo is not None:
+            return values
+
+        dtype = "datetime64[us]"
+    elif isinstance(sample, datetime.date):
+        dtype = "datetime64[D]"
+    elif isinstance(sample, td):
+        dtype = "timedelta64[us]"
+    else:
+        return values
+
+    if isinstance(values, np.ndarray):
+        return np.array(values.tolist(), dtype=dtype)
+
+    return np.array(values, dtype=dtype)
+
+
+def apply_checked_ufunc(ufunc, first_values, second_values):
+    """
+    Applies a numpy ufunc to two operands (using apply_temporal_ufunc), raising an error wherever the result would
+    differ from the equivalent Python operator rather than the warning or wrapped around value numpy gives: dividing by
+    zero raises FloatingPointError, raising integers to negative powers raises ValueError and integer results which
+    overflow int64 raise OverflowError.
+
+    :param ufunc:
+    :param first_values:
+    :param second_values:
+    :return:
+    """
+    with np.errstate(all="raise"):
+        values = apply_temporal_ufunc(ufunc, first_values, second_values)
+
+    if ufunc in INTEGER_OVERFLOW_UFUNCS and getattr(values, "dtype", np.dtype(object)).kind in "iu":
+        # numpy integers wrap around silently, so check the size of the result using floats
+        with np.errstate(all="ignore"):
+            magnitudes = np.abs(ufunc(np.asarray(first_values, dtype=float), np.asarray(second_values, dtype=float)))
+
+        if np.any(magnitudes >= 2.0 ** 63):
+            raise OverflowError(f"Integer overflow in {ufunc.__name__}")
+
+    return values
+
+
+def apply_temporal_ufunc(ufunc, first_values, second_values):
+    """
+    Applies a numpy ufunc to two operands. If either is a typed datetime64/timedelta64 array then the other is converted
+    to match so that date arithmetic is carried out natively.
+
+    Adding or subtracting a timedelta to or from a datetime64[D] array keeps the result as whole days (like adding a
+    timedelta to a date object).
+
+    :param ufunc:
+    :param first_values:
+    :param second_values:
+    :return:
+    """
+    operands = [first_values, second_values]
+    is_typed_temporal = [isinstance(v, np.ndarray) and v.dtype.kind in "mM" for v in operands]
+
+    if not any(is_typed_temporal):
+        return ufunc(first_values, second_values)
+
+    operands = [as_temporal(v) for v in operands]
+    values = ufunc(*operands)
+
+    has_date_operand = any(getattr(v, "dtype", None) == np.dtype("datetime64[D]") for v in operands)
+    if has_date_operand and values.dtype.kind == "M":
+        values = values.astype("datetime64[D]")
+
+    return values
+
+
+def as_str_column(values):
+    """
+    Converts a batch of string values into an object array which can be concatenated element-wise. Like str.join, a
+    TypeError is raised if the values are not strings.
+
+    :param values:
+    :return:
+    """
+    if isinstance(values, dict) or values.dtype.kind not in "OU":
+        raise TypeError("expected str instances, %s found" % type(values).__name__)
+
+    return values.astype(object)
+
+
 def extract_date(value, row, date_format):
     """
     Extracts date to use for min/max or other input parameter.
@@ -572,3 +1105,37 @@ def extract_date(value, row, date_format):
     return dt.strptime(value, date_format)
 
 
+def extract_date_batch(value, columns, size, date_format):
+    """
+    Batch version of extract_date which returns dates as datetime64[D] values.
+
+    Fields generate a batch of values which is converted to a datetime64[D] array. Columns which are already typed are
+    used directly and string values are only parsed once for each distinct value. Other values are extracted once
+    and returned as a single datetime64[D] value.
+
+    :param value:
+    :param columns:
+    :param size:
+    :param date_format:
+    :return:
+    """
+
+    if value is None:
+        return None
+
+    if not isinstance(value, Field):
+        return np.datetime64(extract_date(value, {}, date_format), "D")
+
+    values = value.next_batch(columns, size)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[D]")
+
+    if values.dtype.kind == "U" or all(isinstance(v, str) for v in values):
+        unique_values, inverse = np.unique(values.astype(str), return_inverse=True)
+        parse = date_parser(date_format)
+        parsed = [parse(unique_value) for unique_value in unique_values.tolist()]
+        return np.array(parsed, dtype="datetime64[D]")[inverse.reshape(-1)]
+
+    return np.array(values.tolist(), dtype="datetime64[D]")
+
+
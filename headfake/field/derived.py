@@ -1,10 +1,11 @@
-from .core import Field, DerivedField, NumberField, BooleanField, extract_date
+from .core import Field, DerivedField, NumberField, BooleanField, extract_date, extract_date_batch
 import attr
 import datetime
+import numpy as np
 import random as rnd
 from typing import Dict, List, Any
 
-from headfake.util import calculate_age
+from headfake.util import calculate_age, calculate_ages, format_datetime64, has_time_directives
 
 
 @attr.s(kw_only=True)
@@ -35,6 +36,21 @@ class DateOfBirthField(DerivedField):
         dob = datetime.datetime.now() - datetime.timedelta(days=age_in_days)
         return dob.strftime(self.date_format)
 
+    def _next_typed_batch(self, columns, size):
+        ages_in_years = self._internal_field.next_batch(columns, size).astype(float)
+
+        age_in_us = np.round(ages_in_years * 365.25 * 86400e6).astype("timedelta64[us]")
+        dobs = np.datetime64(datetime.datetime.now(), "us") - age_in_us
+
+        if not has_time_directives(self.date_format):
+            # date only format, so the time of birth is not needed
+            return dobs.astype("datetime64[D]")
+
+        return dobs
+
+    def format_batch(self, values):
+        return format_datetime64(values, self.date_format)
+
 
 @attr.s(kw_only=True)
 class GenderField(DerivedField):
@@ -109,6 +125,7 @@ class DeceasedField(Field):
     object, a field name or a Field object.
 
     """
+    uses_typed_values = True
     deceased_true_value = attr.ib(default=1)
     deceased_false_value = attr.ib(default=0)
     dob_field: str = attr.ib()
@@ -119,6 +136,7 @@ class DeceasedField(Field):
     risk_of_death: Dict[str, str] = attr.ib()
     date_format = attr.ib()
     _risk_by_age: Dict[int, float] = attr.ib()
+    _derived_attributes = Field._derived_attributes + ("_risk_by_age",)
 
     end_date = attr.ib(default=datetime.date.today())
     end_date_format = attr.ib(default=None)
@@ -148,8 +166,9 @@ class DeceasedField(Field):
 
 
     def _next_value(self, row):
-        dob = row.get(self.dob_field)
-        dob = datetime.datetime.strptime(dob, self._dob_field.date_format).date()
+        dob = extract_date(row.get(self.dob_field), row, self._dob_field.date_format)
+        if isinstance(dob, datetime.datetime):
+            dob = dob.date()
 
         today = extract_date(self.end_date, row, self.end_date_format)
         prev_date = dob
@@ -194,6 +213,7 @@ class AgeField(Field):
     Calculates age in years from two fields or values. The specified from_value and to_value can be either strings,
     date objects or Fields. If the former, then it is treated as the name of the field to obtain from the row.
     """
+    uses_typed_values = True
     from_value = attr.ib()
     to_value = attr.ib()
     from_format = attr.ib(default=None)
@@ -203,3 +223,13 @@ class AgeField(Field):
         from_date = extract_date(self.from_value, row, self.from_format)
         to_date = extract_date(self.to_value, row, self.to_format)
         return calculate_age(from_date, to_date)
+
+    def _next_batch(self, columns, size):
+        from_dates = extract_date_batch(self.from_value, columns, size, self.from_format)
+        to_dates = extract_date_batch(self.to_value, columns, size, self.to_format)
+
+        ages = calculate_ages(from_dates, to_dates)
+        if np.ndim(ages) == 0:
+            return np.full(size, ages)
+
+        return ages
@@ -1,6 +1,10 @@
+from typing import List, Optional
+
 import attr
+import numpy as np
 
-from .core import FakerField
+from headfake.util import as_column, as_list
+from .core import FakerField, transform_column
 
 
 @attr.s(kw_only=True)
@@ -84,7 +88,8 @@ class MiddleNameField(NameField):
 @attr.s
 class AddressField(FakerField):
     """
-    Mock address line field.
+    Mock address line field. Each line is generated independently, so use AddressLinesField where the lines (and
+    postcode) need to belong to the same address.
     """
 
     line_no = attr.ib()
@@ -103,6 +108,144 @@ class AddressField(FakerField):
             return ""
 
 
+@attr.s(kw_only=True)
+class AddressLinesField(FakerField):
+    """
+    Mock whole-address field. A single coherent address is generated per row and spread across the columns named in
+    'line_fields' (unused lines are left blank and any surplus lines are folded into the last column). The field's own
+    value is the full address joined with the 'separator' (default=", ").
+
+    If a 'postcode_field' is given, that column is filled with the postcode for the address. By default this is
+    generated by faker, however if 'map_file_field' and 'postcode_lookup_field' are provided the postcode is looked up
+    from the current row of that MapFileField instead (in the same way as LookupMapFileField).
+
+    Any transformers are applied to each address line and to the postcode.
+    """
+
+    line_fields: List[str] = attr.ib()
+    separator: str = attr.ib(default=", ")
+    postcode_field: Optional[str] = attr.ib(default=None)
+    map_file_field: Optional[str] = attr.ib(default=None)
+    postcode_lookup_field: Optional[str] = attr.ib(default=None)
+    _map_file_field_obj = attr.ib(default=None)
+
+    def __attrs_post_init__(self):
+        if self.map_file_field:
+            self.generate_after = True
+
+    def init_from_fieldset(self, fieldset):
+        fieldset.field_names.extend(self.line_fields)
+
+        if self.postcode_field:
+            fieldset.field_names.append(self.postcode_field)
+
+        if not self.map_file_field:
+            return
+
+        self._map_file_field_obj = fieldset.field_map.get(self.map_file_field)
+        first_store_row = list(self._map_file_field_obj.key_field_store.values())[0]
+        if self.postcode_lookup_field not in first_store_row:
+            raise ValueError("Lookup value field  '%s' not found in file" % self.postcode_lookup_field)
+
+    def next_value(self, row):
+        try:
+            return self._next_value(row)
+        except Exception as ex:
+            if self.error_value:
+                return self.error_value
+
+            raise ex
+
+    def _next_value(self, row):
+        lines = [self._transform(row=row, value=line) for line in self._address_lines()]
+
+        value = {self.name: self.separator.join(lines)}
+
+        num_lines = len(self.line_fields)
+        if num_lines and len(lines) > num_lines:
+            lines = lines[:num_lines - 1] + [self.separator.join(lines[num_lines - 1:])]
+
+        lines += [""] * (num_lines - len(lines))
+        value.update(zip(self.line_fields, lines))
+
+        if self.postcode_field:
+            value[self.postcode_field] = self._transform(row=row, value=self._postcode(row))
+
+        return value
+
+    def _next_batch(self, columns, size):
+        addresses = []
+        postcodes = []
+        for _ in range(size):
+            addresses.append(self._address_lines())
+            if self.postcode_field and not self._map_file_field_obj:
+                postcodes.append(self._fake.postcode())
+
+        if self.postcode_field and self._map_file_field_obj:
+            map_keys = columns.get(self._map_file_field_obj.name, [None] * size)
+            postcodes = [self._lookup_postcode(map_key) for map_key in as_list(map_keys)]
+
+        if self.transformers:
+            addresses = self._transform_lines(columns, addresses)
+
+        values = {self.name: as_column([self.separator.join(lines) for lines in addresses])}
+
+        for line_no, line_field in enumerate(self.line_fields):
+            if line_no == len(self.line_fields) - 1:
+                values[line_field] = as_column([self.separator.join(lines[line_no:]) for lines in addresses])
+            else:
+                values[line_field] = as_column([lines[line_no] if line_no < len(lines) else "" for lines in addresses])
+
+        if self.postcode_field:
+            values[self.postcode_field] = self._transform_column(columns, as_column(postcodes))
+
+        return values
+
+    def _transform_batch(self, columns, values, size):
+        # the transformers have already been applied to each address line and the postcode
+        return values
+
+    def _transform_lines(self, columns, addresses):
+        """
+        Applies the transformers to the address lines a line at a time, over the rows which have that line.
+        """
+        num_lines = np.array([len(lines) for lines in addresses])
+
+        for line_no in range(num_lines.max(initial=0)):
+            mask = num_lines > line_no
+            rows = np.flatnonzero(mask)
+
+            lines = self._transform_column({name: column[mask] for name, column in columns.items()},
+                                           as_column([addresses[i][line_no] for i in rows]))
+            for i, line in zip(rows, lines.tolist()):
+                addresses[i][line_no] = line
+
+        return addresses
+
+    def _transform_column(self, columns, values):
+        if not self.transformers:
+            return values
+
+        return transform_column(self, columns, values, self.transformers)
+
+    def _address_lines(self):
+        return self._fake.street_address().split("\n") + [self._fake.city()]
+
+    def _postcode(self, row):
+        if not self._map_file_field_obj:
+            return self._fake.postcode()
+
+        return self._lookup_postcode(row.get(self._map_file_field_obj.name))
+
+    def _lookup_postcode(self, map_key):
+        map_line = self._map_file_field_obj.key_field_store.get(map_key)
+        if map_line is None:
+            raise ValueError("Key '%s' of map file field '%s' not found for the postcode of field '%s'"
+                             % (map_key, self._map_file_field_obj.name, self.name))
+
+        return map_line.get(self.postcode_lookup_field)
+
+
 @attr.s(kw_only=True)
 class PostcodeField(FakerField):
     """
@@ -2,11 +2,13 @@
 This package includes fieldset classes
 """
 
-import pandas as pd
-from headfake.field import Field, transform_value, ConstantField
+from headfake.field import Field, transform_column, ConstantField, as_native
+from headfake.util import BatchColumns
 
 import logging
 
+DEFAULT_CHUNK_SIZE = 10000
+
 def is_field_shown(field):
     if isinstance(field, Field):
         return not field.hidden
@@ -75,64 +77,104 @@ class Fieldset:
 
         return field.get("name")
 
-    def _build_generation_functions(self):
+    def _build_generation_fields(self):
         """
-        Build list of field generation functions with those which need to run after all other functions to the end.
+        Build list of fields in generation order with those which need to run after all other fields moved to the end.
         """
 
-        generation_funcs = []
-        after_funcs = []
+        generation_fields = []
+        after_fields = []
         for field in self.fields:
             if field.generate_after is True:
-                after_funcs.append((field.name, field.next_value))
+                after_fields.append(field)
             else:
-                generation_funcs.append((field.name, field.next_value))
+                generation_fields.append(field)
 
+        generation_fields.extend(after_fields)
 
-        generation_funcs.extend(after_funcs)
+        return generation_fields
 
-        return generation_funcs
+    def _generate_columns(self, generation_fields, num_rows, typed=False):
+        """
+        Generate column values by i) asking each field in turn for a batch of values covering every row and ii)
+        removing hidden fields from the columns.
 
-    def _build_final_transformer_functions(self):
-        final_transform_fn_by_name = {}
+        Fields which have typed values (e.g. dates) keep them unformatted until a field which needs the formatted
+        values is generated or the columns are output, so fields which use the typed values (e.g. AgeField) do not
+        need to parse them. Hidden fields only used in this way are never formatted.
 
-        for field in self.fields:
-            if field.final_transformers and not field.hidden:
-                final_transform_fn_by_name[field.name] = partial(transform_value, field=field,
-                                                                 transformers=field.final_transformers)
-        return final_transform_fn_by_name
+        Args:
+            generation_fields: fields in generation order
+            num_rows: number of rows to generate
+            typed: whether shown fields with typed values (and no final transformers) are output unformatted
 
-    def _generate_row(self, generation_funcs, hidden_fields, final_transform_fn_by_name):
+        Returns:
+            Dictionary of generated column arrays for the fields which are shown
         """
-        Generate row values by i) iterating through generation functions for each row, ii) removing hidden fields from
-        row and iii) iterating through final transformer functions
+        columns = BatchColumns(num_rows)
+        typed_columns = {}
+        typed_fields = []
+        unformatted_fields = []
+
+        for field in generation_fields:
+            if field.uses_typed_values:
+                field_columns = {**columns, **typed_columns}
+            else:
+                self._format_typed_columns(columns, typed_columns, unformatted_fields)
+                field_columns = columns
 
+            if field.has_typed_values():
+                typed_columns[field.name] = field.next_typed_batch(field_columns, num_rows)
+                typed_fields.append(field)
+                unformatted_fields.append(field)
+                continue
 
-        Args:
-            generation_funcs:
-            hidden_fields:
-            final_transform_fn_by_name:
+            values = field.next_batch(field_columns, num_rows)
+            if isinstance(values, dict):
+                columns.update(values)
+            else:
+                columns[field.name] = values
 
-        Returns:
-            Dictionary of generated field values
+        shown_fields = [field for field in unformatted_fields if field.name in self.field_names]
+        if typed:
+            # the final transformers act on the formatted values
+            for field in typed_fields:
+                if field.name in self.field_names and not field.final_transformers:
+                    columns[field.name] = as_native(typed_columns[field.name])
+
+            shown_fields = [field for field in shown_fields if field.final_transformers]
+
+        self._format_typed_columns(columns, typed_columns, shown_fields)
 
+        return {name: columns[name] for name in self.field_names if name in columns}
+
+    @staticmethod
+    def _format_typed_columns(columns, typed_columns, unformatted_fields):
         """
-        row = {}
-        for field_name, generate_fn in generation_funcs:
-            next_val = generate_fn(row)
-            if isinstance(next_val, dict):
-                row.update(next_val)
-            else:
-                row[field_name] = next_val
+        Formats typed columns into the generated columns, emptying the list of unformatted fields.
+        """
+        for field in unformatted_fields:
+            columns[field.name] = field.format_batch(typed_columns[field.name])
 
-        for hidden in hidden_fields:
-            del (row[hidden])
+        unformatted_fields.clear()
 
-        for field_name, final_transformer_fn in final_transform_fn_by_name.items():
-            row[field_name] = final_transformer_fn(row=row, value=row[field_name])
+    def _apply_final_transformers(self, columns, num_rows):
+        """
+        Run the final transformers for each shown field as a single pass over its whole column. Each field sees the
+        rows as left by the final transformers of the fields before it.
 
-        logging.info(f"row:{row}")
-        return row
+        Args:
+            columns: Dictionary of generated column arrays
+            num_rows: number of rows in the columns
+
+        Returns:
+            None
+        """
+        for field in self.fields:
+            if not field.final_transformers or field.hidden:
+                continue
+
+            columns[field.name] = transform_column(field, columns, columns[field.name], field.final_transformers)
 
     def generate_data(self, num_rows):
         """
@@ -145,20 +187,42 @@ class Fieldset:
             a pandas dataframe
 
         """
-        generation_funcs = self._build_generation_functions()
+        dataset = self._generate_dataframe(num_rows)
+
+        logging.info(f"dataset:{dataset}")
+        return dataset
+
+    def generate_chunks(self, num_rows, chunk_size=DEFAULT_CHUNK_SIZE, typed=False):
+        """
+        Generates data in chunks of up to chunk_size rows, so that large datasets can be written without holding all
+        of the rows in memory. Values continue from one chunk to the next (e.g. IDs carry on incrementing) and the
+        index of each chunk follows on from the previous one.
 
-        hidden_fields = list([f.name for f in filter(lambda x: x.hidden, self.fields)])
-        final_transform_fn_by_name = self._build_final_transformer_functions()
+        Args:
+            num_rows: total number of rows to generate
+            chunk_size: maximum number of rows in each chunk
+            typed: whether fields with typed values give them as Python objects (e.g. dates) rather than formatting
+            them, for outputs which store the types (e.g. ParquetFileOutput)
 
-        data_rows = []
-        for i in range(num_rows):
-            row = self._generate_row(generation_funcs, hidden_fields, final_transform_fn_by_name)
+        Returns:
+            a generator of pandas dataframes
+        """
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1 (not {chunk_size})")
 
-            data_rows.append(row)
+        for start in range(0, num_rows, chunk_size):
+            yield self._generate_dataframe(min(chunk_size, num_rows - start), start, typed)
 
-        dataset = pd.DataFrame.from_records(data=data_rows, columns=self.field_names, index=None)
+    def _generate_dataframe(self, num_rows, start=0, typed=False):
+        """
+        Generates a dataframe of num_rows with an index beginning at start.
+        """
+        import pandas as pd
 
-        logging.info(f"dataset:{dataset}")
-        return dataset
+        generation_fields = self._build_generation_fields()
+
+        columns = self._generate_columns(generation_fields, num_rows, typed)
+        self._apply_final_transformers(columns, num_rows)
 
-from functools import partial
+        index = pd.RangeIndex(start, start + num_rows)
+        return pd.DataFrame(columns, columns=self.field_names, index=index).infer_objects()
@@ -3,15 +3,19 @@ This file implements the HeadFake public API
 """
 
 import random
+import sys
 import yaml
 import json
 import numpy as np
 
-from faker import Faker
-
+from headfake.fieldset import DEFAULT_CHUNK_SIZE
+from headfake.output import BackgroundWriter
 from headfake.util import create_class_tree, locate_file
 
 
+DEFAULT_QUEUE_SIZE = 2
+
+
 class HeadFake:
     """
     Provides the core logic as a class which has an input a parameter dictions.
@@ -20,6 +24,9 @@ class HeadFake:
 
     locale = "en_GB"
     field_count = 0
+    # seed to apply to faker when it is first imported (it is only imported by templates with faker-based fields)
+    _faker_seed = None
+
     def __init__(self, params, seed=None):
         """
         Creates an instance of the HeadFake object
@@ -32,40 +39,96 @@ class HeadFake:
         self.fieldset = self._create_fieldset(params)
 
     @staticmethod
-    def from_yaml(filename, **kwargs):
+    def from_yaml(filename, cache=None, **kwargs):
         """
         Create an instance of the HeadFake class with parameters loaded from a .yaml file
 
         Args:
             filename: name of yaml template
+            cache: optional TemplateCache to load the compiled template from (or store it in)
             **kwargs: additional arguments passed to HeadFake constructor
 
         Returns:
             a HeadFake instance
 
         """
-        path = locate_file(filename)
-        with open(path) as file:
-            params = yaml.safe_load(file)
-        return HeadFake(params, **kwargs)
+        return HeadFake._from_file(filename, yaml.safe_load, cache, **kwargs)
 
     @staticmethod
-    def from_json(filename, **kwargs):
+    def from_json(filename, cache=None, **kwargs):
         """
         Create an instance of the HeadFake class with parameters loaded from a json file
 
         Args:
             filename: name of json template
+            cache: optional TemplateCache to load the compiled template from (or store it in)
             **kwargs: additional arguments passed to HeadFake constructor
 
         Returns:
             a HeadFake instance
 
+        """
+        return HeadFake._from_file(filename, json.load, cache, **kwargs)
+
+    @staticmethod
+    def _from_file(filename, load, cache=None, **kwargs):
+        """
+        Create an instance of the HeadFake class with parameters loaded from a file, using the compiled template from
+        the cache if there is one. Otherwise the template is compiled and stored in the cache.
+
+        Args:
+            filename: name of template
+            load: function loading the parameters from an open file
+            cache: optional TemplateCache
+            **kwargs: additional arguments passed to HeadFake constructor (and used in the cache key)
+
+        Returns:
+            a HeadFake instance
+
         """
         path = locate_file(filename)
+        seed = kwargs.get("seed")
+
+        if cache is not None:
+            key = cache.key(path, locale=HeadFake.locale, **kwargs)
+
+            # the seed is set first, so that anything rebuilt as the fieldset is unpickled (e.g. Faker) is seeded
+            HeadFake.set_seed(seed)
+            entry = cache.get(key)
+            if entry is not None:
+                return HeadFake._from_cache_entry(entry, seed)
+
         with open(path) as file:
-            params = json.loads(file)
-        return HeadFake(params, **kwargs)
+            params = load(file)
+
+        headfake = HeadFake(params, **kwargs)
+
+        if cache is not None:
+            from headfake.cache import find_template_files
+
+            entry = {"fieldset": headfake.fieldset}
+            if seed is not None:
+                entry["random_state"] = random.getstate()
+                entry["np_random_state"] = np.random.get_state()
+
+            cache.put(key, entry, find_template_files(params))
+
+        return headfake
+
+    @staticmethod
+    def _from_cache_entry(entry, seed):
+        """
+        Create an instance of the HeadFake class from a cached compiled template, restoring the random number generators
+        to the state they were in after compiling it with the same seed.
+        """
+        headfake = HeadFake.__new__(HeadFake)
+        headfake.fieldset = entry["fieldset"]
+
+        if seed is not None:
+            random.setstate(entry["random_state"])
+            np.random.set_state(entry["np_random_state"])
+
+        return headfake
 
     @staticmethod
     def from_python(class_tree, **kwargs):
@@ -112,7 +175,64 @@ class HeadFake:
 
         random.seed(seed)
         np.random.seed(seed)
-        Faker.seed(seed)
+
+        if "faker" in sys.modules:
+            sys.modules["faker"].Faker.seed(seed)
+        else:
+            HeadFake._faker_seed = seed
+
+    @staticmethod
+    def get_random_state():
+        """
+        Get the state of the random number generators used to generate data (random, numpy and faker, if it has been
+        imported), so that generation can be paused and later resumed with set_random_state
+
+        Returns:
+            the random state
+
+        """
+        faker_generator = sys.modules.get("faker.generator")
+        faker_state = faker_generator.random.getstate() if faker_generator else None
+
+        return random.getstate(), np.random.get_state(), faker_state
+
+    @staticmethod
+    def set_random_state(state):
+        """
+        Restore the state of the random number generators from get_random_state
+
+        Args:
+            state: the random state
+
+        Returns:
+            None
+
+        """
+        random_state, np_random_state, faker_state = state
+
+        random.setstate(random_state)
+        np.random.set_state(np_random_state)
+
+        if faker_state is not None:
+            sys.modules["faker.generator"].random.setstate(faker_state)
+
+    @classmethod
+    def create_faker(cls):
+        """
+        Create a Faker instance for the current locale, importing faker (and applying any seed set before it was
+        imported) the first time it is needed
+
+        Returns:
+            a Faker instance
+
+        """
+        import faker
+
+        if HeadFake._faker_seed is not None:
+            faker.Faker.seed(HeadFake._faker_seed)
+            HeadFake._faker_seed = None
+
+        return faker.Faker(cls.locale)
 
 
     @classmethod
@@ -160,6 +280,85 @@ class HeadFake:
 
         return self.fieldset.generate_data(num_rows)
 
+    def generate_chunks(self, num_rows=1, chunk_size=DEFAULT_CHUNK_SIZE, typed=False):
+        """
+        Generate fake data in chunks based on the parameters specified in the constructor. This keeps memory use
+        bounded by the chunk size, and the chunks can be written as they are generated (e.g. using an output's
+        write_chunks method).
+
+        Args:
+            num_rows: total number of rows to generate
+            chunk_size: maximum number of rows in each chunk
+            typed: whether date fields give dates rather than formatted values (for outputs which store dates, e.g.
+            ParquetFileOutput)
+
+        Returns:
+            a generator of pandas dataframes
+        """
+
+        return self.fieldset.generate_chunks(num_rows, chunk_size, typed)
+
+    async def agenerate_chunks(self, num_rows=1, chunk_size=DEFAULT_CHUNK_SIZE, executor=None):
+        """
+        Generate fake data in chunks without blocking the asyncio event loop. Each chunk is generated in an executor,
+        and the next chunk is generated while the previous one is being consumed. If the iteration is cancelled or
+        closed early, the chunk being prefetched is cancelled (or discarded if it has started).
+
+        The random number generators are shared, so a seeded template only generates the same data as
+        generate_chunks when nothing else uses them at the same time (e.g. another agenerate_chunks).
+
+        Args:
+            num_rows: total number of rows to generate
+            chunk_size: maximum number of rows in each chunk
+            executor: concurrent.futures executor to generate the chunks in (by default the event loop's executor)
+
+        Returns:
+            an async generator of pandas dataframes
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        chunks = self.generate_chunks(num_rows, chunk_size)
+
+        # chunks are only requested once the previous one has been generated, so the generator is never run by two
+        # threads at the same time, even in an executor with several threads
+        future = loop.run_in_executor(executor, next, chunks, None)
+        try:
+            while True:
+                chunk = await future
+                if chunk is None:
+                    break
+
+                future = loop.run_in_executor(executor, next, chunks, None)
+                yield chunk
+        finally:
+            # a chunk which is already being generated cannot be interrupted, but its result is discarded
+            future.cancel()
+
+    def write(self, outfile, num_rows=1, chunk_size=DEFAULT_CHUNK_SIZE, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Generate fake data in chunks and write it to an output. The chunks are written in a background thread while
+        the next chunks are generated, with up to queue_size chunks waiting to be written.
+
+        Args:
+            outfile: output to write the data to (e.g. a headfake.output.CsvFileOutput)
+            num_rows: total number of rows to generate
+            chunk_size: maximum number of rows in each chunk
+            queue_size: maximum number of chunks waiting to be written (if 0 the chunks are written as they are
+            generated, without a background thread)
+
+        Returns:
+            None
+        """
+
+        outfile.init_from_fieldset(self.fieldset)
+        chunks = self.generate_chunks(num_rows, chunk_size, outfile.uses_typed_values)
+
+        if queue_size < 1:
+            outfile.write_chunks(chunks)
+        else:
+            BackgroundWriter(outfile, queue_size).write_chunks(chunks)
+
 class PyHeadFake(HeadFake):
     def _create_fieldset(self, params):
         """
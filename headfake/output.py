@@ -1,11 +1,41 @@
 from abc import ABC, abstractmethod
 
+import bz2
+import collections
+import concurrent.futures
+import copy
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+import itertools
+import queue
+import re
+import sqlite3
+import struct
+import sys
+import threading
+from functools import partial, lru_cache
+
+import numpy as np
+
+from headfake.transformer import DATE_MEMO_SIZE, IntermittentBlanks
+from headfake.util import import_optional, locate_file, date_parser
+
 
 class Output(ABC):
     """
     Base output class.
     """
 
+    # whether the output is given the values of fields with typed values (e.g. dates) before they are formatted, so
+    # that it can store them in their own type
+    uses_typed_values = False
+
     @abstractmethod
     def write(self, dataframe):
         """
@@ -15,6 +45,459 @@ class Output(ABC):
         """
         pass
 
+    def init_from_fieldset(self, fieldset):
+        """
+        Called with the fieldset which generates the data before anything is written, so that outputs which depend on
+        the fields (e.g. to map them into another structure) can set themselves up.
+        :param fieldset: the Fieldset
+        :return:
+        """
+        pass
+
+    def write_chunks(self, chunks):
+        """
+        Writes data generated in chunks (e.g. using HeadFake.generate_chunks) to the output. By default the chunks are
+        joined into a single dataframe and passed to write.
+        :param chunks: iterable of dataframes
+        :return:
+        """
+        import pandas as pd
+
+        self.write(pd.concat(list(chunks)))
+
+
+class ChunkedOutput(Output):
+    """
+    Base output which writes data a chunk at a time, so that memory use is bounded by the size of each chunk rather than
+    the whole dataset.
+    """
+
+    def open(self):
+        """
+        Prepares the output before the first chunk is written.
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def write_chunk(self, dataframe):
+        """
+        Writes a single chunk of data to the output.
+        :param dataframe:
+        :return:
+        """
+        pass
+
+    def close(self):
+        """
+        Finishes the output after the last chunk has been written.
+        :return:
+        """
+        pass
+
+    def abort(self):
+        """
+        Cleans up the output if an error occurs while generating or writing the chunks, or while closing the output.
+        By default the output is closed.
+        :return:
+        """
+        self.close()
+
+    def write(self, dataframe):
+        self.write_chunks([dataframe])
+
+    def write_chunks(self, chunks):
+        self.open()
+        try:
+            for chunk in chunks:
+                self.write_chunk(chunk)
+
+            self.close()
+        except BaseException:
+            # also release anything left open if closing fails (e.g. writing the footer to a full disk)
+            self.abort()
+            raise
+
+
+class BackgroundWriter(Output):
+    """
+    Writes chunks to another output in a background thread, so that generating the next chunks overlaps with writing
+    the previous ones. The chunks are passed to the thread through a queue holding at most queue_size chunks, which
+    blocks generation if writing falls behind and so bounds memory use.
+
+    If writing fails, generation is stopped and the error raised. If generation fails, the output is aborted (see
+    ChunkedOutput.abort) and the generation error raised.
+    """
+
+    def __init__(self, output, queue_size=2):
+        """
+        :param output: output to write the chunks to
+        :param queue_size: maximum number of generated chunks waiting to be written
+        """
+        self.output = output
+        self.queue_size = queue_size
+
+    def init_from_fieldset(self, fieldset):
+        self.output.init_from_fieldset(fieldset)
+
+    def write(self, dataframe):
+        self.output.write(dataframe)
+
+    def write_chunks(self, chunks):
+        self.start()
+
+        try:
+            for chunk in chunks:
+                self.put(chunk)
+        except BaseException as ex:
+            if ex is not self._error:
+                # let the output clean up (e.g. roll back) before raising the generation error
+                self.fail(ex)
+
+            raise
+
+        self.finish()
+
+    def start(self):
+        """
+        Starts the background thread, which writes chunks as they are added using put.
+        """
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._write, name="headfake-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, chunk):
+        """
+        Adds a chunk to be written, waiting while the queue is full. Raises the error if writing has failed.
+        """
+        self._put(chunk)
+
+    def finish(self):
+        """
+        Waits for the remaining chunks to be written and the output to be closed. Raises the error if writing has
+        failed.
+        """
+        self._put(None)
+        self._thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def fail(self, error):
+        """
+        Stops writing because generating the chunks has failed, waiting for the output to be aborted.
+        """
+        if not self._thread.is_alive():
+            return
+
+        self._put(GenerationFailed(error))
+        self._thread.join()
+
+    def _put(self, item):
+        """
+        Adds an item to the queue, waiting while it is full unless the writing thread has stopped (e.g. due to an
+        error).
+        """
+        while True:
+            if not self._thread.is_alive():
+                raise self._error or RuntimeError("The background writer stopped unexpectedly")
+
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _write(self):
+        try:
+            self.output.write_chunks(self._queued_chunks())
+        except BaseException as ex:
+            self._error = ex
+
+    def _queued_chunks(self):
+        """
+        Yields chunks from the queue until the end (None) or an error in generation.
+        """
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+
+            if isinstance(chunk, GenerationFailed):
+                raise chunk
+
+            yield chunk
+
+
+class GenerationFailed(Exception):
+    """
+    Raised in the background writer when generating the chunks has failed.
+    """
+
+
+DEFAULT_MAX_PARTITIONS = 256
+
+
+class PartitionedOutput(ChunkedOutput):
+    """
+    Output generated data for a single fieldset split across several files, each written by its own output (of class
+    output_class) in a background thread so that the partitions are written in parallel.
+
+    The data is split either into files of up to options.partition_rows rows, or by the value of the field named in
+    options.partition_by. If options.partition_count is also given, the values are hashed into that many partitions.
+    The partition files are named after the output file (options.output_file), e.g. data-00000.csv for row partitions,
+    data-gender=M.csv for value partitions and data-gender-00003.csv for hashed partitions. Values which are missing or
+    not safe to use in a file name (or whose safe name is already used by another value) have a short hash of the value
+    added to the name, so every value has its own file.
+
+    Value and hashed partitions are kept open until all of the data has been written, each with its own file and
+    background thread, so there can be at most options.max_partitions of them (default 256). A ValueError is raised if
+    a field has more values than this, in which case partition_count can be used to hash them into fewer files.
+
+    Once all of the data has been written, a manifest listing each file with its partition and row count is written
+    alongside (e.g. data.manifest.json).
+    """
+
+    def __init__(self, options, output_class):
+        """
+        Setup output with appropriate options.
+        :param options: Arguments dictionary
+        :param output_class: Output class used to write each partition
+        """
+        self.options = options
+        self.output_class = output_class
+        self.output_file = options.output_file
+        self.partition_rows = getattr(options, "partition_rows", None)
+        self.partition_by = getattr(options, "partition_by", None)
+        self.partition_count = getattr(options, "partition_count", None)
+        self.max_partitions = getattr(options, "max_partitions", None) or DEFAULT_MAX_PARTITIONS
+        self.queue_size = getattr(options, "queue_size", None) or 2
+
+        if bool(self.partition_rows) == bool(self.partition_by):
+            raise ValueError("Either partition_rows or partition_by should be set for partitioned output")
+
+        if self.partition_count and self.partition_count > self.max_partitions:
+            raise ValueError(f"partition_count ({self.partition_count}) is more than max_partitions "
+                             f"({self.max_partitions})")
+
+        self._writers = {}
+        self._partitions = []
+        self._row_partition = 0
+        self._rows_in_partition = 0
+        self._fieldset = None
+        self._executor = None
+
+    @property
+    def uses_typed_values(self):
+        return self.output_class.uses_typed_values
+
+    def init_from_fieldset(self, fieldset):
+        self._fieldset = fieldset
+
+    def open(self):
+        self._writers = {}
+        self._partitions = []
+        self._row_partition = 0
+        self._rows_in_partition = 0
+
+        # the partitions share one pool of worker processes, rather than each starting its own
+        workers = getattr(self.options, "workers", None) or 1
+        if workers > 1 and issubclass(self.output_class, StreamOutput):
+            self._executor = create_process_pool(workers)
+
+    def write_chunk(self, dataframe):
+        if self.partition_rows:
+            self._write_row_partitions(dataframe)
+            return
+
+        values = dataframe[self.partition_by]
+        if self.partition_count:
+            import pandas as pd
+
+            values = pd.util.hash_pandas_object(values.astype(str), index=False) % self.partition_count
+
+        for key, part in dataframe.groupby(values.to_numpy(), sort=False, dropna=False):
+            self._writer(key).put(part)
+
+    def close(self):
+        errors = []
+        for key in list(self._writers):
+            try:
+                self._finish(key)
+            except Exception as ex:
+                errors.append(ex)
+
+        self._shutdown_executor()
+
+        if errors:
+            raise errors[0]
+
+        self._write_manifest()
+
+    def abort(self):
+        for writer, _ in self._writers.values():
+            writer.fail(GenerationFailed("Generating the partitioned data failed"))
+
+        self._writers = {}
+        self._shutdown_executor()
+
+    def _shutdown_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _write_row_partitions(self, dataframe):
+        """
+        Splits the chunk at partition_rows boundaries, finishing each partition file once it is full.
+        """
+        start = 0
+        while start < len(dataframe):
+            part = dataframe.iloc[start:start + self.partition_rows - self._rows_in_partition]
+            self._writer(self._row_partition).put(part)
+            self._rows_in_partition += len(part)
+            start += len(part)
+
+            if self._rows_in_partition == self.partition_rows:
+                self._finish(self._row_partition)
+                self._row_partition += 1
+                self._rows_in_partition = 0
+
+    def _writer(self, key):
+        """
+        Gets the background writer for a partition, starting it if needed.
+        """
+        if key not in self._writers:
+            if len(self._writers) >= self.max_partitions:
+                raise ValueError(f"Field '{self.partition_by}' has more than {self.max_partitions} values to partition "
+                                 f"by (use partition_count to hash the values into fewer files or raise max_partitions)")
+
+            options = copy.copy(self.options)
+            options.output_file = self._partition_file(key)
+            options.executor = self._executor
+
+            writer = BackgroundWriter(RowCountingOutput(self.output_class(options)), self.queue_size)
+            if self._fieldset is not None:
+                writer.init_from_fieldset(self._fieldset)
+
+            writer.start()
+
+            self._writers[key] = (writer, options.output_file)
+
+        return self._writers[key][0]
+
+    def _finish(self, key):
+        writer, output_file = self._writers.pop(key)
+        writer.finish()
+
+        self._partitions.append({
+            "file": os.path.basename(output_file),
+            "partition": as_manifest_key(key),
+            "rows": writer.output.row_count
+        })
+
+    def _partition_file(self, key):
+        """
+        Gets the file name for a partition from the output file name.
+        """
+        filename, extension = split_extension(self.output_file)
+
+        if self.partition_rows:
+            return f"{filename}-{key:05d}{extension}"
+
+        if self.partition_count:
+            return f"{filename}-{safe_file_part(self.partition_by)}-{key:05d}{extension}"
+
+        value = as_manifest_key(key)
+        value_part = safe_file_part(value)
+        if value is None or value_part != str(value) or self._is_file_used(value_part):
+            # keep the names of different values apart when they are changed to be safe (e.g. "a/b" and "a_b")
+            value_part += "-" + hashlib.sha1(repr(value).encode("utf-8")).hexdigest()[:8]
+
+        return f"{filename}-{safe_file_part(self.partition_by)}={value_part}{extension}"
+
+    def _is_file_used(self, value_part):
+        filename, extension = split_extension(self.output_file)
+        output_file = f"{filename}-{safe_file_part(self.partition_by)}={value_part}{extension}"
+
+        return any(file == output_file for _, file in self._writers.values()) \
+            or any(partition["file"] == os.path.basename(output_file) for partition in self._partitions)
+
+    def _write_manifest(self):
+        filename, _ = split_extension(self.output_file)
+
+        manifest = {
+            "partition_rows": self.partition_rows,
+            "partition_by": self.partition_by,
+            "partition_count": self.partition_count,
+            "total_rows": sum(partition["rows"] for partition in self._partitions),
+            "files": sorted(self._partitions, key=lambda partition: partition["file"])
+        }
+
+        with open(f"{filename}.manifest.json", "w") as fh:
+            json.dump(manifest, fh, indent=2, allow_nan=False)
+
+
+class RowCountingOutput(Output):
+    """
+    Passes chunks through to another output, counting the rows written.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.row_count = 0
+
+    def init_from_fieldset(self, fieldset):
+        self.output.init_from_fieldset(fieldset)
+
+    def write(self, dataframe):
+        self.write_chunks([dataframe])
+
+    def write_chunks(self, chunks):
+        self.output.write_chunks(self._count_rows(chunks))
+
+    def _count_rows(self, chunks):
+        for chunk in chunks:
+            yield chunk
+            self.row_count += len(chunk)
+
+
+def split_extension(output_file):
+    """
+    Splits an output file name into the name and extension, keeping any compression extension with the format one
+    (e.g. "data" and ".csv.gz").
+    """
+    filename, extension = os.path.splitext(output_file)
+    if extension.lower() in COMPRESSION_EXTENSIONS:
+        filename, format_extension = os.path.splitext(filename)
+        extension = format_extension + extension
+
+    return filename, extension
+
+
+def safe_file_part(value):
+    """
+    Replaces characters which should not be used in file names.
+    """
+    return re.sub(r"[^\w.-]", "_", str(value))
+
+
+def as_manifest_key(key):
+    """
+    Converts a partition key into a JSON value for the manifest.
+    """
+    if isinstance(key, np.generic):
+        key = key.item()
+
+    if isinstance(key, float) and not math.isfinite(key):
+        # missing values (None or NaN) are grouped as NaN, and JSON has no infinity
+        return None if math.isnan(key) else str(key)
+
+    if isinstance(key, (str, int, float, bool)) or key is None:
+        return key
+
+    return str(key)
+
 
 class FileOutput(Output):
     """
@@ -33,10 +516,10 @@ class FileOutput(Output):
         pass
 
 
-class CsvFileOutput(Output):
+class JsonFileOutput(Output):
     """
-    Output generated mock data for a single fieldset to a CSV file specified in the
-    options (output_file)
+    Output generated data for a single fieldset to a JSON text file specified in the options (output_file). The whole
+    dataset is written as a single JSON document; JsonLinesOutput can be used to stream rows instead.
     """
 
     def __init__(self, options):
@@ -47,29 +530,1637 @@ class CsvFileOutput(Output):
         self.output_file = options.output_file
 
     def write(self, dataframe):
-        dataframe.to_csv(self.output_file)
+        dataframe.to_json(self.output_file)
 
 
-class JsonFileOutput(Output):
+class StreamOutput(ChunkedOutput):
     """
-    Output generated data for a single fieldset to a JSON text file specified in the options (output_file)
+    Base output which streams chunks of data to a file specified in the options (output_file) or to STDOUT if there is
+    no output file. Chunks are formatted into bytes by format_chunk and written to a binary handle with a large buffer.
+    A header (from format_header) is written before the first chunk, or from the fields of the fieldset if there are
+    no chunks. The formatting methods (format_header, format_chunk, format_footer and format_empty) can also be used
+    without opening the output, to send the formatted data elsewhere (e.g. to the clients of GenerationServer).
+
+    The data can be compressed with gzip, bz2 or zstd, as given in the options (compress) or by the extension of the
+    output file (e.g. ".csv.gz"). Compression runs in a background thread so that it overlaps with generating and
+    formatting the data.
+
+    If options.workers is more than 1, chunks are formatted in a pool of that many processes and written in the order
+    they were generated, so the output is the same as formatting them one at a time. A pool shared with other outputs
+    can be given as options.executor (e.g. by PartitionedOutput), in which case it is left running when the output is
+    closed.
     """
+    encoding = "utf-8"
+    buffer_size = 1024 * 1024
 
     def __init__(self, options):
         """
         Setup output with appropriate options.
         :param options: Arguments dictionary
         """
-        self.output_file = options.output_file
+        self.output_file = getattr(options, "output_file", None)
+        self.compression = getattr(options, "compress", None) or infer_compression(self.output_file)
+        self.workers = getattr(options, "workers", None) or 1
+        self._shared_executor = getattr(options, "executor", None)
+        self._handle = None
+        self._raw_handle = None
+        self._header_written = False
+        self._field_names = None
+        self._executor = None
+        self._pending = collections.deque()
 
-    def write(self, dataframe):
-        dataframe.to_json(self.output_file)
+    def init_from_fieldset(self, fieldset):
+        self._field_names = list(fieldset.field_names)
+
+    def __getstate__(self):
+        # only the formatting settings are needed to format chunks in worker processes
+        state = self.__dict__.copy()
+        for name in ("_handle", "_raw_handle", "_executor", "_shared_executor", "_pending"):
+            state.pop(name, None)
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._handle = None
+        self._raw_handle = None
+        self._executor = None
+        self._shared_executor = None
+        self._pending = collections.deque()
+
+    def open(self):
+        if self.output_file:
+            self._raw_handle = self._open_file()
+        else:
+            self._raw_handle = sys.stdout.buffer
+
+        if self.compression:
+            self._handle = CompressedWriter(self._raw_handle, self.compression)
+        else:
+            self._handle = self._raw_handle
+
+        self._header_written = False
+
+        if self.workers > 1:
+            self._executor = self._shared_executor or create_process_pool(self.workers)
+            self._pending = collections.deque()
+
+    def write_chunk(self, dataframe):
+        if not self._header_written:
+            self._handle.write(self.format_header(dataframe))
+            self._header_written = True
+
+        if self._executor is None:
+            self._write_formatted(self.format_chunk(dataframe))
+            return
+
+        self._pending.append(self._executor.submit(self.format_chunk, dataframe))
+
+        # keep every worker busy, with a bounded number of formatted chunks waiting to be written
+        while len(self._pending) > self.workers * 2:
+            self._write_formatted(self._pending.popleft().result())
+
+    def _write_formatted(self, data):
+        self._handle.write(data)
+
+        if not self.output_file:
+            # flush so that whatever reads STDOUT can start on each chunk straight away
+            self._handle.flush()
 
+    def close(self):
+        if self._handle is None:
+            return
 
-class StdoutOutput(FileOutput):
+        while self._pending:
+            self._write_formatted(self._pending.popleft().result())
+
+        if self._header_written:
+            self._handle.write(self.format_footer())
+        else:
+            self._handle.write(self.format_empty())
+
+        self.abort()
+
+    def abort(self):
+        if self._executor is not None:
+            for future in self._pending:
+                future.cancel()
+
+            if self._executor is not self._shared_executor:
+                self._executor.shutdown()
+
+            self._executor = None
+            self._pending.clear()
+
+        if self._handle is None:
+            return
+
+        try:
+            if self._handle is not self._raw_handle:
+                self._handle.close()
+        finally:
+            if self.output_file:
+                self._raw_handle.close()
+            else:
+                self._raw_handle.flush()
+
+            self._handle = None
+            self._raw_handle = None
+
+    def _open_file(self):
+        """
+        Opens the output file for writing.
+        :return: binary handle
+        """
+        return open(self.output_file, "wb", buffering=self.buffer_size)
+
+    def format_header(self, dataframe):
+        """
+        Formats the header written before the first chunk.
+        :param dataframe: the first chunk
+        :return: bytes
+        """
+        return b""
+
+    def format_footer(self):
+        """
+        Formats the footer written after the last chunk (if any chunks were written).
+        :return: bytes
+        """
+        return b""
+
+    def format_empty(self):
+        """
+        Formats the output when no rows were generated: the header (e.g. the CSV column names) and footer for the fields
+        of the fieldset, or nothing if the fieldset is not known.
+        :return: bytes
+        """
+        if self._field_names is None:
+            return b""
+
+        import pandas as pd
+
+        return self.format_header(pd.DataFrame(columns=self._field_names)) + self.format_footer()
+
+    @abstractmethod
+    def format_chunk(self, dataframe):
+        """
+        Formats a chunk of data for the output.
+        :param dataframe:
+        :return: bytes
+        """
+        pass
+
+
+def create_process_pool(workers):
     """
-    Output generated data for a single fieldset to the console/STDOUT as CSV data
+    Creates a pool of processes for formatting chunks. The chunks are submitted from writer threads (e.g. in a
+    BackgroundWriter) while other threads are running, so the processes are started by a fork server (or spawned where
+    that is not available) rather than forked from this process, which could copy locks held by the other threads.
+    :param workers: number of processes
+    :return: ProcessPoolExecutor
     """
+    import multiprocessing
 
-    def write(self, dataframe):
-        print(dataframe.to_csv(index=False))
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method))
+
+
+class CompressedWriter:
+    """
+    Binary file-like object which compresses the data written to it into another binary handle. The compression is done
+    in a background thread, fed through a bounded queue, so that it overlaps with whatever is producing the data.
+    Errors in the thread are raised on the next write or on close.
+    """
+
+    def __init__(self, handle, compression, queue_size=8):
+        """
+        :param handle: binary handle to write the compressed data to (it is not closed by this object)
+        :param compression: gzip, bz2 or zstd
+        :param queue_size: maximum number of writes waiting to be compressed
+        """
+        self._compressor = open_compressor(handle, compression)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._compress, name="headfake-compress", daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+
+        self._queue.put(data)
+
+    def flush(self):
+        # compressed data is only complete once closed, so there is nothing useful to flush
+        pass
+
+    def close(self):
+        if self._thread is None:
+            return
+
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+        if self._error is not None:
+            raise self._error
+
+    def _compress(self):
+        try:
+            data = self._queue.get()
+            while data is not None:
+                self._compressor.write(data)
+                data = self._queue.get()
+
+            self._compressor.close()
+        except Exception as ex:
+            self._error = ex
+
+            # keep taking writes so that the writing thread is never blocked by a full queue
+            while data is not None:
+                data = self._queue.get()
+
+
+def open_compressor(handle, compression):
+    """
+    Creates a writable compressed stream on a binary handle, which can be closed without closing the handle.
+    :param handle: binary handle
+    :param compression: gzip, bz2 or zstd
+    :return: binary file-like object
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=handle, mode="wb", compresslevel=6)
+
+    if compression == "bz2":
+        return bz2.BZ2File(handle, mode="wb")
+
+    if compression == "zstd":
+        zstandard = import_optional("zstandard", "zstd")
+        return zstandard.ZstdCompressor().stream_writer(handle, closefd=False)
+
+    raise ValueError(f"Unknown compression '{compression}' (should be one of {', '.join(COMPRESSION_EXTENSIONS.values())})")
+
+
+class CsvFileOutput(StreamOutput):
+    """
+    Output generated mock data for a single fieldset to a CSV file specified in the options (output_file). The data is
+    written with a single header row and no index.
+
+    Chunks where every column holds strings (e.g. pre-formatted fields) or integers are joined directly, rather than
+    using DataFrame.to_csv, with the same quoting and line endings.
+    """
+    delimiter = ","
+    quotechar = '"'
+
+    def format_header(self, dataframe):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator=os.linesep).writerow(dataframe.columns.tolist())
+        return buffer.getvalue().encode(self.encoding)
+
+    def format_chunk(self, dataframe):
+        str_columns = as_str_columns(dataframe)
+
+        if str_columns is None or len(str_columns) < 2:
+            return dataframe.to_csv(index=False, header=False).encode(self.encoding)
+
+        str_columns = [self._quote_column(values) for values in str_columns]
+        lines = map(self.delimiter.join, zip(*str_columns))
+
+        return (os.linesep.join(lines) + os.linesep).encode(self.encoding)
+
+    def _quote_column(self, values):
+        """
+        Quotes values which contain the delimiter, quote character or a line ending (as csv.writer does). The whole
+        column is checked at once so that most columns are left as they are.
+        """
+        special_chars = self.delimiter + self.quotechar + os.linesep
+        joined = "\0".join(values)
+        if not any(char in joined for char in special_chars):
+            return values
+
+        quotechar = self.quotechar
+        escaped_quote = quotechar * 2
+
+        return [
+            quotechar + value.replace(quotechar, escaped_quote) + quotechar
+            if any(char in value for char in special_chars) else value
+            for value in values
+        ]
+
+
+class JsonLinesOutput(StreamOutput):
+    """
+    Output generated data for a single fieldset as JSON Lines (newline delimited JSON), with one object per row, to a
+    file specified in the options (output_file) or to STDOUT.
+
+    Rows are encoded with orjson if it is installed (pip install headfake[jsonl]), otherwise with the json module.
+    Missing values are written as null and dates in ISO 8601 format.
+    """
+
+    def format_chunk(self, dataframe):
+        names = dataframe.columns.tolist()
+        columns = [as_json_values(series) for _, series in dataframe.items()]
+
+        dumps = json_encoder()
+        lines = [dumps(dict(zip(names, row))) for row in zip(*columns)]
+        lines.append(b"")
+
+        return b"\n".join(lines)
+
+
+PG_LENGTH = struct.Struct(">i")
+PG_BIGINT = struct.Struct(">iq")
+PG_DOUBLE = struct.Struct(">id")
+PG_DATE = struct.Struct(">ii")
+PG_BOOLEAN_TRUE = struct.pack(">ib", 1, 1)
+PG_BOOLEAN_FALSE = struct.pack(">ib", 1, 0)
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+
+
+def pack_pg_timestamp(value):
+    """
+    Packs a datetime as a PostgreSQL binary timestamp (microseconds since 2000-01-01). Timezone aware datetimes are
+    converted to UTC (for timestamptz columns).
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    delta = value - PG_EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return PG_BIGINT.pack(8, microseconds)
+
+
+class PgCopyOutput(StreamOutput):
+    """
+    Output generated data for a single fieldset in PostgreSQL COPY text format (tab delimited, with backslash escapes)
+    to a file specified in the options (output_file) or to STDOUT, e.g. to pipe into psql -c "COPY t FROM STDIN".
+
+    Missing values (e.g. from an error_value of None) are written as NULL (\\N). Empty strings (e.g. from
+    IntermittentBlanks) are also written as NULL, unless options.keep_empty_strings is set.
+    """
+    null = "\\N"
+    escapes = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"}
+
+    def __init__(self, options):
+        """
+        Setup output with appropriate options.
+        :param options: Arguments dictionary
+        """
+        super().__init__(options)
+        self.keep_empty_strings = getattr(options, "keep_empty_strings", False)
+
+    def format_chunk(self, dataframe):
+        columns = [self._format_column(series) for _, series in dataframe.items()]
+        lines = map("\t".join, zip(*columns))
+
+        return ("\n".join(lines) + "\n").encode(self.encoding)
+
+    def _format_column(self, series):
+        """
+        Formats a column of values as COPY text values.
+        """
+        null = self.null
+        empty = "" if self.keep_empty_strings else null
+
+        if series.dtype.kind in "iu":
+            return list(map(str, series.tolist()))
+
+        values = as_sql_values(series)
+        if series.dtype.kind == "b":
+            return ["t" if value else "f" for value in values]
+
+        if series.dtype.kind == "f":
+            return [null if value is None else repr(value) for value in values]
+
+        values = [None if value is None else str(value) for value in values]
+
+        joined = "\0".join(value for value in values if value is not None)
+        if any(char in joined for char in self.escapes):
+            escape = re.compile("[\\\\\t\n\r]")
+            escape_char = lambda match: self.escapes[match.group(0)]
+            values = [None if value is None else escape.sub(escape_char, value) for value in values]
+
+        return [null if value is None else (empty if value == "" else value) for value in values]
+
+
+class PgCopyBinaryOutput(PgCopyOutput):
+    """
+    Output generated data for a single fieldset in PostgreSQL COPY binary format (COPY t FROM STDIN WITH (FORMAT
+    binary)) to a file specified in the options (output_file) or to STDOUT.
+
+    Integer columns are written as bigint, floats as double precision, booleans as boolean and columns of dates or
+    datetimes as date or timestamp. Anything else is written as text (so the table column should be text or varchar).
+    Missing values, and empty strings unless options.keep_empty_strings is set, are written as NULL.
+    """
+    signature = b"PGCOPY\n\xff\r\n\0" + struct.pack(">ii", 0, 0)
+    null_cell = struct.pack(">i", -1)
+
+    def format_header(self, dataframe):
+        return self.signature
+
+    def format_footer(self):
+        return struct.pack(">h", -1)
+
+    def format_chunk(self, dataframe):
+        cells = [self._format_binary_column(series) for _, series in dataframe.items()]
+        field_count = struct.pack(">h", len(cells))
+
+        return b"".join(itertools.chain.from_iterable(zip(itertools.repeat(field_count), *cells)))
+
+    def _format_binary_column(self, series):
+        """
+        Formats a column of values as COPY binary fields (length followed by the value).
+        """
+        values = series.tolist()
+
+        if series.dtype.kind in "iu":
+            return list(map(PG_BIGINT.pack, itertools.repeat(8), values))
+
+        if series.dtype.kind == "b":
+            return [PG_BOOLEAN_TRUE if value else PG_BOOLEAN_FALSE for value in values]
+
+        if series.dtype.kind == "f":
+            null_cell = self.null_cell
+            return [null_cell if value != value else PG_DOUBLE.pack(8, value) for value in values]
+
+        values = as_json_values(series)
+        value_types = set(map(type, values)) - {type(None)}
+
+        if value_types and value_types <= {datetime.date}:
+            return self._pack_values(values, lambda value: PG_DATE.pack(4, (value - PG_EPOCH.date()).days))
+
+        if value_types and all(issubclass(value_type, datetime.datetime) for value_type in value_types):
+            return self._pack_values(values, pack_pg_timestamp)
+
+        if not self.keep_empty_strings:
+            values = [None if value == "" else value for value in values]
+
+        def pack_text(value):
+            data = str(value).encode(self.encoding)
+            return PG_LENGTH.pack(len(data)) + data
+
+        return self._pack_values(values, pack_text)
+
+    def _pack_values(self, values, pack):
+        null_cell = self.null_cell
+        return [null_cell if value is None else pack(value) for value in values]
+
+
+class FhirPatientOutput(StreamOutput):
+    """
+    Output generated data for a single fieldset as FHIR R4 Patient resources in the FHIR Bulk Data NDJSON layout (one
+    resource per line), to a file specified in the options (output_file) or to STDOUT.
+
+    The columns used for each part of the resource are taken from options.fhir_mapping (a dictionary or the name of a
+    YAML/JSON file) with the keys: id, nhs_number, family, given (list), gender, birth_date, address_lines (list),
+    postal_code, phone, deceased and deceased_date. Any which are not given are taken from the first field of the
+    matching type in the fieldset (IdField, NhsNoField, LastNameField, FirstNameField/MiddleNameField, GenderField,
+    DateOfBirthField, AddressLinesField/AddressField, PostcodeField and DeceasedField).
+
+    The mapping, including how gender values and date formats are converted, is compiled once and empty values are
+    left out of the resources.
+    """
+    nhs_number_system = "https://fhir.nhs.uk/Id/nhs-number"
+
+    def __init__(self, options):
+        """
+        Setup output with appropriate options.
+        :param options: Arguments dictionary
+        """
+        super().__init__(options)
+        self.mapping = load_mapping(getattr(options, "fhir_mapping", None))
+        self._plan = None
+        self._builders = None
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_builders"] = None
+        return state
+
+    def init_from_fieldset(self, fieldset):
+        super().init_from_fieldset(fieldset)
+        self._plan = create_patient_plan(fieldset, self.mapping)
+        self._builders = None
+
+    def format_chunk(self, dataframe):
+        if self._builders is None:
+            plan = self._plan or create_patient_plan(None, self.mapping)
+            self._builders = compile_fhir_patient_plan(plan, dataframe.columns.tolist())
+
+        columns = [as_json_values(series) for _, series in dataframe.items()]
+        if not columns:
+            return b""
+
+        dumps = json_encoder()
+        builders = self._builders
+        lines = []
+
+        for row_no, row in zip(dataframe.index.tolist(), zip(*columns)):
+            resource = {"resourceType": "Patient"}
+            for build in builders:
+                build(resource, row, row_no)
+
+            lines.append(dumps(resource))
+
+        lines.append(b"")
+        return b"\n".join(lines)
+
+
+PATIENT_MAPPING_KEYS = ["id", "nhs_number", "family", "given", "gender", "birth_date", "address_lines", "postal_code",
+                        "phone", "deceased", "deceased_date"]
+
+
+def load_mapping(mapping):
+    """
+    Loads a mapping from a YAML or JSON file, if given a file name rather than a dictionary.
+    """
+    if mapping is None or isinstance(mapping, dict):
+        return dict(mapping or {})
+
+    with open(locate_file(mapping)) as fh:
+        import yaml
+        return yaml.safe_load(fh) or {}
+
+
+def create_patient_plan(fieldset, mapping):
+    """
+    Creates the plan for building patient records (e.g. FHIR Patient resources or HL7 PID segments) from the fieldset:
+    the columns to use for each part of the record and how their values are converted. Parts which are not in the
+    mapping are found from the field types.
+    :param fieldset: Fieldset generating the data (or None to use the mapping only)
+    :param mapping: dictionary of resource part to column name(s)
+    :return: dictionary plan
+    """
+    unknown = set(mapping) - set(PATIENT_MAPPING_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown patient mapping key(s) {', '.join(sorted(unknown))} (should be in {PATIENT_MAPPING_KEYS})")
+
+    plan = {"columns": dict(mapping), "gender_values": {}, "date_formats": {}, "deceased_values": []}
+    if fieldset is None:
+        return plan
+
+    from headfake import field as fields
+
+    columns = plan["columns"]
+    by_name = fieldset.field_map
+
+    def first_field(*classes):
+        return next((f for f in fieldset.fields if isinstance(f, classes) and not f.hidden), None)
+
+    def infer(key, *classes):
+        found = first_field(*classes)
+        if key not in columns and found is not None:
+            columns[key] = found.name
+
+    infer("id", fields.IdField)
+    infer("nhs_number", fields.NhsNoField)
+    infer("family", fields.LastNameField)
+    infer("gender", fields.GenderField)
+    infer("birth_date", fields.DateOfBirthField)
+    infer("postal_code", fields.PostcodeField)
+
+    if "given" not in columns:
+        given = [first_field(fields.FirstNameField), first_field(fields.MiddleNameField)]
+        columns["given"] = [f.name for f in given if f is not None]
+
+    if "address_lines" not in columns:
+        address = first_field(fields.AddressLinesField)
+        if address is not None:
+            columns["address_lines"] = list(address.line_fields)
+            columns.setdefault("postal_code", address.postcode_field)
+        else:
+            lines = {}
+            for f in fieldset.fields:
+                if isinstance(f, fields.AddressField) and not f.hidden:
+                    lines.setdefault(f.line_no, f.name)
+
+            columns["address_lines"] = [lines[line_no] for line_no in sorted(lines)]
+
+    deceased = by_name.get(columns.get("deceased")) if "deceased" in columns else first_field(fields.DeceasedField)
+    if isinstance(deceased, fields.DeceasedField):
+        columns.setdefault("deceased", deceased.name)
+        if deceased.deceased_date_field:
+            columns.setdefault("deceased_date", deceased.deceased_date_field)
+            plan["date_formats"]["deceased_date"] = deceased.date_format
+
+        plan["deceased_values"] = [deceased.deceased_true_value]
+
+    gender = by_name.get(columns.get("gender"))
+    if isinstance(gender, fields.GenderField):
+        plan["gender_values"] = {gender.male_value: "male", gender.female_value: "female"}
+
+    birth_date = by_name.get(columns.get("birth_date"))
+    if isinstance(birth_date, fields.DateOfBirthField):
+        plan["date_formats"]["birth_date"] = birth_date.date_format
+
+    return plan
+
+
+def compile_fhir_patient_plan(plan, column_names):
+    """
+    Compiles a plan (from create_patient_plan) into a list of functions which each add part of a Patient resource
+    from a row of values. Columns in the plan which are not in the data are ignored.
+    :param plan: dictionary plan
+    :param column_names: names of the columns in the data
+    :return: list of functions taking (resource, row, row number)
+    """
+    positions = {name: pos for pos, name in enumerate(column_names)}
+    columns = plan["columns"]
+
+    def position(key):
+        return positions.get(columns.get(key))
+
+    def positions_of(key):
+        names = columns.get(key) or []
+        if isinstance(names, str):
+            names = [names]
+
+        return [positions[name] for name in names if name in positions]
+
+    builders = []
+
+    id_pos = position("id")
+    if id_pos is not None:
+        builders.append(lambda resource, row, row_no: resource.__setitem__("id", str(row[id_pos])))
+    else:
+        builders.append(lambda resource, row, row_no: resource.__setitem__("id", str(row_no)))
+
+    nhs_pos = position("nhs_number")
+    if nhs_pos is not None:
+        system = FhirPatientOutput.nhs_number_system
+
+        def build_identifier(resource, row, row_no):
+            value = as_fhir_value(row[nhs_pos])
+            if value is not None:
+                resource["identifier"] = [{"system": system, "value": value.replace(" ", "")}]
+
+        builders.append(build_identifier)
+
+    family_pos = position("family")
+    given_pos = positions_of("given")
+    if family_pos is not None or given_pos:
+        def build_name(resource, row, row_no):
+            name = {"use": "official"}
+            family = as_fhir_value(row[family_pos]) if family_pos is not None else None
+            given = [value for value in (as_fhir_value(row[pos]) for pos in given_pos) if value is not None]
+
+            if family is not None:
+                name["family"] = family
+
+            if given:
+                name["given"] = given
+
+            if len(name) > 1:
+                resource["name"] = [name]
+
+        builders.append(build_name)
+
+    phone_pos = position("phone")
+    if phone_pos is not None:
+        def build_telecom(resource, row, row_no):
+            value = as_fhir_value(row[phone_pos])
+            if value is not None:
+                resource["telecom"] = [{"system": "phone", "value": value, "use": "home"}]
+
+        builders.append(build_telecom)
+
+    gender_pos = position("gender")
+    if gender_pos is not None:
+        gender_values = plan["gender_values"]
+        fhir_genders = {"male", "female", "other", "unknown"}
+
+        def build_gender(resource, row, row_no):
+            value = row[gender_pos]
+            if value in gender_values:
+                resource["gender"] = gender_values[value]
+            elif value is not None and str(value).lower() in fhir_genders:
+                resource["gender"] = str(value).lower()
+            elif as_fhir_value(value) is not None:
+                resource["gender"] = "unknown"
+
+        builders.append(build_gender)
+
+    birth_date_pos = position("birth_date")
+    if birth_date_pos is not None:
+        convert_birth_date = patient_date_converter(plan, "birth_date")
+
+        def build_birth_date(resource, row, row_no):
+            value = convert_birth_date(row[birth_date_pos])
+            if value is not None:
+                resource["birthDate"] = value
+
+        builders.append(build_birth_date)
+
+    deceased_pos = position("deceased")
+    deceased_date_pos = position("deceased_date")
+    if deceased_pos is not None or deceased_date_pos is not None:
+        deceased_values = plan["deceased_values"]
+        convert_deceased_date = patient_date_converter(plan, "deceased_date")
+
+        def build_deceased(resource, row, row_no):
+            date = None
+            if deceased_date_pos is not None:
+                date = convert_deceased_date(row[deceased_date_pos])
+
+            if date is not None:
+                resource["deceasedDateTime"] = date
+            elif deceased_pos is not None and row[deceased_pos] is not None:
+                value = row[deceased_pos]
+                resource["deceasedBoolean"] = value in deceased_values if deceased_values else bool(value)
+
+        builders.append(build_deceased)
+
+    address_pos = positions_of("address_lines")
+    postal_code_pos = position("postal_code")
+    if address_pos or postal_code_pos is not None:
+        def build_address(resource, row, row_no):
+            address = {"use": "home"}
+            lines = [value for value in (as_fhir_value(row[pos]) for pos in address_pos) if value is not None]
+            postal_code = as_fhir_value(row[postal_code_pos]) if postal_code_pos is not None else None
+
+            if lines:
+                address["line"] = lines
+
+            if postal_code is not None:
+                address["postalCode"] = postal_code
+
+            if len(address) > 1:
+                resource["address"] = [address]
+
+        builders.append(build_address)
+
+    return builders
+
+
+def patient_date_converter(plan, key):
+    """
+    Creates a function converting the dates for part of a patient plan to ISO 8601 date strings (with missing and empty
+    values as None), reparsing strings in the date format of the field when it is not already ISO 8601.
+    """
+    date_format = plan["date_formats"].get(key)
+    if not date_format or date_format == "%Y-%m-%d":
+        return as_fhir_date
+
+    parse = date_parser(date_format)
+    reformat = lru_cache(maxsize=DATE_MEMO_SIZE)(lambda value: parse(value).date().isoformat())
+
+    def convert(value):
+        if isinstance(value, str):
+            return reformat(value) if value.strip() else None
+
+        return as_fhir_date(value)
+
+    return convert
+
+
+def as_fhir_value(value):
+    """
+    Converts a value to a FHIR string, with missing and empty values (which are not allowed in FHIR) as None.
+    """
+    if value is None:
+        return None
+
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+
+    value = str(value)
+    return value if value.strip() else None
+
+
+def as_fhir_date(value):
+    """
+    Converts a date (or date string already in ISO 8601 format) to a FHIR date, with missing and empty values as None.
+    """
+    if hasattr(value, "isoformat"):
+        return value.isoformat()[:10]
+
+    return as_fhir_value(value)
+
+
+class Hl7AdtOutput(StreamOutput):
+    """
+    Output generated data for a single fieldset as HL7 v2.5 ADT^A04 (or ADT^A08) messages, one per row, each made up of
+    MSH, EVN, PID and PV1 segments, to a file specified in the options (output_file) or to STDOUT.
+
+    The columns bound to the PID segment are taken from options.hl7_mapping (a dictionary or the name of a YAML/JSON
+    file) with the same keys as the FHIR Patient mapping, with any not given found from the field types in the
+    fieldset. The event is taken from options.hl7_event and the messages are MLLP framed or separated by newlines
+    according to options.hl7_framing ("mllp" or "newline").
+
+    The segment template is compiled once into a format string with a slot for each bound value. Each chunk is then
+    converted and escaped column by column before the messages are filled in.
+    """
+    events = ["A04", "A08"]
+    framings = ["newline", "mllp"]
+    sending_application = "HEADFAKE"
+    sending_facility = "HEADFAKE"
+    receiving_application = ""
+    receiving_facility = ""
+    processing_id = "P"
+    version = "2.5"
+    patient_class = "O"
+    assigning_authority = "HEADFAKE"
+
+    def __init__(self, options):
+        """
+        Setup output with appropriate options.
+        :param options: Arguments dictionary
+        """
+        super().__init__(options)
+        self.mapping = load_mapping(getattr(options, "hl7_mapping", None))
+        self.event = getattr(options, "hl7_event", None) or "A04"
+        self.framing = getattr(options, "hl7_framing", None) or "newline"
+
+        if self.event not in self.events:
+            raise ValueError(f"Unknown HL7 event '{self.event}' (should be one of {self.events})")
+
+        if self.framing not in self.framings:
+            raise ValueError(f"Unknown HL7 framing '{self.framing}' (should be one of {self.framings})")
+
+        self.timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        self._plan = None
+        self._template = None
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_template"] = None
+        return state
+
+    def init_from_fieldset(self, fieldset):
+        super().init_from_fieldset(fieldset)
+        self._plan = create_patient_plan(fieldset, self.mapping)
+        self._template = None
+
+    def format_chunk(self, dataframe):
+        if self._template is None:
+            plan = self._plan or create_patient_plan(None, self.mapping)
+            self._template = compile_hl7_adt_template(plan, dataframe.columns.tolist(), self)
+
+        message_format, slots = self._template
+        columns = [as_json_values(series) for _, series in dataframe.items()]
+        row_nos = dataframe.index.tolist()
+
+        values = [fill(columns, row_nos) for fill in slots]
+        return "".join(map(message_format.format, *values)).encode(self.encoding)
+
+
+HL7_ESCAPES = str.maketrans({"\\": "\\E\\", "|": "\\F\\", "^": "\\S\\", "~": "\\R\\", "&": "\\T\\",
+                             "\r": "\\X0D\\", "\n": "\\X0A\\"})
+HL7_SPECIAL_CHARS = re.compile(r"[\\|^~&\r\n]")
+HL7_GENDERS = {"male": "M", "female": "F", "other": "O", "unknown": "U"}
+HL7_ADDRESS_LINES = 4
+
+
+def compile_hl7_adt_template(plan, column_names, output):
+    """
+    Compiles a plan (from create_patient_plan) into a format string for a whole ADT message and the functions which
+    fill each of its slots for a chunk. Columns in the plan which are not in the data are left empty.
+    :param plan: dictionary plan
+    :param column_names: names of the columns in the data
+    :param output: Hl7AdtOutput providing the message header values, event and framing
+    :return: tuple of format string and list of functions taking (columns, row numbers) returning escaped strings
+    """
+    positions = {name: pos for pos, name in enumerate(column_names)}
+    columns = plan["columns"]
+    slots = []
+
+    def position(key):
+        return positions.get(columns.get(key))
+
+    def positions_of(key):
+        names = columns.get(key) or []
+        if isinstance(names, str):
+            names = [names]
+
+        return [positions[name] for name in names if name in positions]
+
+    def slot(fill):
+        slots.append(fill)
+        return "{%d}" % (len(slots) - 1)
+
+    def literal(text):
+        return escape_hl7(text).replace("{", "{{").replace("}", "}}")
+
+    def column_values(pos, convert=as_hl7_value):
+        if pos is None:
+            return None
+
+        return lambda cols, row_nos: escape_hl7_column([convert(value) for value in cols[pos]])
+
+    def column_slot(pos, convert=as_hl7_value):
+        values = column_values(pos, convert)
+        return slot(values) if values is not None else ""
+
+    def date_slot(key):
+        convert = patient_date_converter(plan, key)
+        return column_slot(position(key), lambda value: (convert(value) or "").replace("-", ""))
+
+    control_id = slot(lambda cols, row_nos: [str(row_no + 1) for row_no in row_nos])
+
+    msh = "|".join(["MSH", "^~\\&", literal(output.sending_application), literal(output.sending_facility),
+                    literal(output.receiving_application), literal(output.receiving_facility), output.timestamp, "",
+                    f"ADT^{output.event}^ADT_A01", control_id, output.processing_id, output.version])
+    evn = "|".join(["EVN", output.event, output.timestamp])
+
+    pid = [""] * 31
+    pid[0] = "PID"
+    pid[1] = "1"
+
+    id_values = column_values(position("id"))
+    nhs_values = column_values(position("nhs_number"), lambda value: as_hl7_value(value).replace(" ", ""))
+    authority = literal(output.assigning_authority)
+
+    def fill_identifiers(cols, row_nos):
+        ids = id_values(cols, row_nos) if id_values else [str(row_no) for row_no in row_nos]
+        identifiers = [f"{value}^^^{authority}^MR" for value in ids]
+        if nhs_values is None:
+            return identifiers
+
+        return [f"{identifier}~{nhs}^^^NHS^NH" if nhs else identifier
+                for identifier, nhs in zip(identifiers, nhs_values(cols, row_nos))]
+
+    pid[3] = slot(fill_identifiers)
+
+    given_pos = positions_of("given")
+    given = ["", ""]
+    if given_pos:
+        given[0] = column_slot(given_pos[0])
+
+    if len(given_pos) > 1:
+        def fill_middle(cols, row_nos):
+            names = zip(*[[as_hl7_value(value) for value in cols[pos]] for pos in given_pos[1:]])
+            return escape_hl7_column([" ".join(name for name in names_row if name) for names_row in names])
+
+        given[1] = slot(fill_middle)
+
+    pid[5] = "^".join([column_slot(position("family"))] + given).rstrip("^")
+    pid[7] = date_slot("birth_date")
+
+    gender_values = plan["gender_values"]
+
+    def as_hl7_gender(value):
+        if value in gender_values:
+            return HL7_GENDERS[gender_values[value]]
+
+        value = as_hl7_value(value)
+        if not value:
+            return ""
+
+        if value.upper() in HL7_GENDERS.values():
+            return value.upper()
+
+        return HL7_GENDERS.get(value.lower(), "U")
+
+    pid[8] = column_slot(position("gender"), as_hl7_gender)
+
+    address = [column_slot(pos) for pos in positions_of("address_lines")[:HL7_ADDRESS_LINES]]
+    address += [""] * (HL7_ADDRESS_LINES - len(address))
+    pid[11] = "^".join(address + [column_slot(position("postal_code"))]).rstrip("^")
+    pid[13] = column_slot(position("phone"))
+
+    deceased_pos = position("deceased")
+    deceased_date_pos = position("deceased_date")
+    if deceased_date_pos is not None:
+        pid[29] = date_slot("deceased_date")
+
+    if deceased_pos is not None or deceased_date_pos is not None:
+        deceased_values = plan["deceased_values"]
+        convert_deceased_date = patient_date_converter(plan, "deceased_date")
+
+        def as_indicator(deceased, date):
+            if date is not None and convert_deceased_date(date):
+                return "Y"
+
+            if deceased is None:
+                return ""
+
+            return "Y" if (deceased in deceased_values if deceased_values else bool(deceased)) else "N"
+
+        def fill_indicator(cols, row_nos):
+            deceased = cols[deceased_pos] if deceased_pos is not None else [None] * len(row_nos)
+            dates = cols[deceased_date_pos] if deceased_date_pos is not None else [None] * len(row_nos)
+            return list(map(as_indicator, deceased, dates))
+
+        pid[30] = slot(fill_indicator)
+
+    pv1 = "|".join(["PV1", "1", output.patient_class])
+
+    message = "\r".join([msh, evn, "|".join(pid).rstrip("|"), pv1]) + "\r"
+    if output.framing == "mllp":
+        message = "\x0b" + message + "\x1c\r"
+    else:
+        message += "\n"
+
+    return message, slots
+
+
+def escape_hl7(value):
+    """
+    Escapes the HL7 v2 delimiters (and line breaks) in a value.
+    """
+    return value.translate(HL7_ESCAPES)
+
+
+def escape_hl7_column(values):
+    """
+    Escapes the HL7 v2 delimiters in a column of strings, only checking each value if the column needs escaping.
+    """
+    if HL7_SPECIAL_CHARS.search("".join(values)) is None:
+        return values
+
+    return [value.translate(HL7_ESCAPES) for value in values]
+
+
+def as_hl7_value(value):
+    """
+    Converts a value to a HL7 v2 string, with missing values as empty strings.
+    """
+    return as_fhir_value(value) or ""
+
+
+class FixedWidthOutput(StreamOutput):
+    """
+    Output generated data for a single fieldset as fixed width records, to a file specified in the options (output_file)
+    or to STDOUT.
+
+    The layout is taken from options.fixed_width_layout (a list, a dictionary of column name to width, or the name of
+    a YAML/JSON file holding either). Each column of the list has a field, a width in bytes and optionally an align
+    ("left" or "right", default left) and fill character (default a space). Columns which are not in the data are
+    written as filler.
+
+    Each chunk is padded and truncated a whole column at a time and packed into a structured array, so that the records
+    are written as one contiguous block. If options.preallocate is set, the output file is sized up front for
+    options.no_rows records and written through a memory map, then truncated to the records actually written.
+    """
+    record_terminator = os.linesep
+
+    def __init__(self, options):
+        """
+        Setup output with appropriate options.
+        :param options: Arguments dictionary
+        """
+        super().__init__(options)
+        self.layout = load_fixed_width_layout(getattr(options, "fixed_width_layout", None))
+        self.preallocate = getattr(options, "preallocate", False)
+        self.no_rows = getattr(options, "no_rows", None)
+
+        if not self.layout:
+            raise ValueError("Fixed width output needs a layout giving the width of each column")
+
+        if self.preallocate and (not self.output_file or self.compression or self.no_rows is None):
+            raise ValueError("Preallocating fixed width output needs an uncompressed output file and the number of rows")
+
+        terminator = self.record_terminator.encode(self.encoding)
+        self.record_dtype = np.dtype([(f"f{pos}", f"S{column['width']}") for pos, column in enumerate(self.layout)]
+                                     + [("end", f"S{len(terminator)}")])
+        self._terminator = terminator
+
+    def _open_file(self):
+        if not self.preallocate:
+            return super()._open_file()
+
+        return MemoryMappedFile(self.output_file, self.record_dtype.itemsize * self.no_rows)
+
+    def format_chunk(self, dataframe):
+        if len(dataframe) == 0:
+            return b""
+
+        records = np.empty(len(dataframe), dtype=self.record_dtype)
+
+        for pos, column in enumerate(self.layout):
+            name = column["field"]
+            values = dataframe[name] if name in dataframe.columns else None
+            records[f"f{pos}"] = self._pad_column(values, len(dataframe), column)
+
+        records["end"] = self._terminator
+        return records.tobytes()
+
+    def _pad_column(self, series, size, column):
+        width = column["width"]
+        fill = column["fill"]
+
+        if series is None:
+            return np.full(size, (fill * width).encode(self.encoding), dtype=f"S{width}")
+
+        values = np.array(["" if value is None else str(value) for value in as_json_values(series)], dtype=str)
+
+        # truncate to the width, then pad
+        values = values.astype(f"U{width}")
+        justify = np.char.rjust if column["align"] == "right" else np.char.ljust
+        padded = justify(values, width, fill)
+
+        # ASCII text can be narrowed from its code points directly, which is much faster than encoding it
+        codes = padded.view(np.uint32).reshape(len(padded), width)
+        if self.encoding in ASCII_COMPATIBLE_ENCODINGS and codes.max() < 128:
+            return codes.astype(np.uint8).view(f"S{width}").reshape(len(padded))
+
+        # other text may have characters of more than one byte, so is fitted to the width in bytes value by value
+        return np.array([fit_fixed_width(value, width, column["align"], fill, self.encoding)
+                         for value in values.tolist()], dtype=f"S{width}")
+
+
+def fit_fixed_width(value, width, align, fill, encoding):
+    """
+    Encodes a value to exactly width bytes, truncating it on a character boundary and padding it with the fill (or
+    spaces if the fill does not divide the remaining bytes).
+    :param value: string
+    :param width: width in bytes
+    :param align: left or right
+    :param fill: fill character
+    :param encoding: encoding of the output
+    :return: bytes
+    """
+    data = value.encode(encoding)
+    while len(data) > width:
+        value = value[:-1]
+        data = value.encode(encoding)
+
+    fill_data = fill.encode(encoding)
+    fill_count, space_count = divmod(width - len(data), len(fill_data))
+    padding = fill_data * fill_count + " ".encode(encoding) * space_count
+
+    return padding + data if align == "right" else data + padding
+
+
+FIXED_WIDTH_ALIGNS = ["left", "right"]
+ASCII_COMPATIBLE_ENCODINGS = {"utf-8", "ascii", "latin-1", "iso-8859-1", "cp1252"}
+
+
+def load_fixed_width_layout(layout):
+    """
+    Loads a fixed width layout (from a YAML/JSON file if given a file name) as a list of column dictionaries with the
+    keys field, width, align and fill.
+    :param layout: list of column dictionaries, dictionary of field name to width or file name
+    :return: list of column dictionaries
+    """
+    if layout is None:
+        return []
+
+    if isinstance(layout, str):
+        with open(locate_file(layout)) as fh:
+            import yaml
+            layout = yaml.safe_load(fh) or []
+
+    if isinstance(layout, dict):
+        layout = [{"field": name, "width": width} for name, width in layout.items()]
+
+    columns = []
+    for column in layout:
+        column = {"align": "left", "fill": " ", **column}
+        column["width"] = int(column["width"])
+
+        if column["width"] < 1:
+            raise ValueError(f"Width of fixed width column '{column['field']}' should be at least 1")
+
+        if column["align"] not in FIXED_WIDTH_ALIGNS:
+            raise ValueError(f"Unknown align '{column['align']}' for fixed width column '{column['field']}' (should be "
+                             f"one of {FIXED_WIDTH_ALIGNS})")
+
+        if len(str(column["fill"])) != 1:
+            raise ValueError(f"Fill for fixed width column '{column['field']}' should be a single character")
+
+        column["fill"] = str(column["fill"])
+        columns.append(column)
+
+    return columns
+
+
+class MemoryMappedFile:
+    """
+    Binary file-like object which writes into a file preallocated to a given size through a memory map. On close, the
+    file is truncated to the data actually written.
+    """
+
+    def __init__(self, filename, size):
+        """
+        :param filename: name of the file to create
+        :param size: number of bytes to preallocate
+        """
+        self._filename = filename
+        self._size = size
+        self._offset = 0
+
+        with open(filename, "wb") as fh:
+            fh.truncate(size)
+
+        # numpy cannot map an empty file
+        self._map = np.memmap(filename, dtype=np.uint8, mode="r+", shape=(size,)) if size else None
+
+    def write(self, data):
+        end = self._offset + len(data)
+        if end > self._size:
+            raise ValueError(f"Data is larger than the {self._size} bytes preallocated for '{self._filename}'")
+
+        if data:
+            self._map[self._offset:end] = np.frombuffer(data, dtype=np.uint8)
+
+        self._offset = end
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        if self._map is None and self._offset == self._size:
+            return
+
+        self.flush()
+        self._map = None
+        self._size = self._offset
+
+        with open(self._filename, "r+b") as fh:
+            fh.truncate(self._offset)
+
+
+class StdoutOutput(CsvFileOutput):
+    """
+    Output generated data for a single fieldset to the console/STDOUT as CSV data
+    """
+
+    def __init__(self, options):
+        """
+        Setup output with appropriate options.
+        :param options: Arguments dictionary
+        """
+        super().__init__(options)
+        self.output_file = None
+        self.compression = getattr(options, "compress", None)
+
+
+class ParquetFileOutput(ChunkedOutput):
+    """
+    Output generated data for a single fieldset to an Apache Parquet file specified in the options (output_file). Each
+    chunk is written as a row group. The schema is taken from the first chunk, with categorical columns dictionary
+    encoded and date columns stored as dates (when the chunks are generated with typed values, as HeadFake.write does).
+    Columns of fields which can be blank or use an error_value are stored as strings, as later chunks may mix those
+    values with other types. If no rows are generated, the file is written with a string column for each field. The
+    compression codec can be set in the options (parquet_compression, default snappy).
+
+    Requires pyarrow (pip install headfake[parquet]).
+    """
+    uses_typed_values = True
+
+    def __init__(self, options):
+        """
+        Setup output with appropriate options.
+        :param options: Arguments dictionary
+        """
+        self.output_file = options.output_file
+        self.compression = getattr(options, "parquet_compression", None) or "snappy"
+        self._writer = None
+        self._schema = None
+        self._str_columns = []
+        self._field_names = None
+        self._blank_columns = set()
+
+    def init_from_fieldset(self, fieldset):
+        self._field_names = list(fieldset.field_names)
+        self._blank_columns = {field.name for field in fieldset.fields if can_be_blank(field)}
+
+    def open(self):
+        self._pa = import_optional("pyarrow", "parquet")
+        self._pq = import_optional("pyarrow.parquet", "parquet")
+
+    def write_chunk(self, dataframe):
+        if self._writer is None:
+            self._schema = self._create_schema(dataframe)
+            self._writer = self._pq.ParquetWriter(self.output_file, self._schema, compression=self.compression)
+
+        for name in self._str_columns:
+            dataframe = dataframe.assign(**{name: dataframe[name].map(as_optional_str)})
+
+        table = self._pa.Table.from_pandas(dataframe, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table, row_group_size=max(len(dataframe), 1))
+
+    def close(self):
+        if self._writer is None and self._field_names is not None:
+            schema = self._pa.schema([self._pa.field(name, self._pa.string()) for name in self._field_names])
+            self._writer = self._pq.ParquetWriter(self.output_file, schema, compression=self.compression)
+
+        self.abort()
+
+    def abort(self):
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            finally:
+                self._writer = None
+
+    def _create_schema(self, dataframe):
+        """
+        Creates the schema for the file from the first chunk. Columns which cannot be stored as a single type (e.g. a
+        mixture of numbers and strings), which are empty or which can be blank are stored as strings.
+        """
+        import pandas as pd
+
+        pa = self._pa
+        fields = []
+        self._str_columns = []
+
+        for name, series in dataframe.items():
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                values_type = pa.array(series.cat.categories).type
+                fields.append(pa.field(name, pa.dictionary(pa.int32(), values_type)))
+                continue
+
+            try:
+                arrow_type = pa.array(series, from_pandas=True).type
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                arrow_type = pa.null()
+
+            if pa.types.is_null(arrow_type) or (name in self._blank_columns and not pa.types.is_string(arrow_type)):
+                arrow_type = pa.string()
+                self._str_columns.append(name)
+
+            fields.append(pa.field(name, arrow_type))
+
+        return pa.schema(fields)
+
+
+class SqliteOutput(ChunkedOutput):
+    """
+    Output generated data for a single fieldset into a table (options.table, default "data") of a SQLite database file
+    specified in the options (output_file). The table is created with a column for each field, typed from the first
+    chunk (INTEGER, REAL or TEXT). What happens if the table already exists is set by options.if_exists ("fail",
+    "replace" or "append", default "fail").
+
+    The chunks are inserted with executemany in a single transaction, with the journal_mode and synchronous pragmas set
+    for a bulk load (options.journal_mode, default MEMORY and options.synchronous, default OFF). Indexes on the columns
+    listed in options.index are created after the data has been loaded (unless they already exist). If no rows are
+    generated, the table is still created from the fields of the fieldset, with TEXT columns.
+    """
+
+    def __init__(self, options):
+        """
+        Setup output with appropriate options.
+        :param options: Arguments dictionary
+        """
+        self.output_file = options.output_file
+        self.table = getattr(options, "table", None) or "data"
+        self.if_exists = getattr(options, "if_exists", None) or "fail"
+        self.journal_mode = getattr(options, "journal_mode", None) or "MEMORY"
+        self.synchronous = getattr(options, "synchronous", None) or "OFF"
+        self.index = getattr(options, "index", None) or []
+        self._connection = None
+        self._insert_sql = None
+        self._field_names = None
+
+    def init_from_fieldset(self, fieldset):
+        self._field_names = list(fieldset.field_names)
+
+    def open(self):
+        self._connection = sqlite3.connect(self.output_file, isolation_level=None)
+        self._connection.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        self._connection.execute(f"PRAGMA synchronous={self.synchronous}")
+        self._connection.execute("BEGIN")
+        self._insert_sql = None
+
+    def write_chunk(self, dataframe):
+        if self._insert_sql is None:
+            self._create_table(dataframe)
+
+        columns = [as_sql_values(series) for _, series in dataframe.items()]
+        self._connection.executemany(self._insert_sql, zip(*columns))
+
+    def close(self):
+        if self._connection is None:
+            return
+
+        try:
+            if self._insert_sql is None:
+                self._create_empty_table()
+
+            # the indexes may already exist when appending, and there is no table to index if nothing was written
+            if self._insert_sql is not None:
+                for column in self.index:
+                    index_name = quote_sql_name(f"{self.table}_{column}_idx")
+                    self._connection.execute(
+                        f"CREATE INDEX IF NOT EXISTS {index_name} ON {quote_sql_name(self.table)} "
+                        f"({quote_sql_name(column)})"
+                    )
+
+            self._connection.execute("COMMIT")
+        finally:
+            self._connection.close()
+            self._connection = None
+
+    def abort(self):
+        if self._connection is None:
+            return
+
+        try:
+            self._connection.execute("ROLLBACK")
+        finally:
+            self._connection.close()
+            self._connection = None
+
+    def _create_table(self, dataframe):
+        """
+        Creates the table using the columns and types of the first chunk.
+        """
+        table = quote_sql_name(self.table)
+
+        if self.if_exists == "replace":
+            self._connection.execute(f"DROP TABLE IF EXISTS {table}")
+
+        if_not_exists = "IF NOT EXISTS " if self.if_exists == "append" else ""
+        column_defs = ", ".join(
+            f"{quote_sql_name(name)} {sql_type(series)}" for name, series in dataframe.items()
+        )
+        self._connection.execute(f"CREATE TABLE {if_not_exists}{table} ({column_defs})")
+
+        placeholders = ", ".join("?" * len(dataframe.columns))
+        self._insert_sql = f"INSERT INTO {table} VALUES ({placeholders})"
+
+    def _create_empty_table(self):
+        """
+        Creates the table when no rows were generated, with TEXT columns for the fields (if the fieldset is known).
+        """
+        if self._field_names is None:
+            return
+
+        import pandas as pd
+
+        self._create_table(pd.DataFrame(columns=self._field_names))
+
+
+def quote_sql_name(name):
+    """
+    Quotes a table/column name for use in SQL.
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def sql_type(series):
+    """
+    Gets the SQLite column type for a series.
+    """
+    if series.dtype.kind in "iub":
+        return "INTEGER"
+
+    if series.dtype.kind == "f":
+        return "REAL"
+
+    return "TEXT"
+
+
+def as_sql_values(series):
+    """
+    Gets the values of a series as a list for inserting into a database, with missing values as None and dates/times
+    in ISO 8601 format.
+    """
+    values = as_json_values(series)
+
+    if series.dtype.kind not in "iubf":
+        values = [value.isoformat() if hasattr(value, "isoformat") else value for value in values]
+
+    return values
+
+
+def can_be_blank(field):
+    """
+    Whether the values of a field can be replaced with a blank or error value, which may not have the same type as the
+    other values.
+    """
+    transformers = (field.transformers or []) + (field.final_transformers or [])
+
+    return bool(field.error_value) or any(isinstance(t, IntermittentBlanks) for t in transformers)
+
+
+def as_optional_str(value):
+    """
+    Converts a value to a string, leaving missing values (None/NaN) as None.
+    """
+    if value is None or value != value:
+        return None
+
+    return str(value)
+
+
+def as_str_columns(dataframe):
+    """
+    Gets the columns of a dataframe as lists of strings if every column holds strings (e.g. pre-formatted fields),
+    integers or booleans, otherwise returns None.
+    """
+    columns = []
+    for _, series in dataframe.items():
+        values = series.tolist()
+
+        if series.dtype.kind in "iub":
+            values = list(map(str, values))
+        elif not all(type(value) is str for value in values):
+            return None
+
+        columns.append(values)
+
+    return columns
+
+
+def as_json_values(series):
+    """
+    Gets the values of a series as a list for encoding as JSON, with missing values (NaN/NaT) replaced by None.
+    """
+    values = series.tolist()
+
+    if series.dtype.kind not in "iub":
+        values = [None if value is None or value != value else value for value in values]
+
+    return values
+
+
+def json_default(value):
+    """
+    Converts values which the JSON encoders do not handle (e.g. pandas Timestamps, numpy numbers and dates) into
+    values which they do.
+    """
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return str(value)
+
+
+@lru_cache(maxsize=None)
+def json_encoder():
+    """
+    Gets a function which encodes a value as compact JSON bytes, using orjson if it is installed.
+    """
+    try:
+        import orjson
+        return partial(orjson.dumps, default=json_default)
+    except ImportError:
+        return partial(dumps_json, default=json_default)
+
+
+def dumps_json(value, default):
+    """
+    Encodes a value as compact JSON bytes using the json module, in the same form as orjson.
+    """
+    return json.dumps(value, default=default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+FORMAT_OUTPUTS = {
+    "csv": CsvFileOutput,
+    "jsonl": JsonLinesOutput,
+    "json": JsonFileOutput,
+    "parquet": ParquetFileOutput,
+    "sqlite": SqliteOutput,
+    "pgcopy": PgCopyOutput,
+    "pgcopy-binary": PgCopyBinaryOutput,
+    "fhir-patient": FhirPatientOutput,
+    "hl7-adt": Hl7AdtOutput,
+    "fixed-width": FixedWidthOutput
+}
+
+FORMAT_EXTENSIONS = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".json": "json",
+    ".parquet": "parquet",
+    ".hl7": "hl7-adt",
+    ".db": "sqlite",
+    ".sqlite": "sqlite",
+    ".sqlite3": "sqlite"
+}
+
+
+COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".zst": "zstd"
+}
+
+
+def infer_format(output_file, default="csv"):
+    """
+    Infers the output format from the extension of the output file (e.g. ".jsonl" for JSON Lines), ignoring any
+    compression extension (e.g. ".jsonl.gz").
+    :param output_file: name of the output file (or None)
+    :param default: format to use if the extension is not recognised
+    :return: name of the format (a key of FORMAT_OUTPUTS)
+    """
+    if not output_file:
+        return default
+
+    filename, file_ext = os.path.splitext(output_file)
+    if file_ext.lower() in COMPRESSION_EXTENSIONS:
+        _, file_ext = os.path.splitext(filename)
+
+    return FORMAT_EXTENSIONS.get(file_ext.lower(), default)
+
+
+def infer_compression(output_file):
+    """
+    Infers the compression from the extension of the output file (e.g. ".gz" for gzip).
+    :param output_file: name of the output file (or None)
+    :return: gzip, bz2, zstd or None if the file is not compressed
+    """
+    if not output_file:
+        return None
+
+    _, file_ext = os.path.splitext(output_file)
+    return COMPRESSION_EXTENSIONS.get(file_ext.lower())
@@ -0,0 +1,281 @@
+"""
+This package implements the headfake generation server
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import pickle
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qs
+
+from headfake import HeadFake, output
+from headfake.fieldset import DEFAULT_CHUNK_SIZE
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+    "pgcopy": "text/plain; charset=utf-8",
+    "fhir-patient": "application/fhir+ndjson",
+    "hl7-adt": "x-application/hl7-v2+er7",
+    "fixed-width": "text/plain; charset=utf-8"
+}
+
+DEFAULT_MAX_ROWS = 10000000
+DEFAULT_MAX_CHUNK_SIZE = 100000
+
+
+class GenerationServer:
+    """
+    HTTP server which generates data from templates loaded and compiled once when it starts, streaming the rows for
+    each request with chunked transfer encoding. Data is requested using GET /generate with the parameters:
+
+    * template: name of the template (its file name without the extension, or the file name as given)
+    * rows: number of rows to generate (default 10)
+    * seed: seed for the random data generator (optional)
+    * format: any streamed output format, e.g. csv (the default) or jsonl
+    * chunk_size: number of rows to generate and send at a time (by default the server's chunk size, and at most its
+      maximum chunk size, as the data generated for a seed depends on the chunk size)
+
+    GET /templates lists the names of the templates.
+
+    Each request generates from its own copy of the compiled template, so fields which keep state (e.g. IdField) start
+    from the beginning for every request. The copies are generated a chunk at a time in a single background thread,
+    which keeps the event loop free to handle other requests. Each request has its own snapshot of the random state,
+    restored before and saved after each of its chunks, so concurrent requests with the same seed get the same data.
+    """
+
+    def __init__(self, templates, chunk_size=DEFAULT_CHUNK_SIZE, max_rows=DEFAULT_MAX_ROWS,
+                 max_chunk_size=DEFAULT_MAX_CHUNK_SIZE):
+        """
+        :param templates: template files to serve
+        :param chunk_size: default number of rows to generate and send at a time
+        :param max_rows: maximum number of rows for a request (or None for no limit)
+        :param max_chunk_size: maximum number of rows which a request can generate at a time (this bounds the memory
+        used for each request)
+        """
+        if not 1 <= chunk_size <= max_chunk_size:
+            raise ValueError(f"Chunk size should be between 1 and the maximum chunk size ({max_chunk_size})")
+
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.max_chunk_size = max_chunk_size
+        self.templates = {}
+
+        for template in templates:
+            headfake = HeadFake.from_yaml(template)
+
+            # generate a row to import everything the template uses (e.g. scipy) and warm up the mapping stores
+            pickle.loads(pickle.dumps(headfake.fieldset)).generate_data(1)
+
+            compiled = pickle.dumps(headfake.fieldset)
+            self.templates[template] = compiled
+            self.templates.setdefault(os.path.splitext(os.path.basename(template))[0], compiled)
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="headfake-generate")
+
+    async def start(self, host="127.0.0.1", port=8000, socket=None):
+        """
+        Starts the server listening on a TCP host and port, or on a Unix socket if one is given.
+        :return: asyncio Server
+        """
+        if socket:
+            return await asyncio.start_unix_server(self._handle, path=socket)
+
+        return await asyncio.start_server(self._handle, host, port)
+
+    def run(self, host="127.0.0.1", port=8000, socket=None):
+        """
+        Runs the server until it is interrupted.
+        """
+        async def serve():
+            server = await self.start(host, port, socket)
+            addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+            logging.info(f"Serving {len(self.templates)} template names on {addresses}")
+
+            async with server:
+                await server.serve_forever()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self._executor.shutdown()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+
+            # headers are not used, but have to be read before responding
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            try:
+                method, target = request_line.decode("latin-1").split()[:2]
+            except ValueError:
+                await self._write_error(writer, 400, "Bad Request")
+                return
+
+            url = urlsplit(target)
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+            if method != "GET":
+                await self._write_error(writer, 405, "Method Not Allowed")
+            elif url.path == "/generate":
+                await self._generate(writer, params)
+            elif url.path == "/templates":
+                body = json.dumps(sorted(self.templates)).encode("utf-8")
+                await self._write_response(writer, 200, "OK", "application/json", body)
+            else:
+                await self._write_error(writer, 404, "Not Found")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logging.info("Client disconnected")
+        finally:
+            writer.close()
+
+    async def _generate(self, writer, params):
+        try:
+            job = self._create_job(params)
+        except (KeyError, ValueError) as ex:
+            await self._write_error(writer, 400, "Bad Request", str(ex.args[0] if ex.args else ex))
+            return
+
+        loop = asyncio.get_running_loop()
+
+        # the first chunk is generated before responding, so that errors in the template can still be reported
+        try:
+            data = await loop.run_in_executor(self._executor, job.next_data)
+        except Exception as ex:
+            logging.exception("Failed to generate data")
+            await self._write_error(writer, 500, "Internal Server Error", str(ex))
+            return
+
+        writer.write(self._format_head(200, "OK", {
+            "Content-Type": self._content_type(job.output),
+            "Transfer-Encoding": "chunked"
+        }))
+
+        while data is not None:
+            if data:
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                await writer.drain()
+
+            try:
+                data = await loop.run_in_executor(self._executor, job.next_data)
+            except Exception:
+                # the response has started, so the only way to report the failure is to end it without the last chunk
+                logging.exception("Failed to generate data")
+                return
+
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def _create_job(self, params):
+        template = params.get("template")
+        if template not in self.templates:
+            raise KeyError(f"Unknown template '{template}'")
+
+        rows = int(params.get("rows", 10))
+        if rows < 0 or (self.max_rows is not None and rows > self.max_rows):
+            raise ValueError(f"Number of rows should be between 0 and {self.max_rows or 'any number'}")
+
+        chunk_size = int(params.get("chunk_size", self.chunk_size))
+        if chunk_size < 1 or chunk_size > self.max_chunk_size:
+            raise ValueError(f"Chunk size should be between 1 and {self.max_chunk_size}")
+        seed = int(params["seed"]) if params.get("seed") else None
+
+        output_format = params.get("format", "csv")
+        output_class = output.FORMAT_OUTPUTS.get(output_format)
+        if output_class is None or not issubclass(output_class, output.StreamOutput):
+            raise ValueError(f"Format '{output_format}' cannot be streamed")
+
+        job_output = output_class(SimpleNamespace(output_file=None, compress=None, workers=1))
+        logging.info(f"Generating {rows} rows from {template} as {output_format}")
+
+        return GenerationJob(self.templates[template], rows, chunk_size, seed, job_output)
+
+    @staticmethod
+    def _content_type(job_output):
+        for output_format, output_class in output.FORMAT_OUTPUTS.items():
+            if type(job_output) is output_class:
+                return CONTENT_TYPES.get(output_format, "application/octet-stream")
+
+        return "application/octet-stream"
+
+    async def _write_error(self, writer, status, reason, message=None):
+        await self._write_response(writer, status, reason, "text/plain; charset=utf-8",
+                                   f"{message or reason}\n".encode("utf-8"))
+
+    async def _write_response(self, writer, status, reason, content_type, body):
+        writer.write(self._format_head(status, reason, {"Content-Type": content_type, "Content-Length": len(body)}))
+        writer.write(body)
+        await writer.drain()
+
+    @staticmethod
+    def _format_head(status, reason, headers):
+        lines = [f"HTTP/1.1 {status} {reason}"] + [f"{name}: {value}" for name, value in headers.items()]
+        lines.append("Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+class GenerationJob:
+    """
+    Generation of the data for a single request, from its own copy of a compiled template and with its own random
+    state. next_data is always called from the same thread.
+    """
+
+    def __init__(self, compiled, rows, chunk_size, seed, output):
+        """
+        :param compiled: pickled Fieldset
+        :param rows: number of rows to generate
+        :param chunk_size: number of rows to generate at a time
+        :param seed: seed for the random data generator (or None)
+        :param output: StreamOutput used to format the data
+        """
+        self.output = output
+        self._compiled = compiled
+        self._rows = rows
+        self._chunk_size = chunk_size
+        self._seed = seed
+        self._chunks = None
+        self._random_state = None
+        self._finished = False
+
+    def next_data(self):
+        """
+        Generates and formats the next chunk of data.
+        :return: bytes, or None once all the data has been returned
+        """
+        if self._finished:
+            return None
+
+        first = self._chunks is None
+        if first:
+            HeadFake.set_seed(self._seed)
+            fieldset = pickle.loads(self._compiled)
+
+            self.output.init_from_fieldset(fieldset)
+            self._chunks = fieldset.generate_chunks(self._rows, self._chunk_size)
+        else:
+            HeadFake.set_random_state(self._random_state)
+
+        try:
+            chunk = next(self._chunks, None)
+        finally:
+            self._random_state = HeadFake.get_random_state()
+
+        if chunk is None:
+            self._finished = True
+            return self.output.format_empty() if first else self.output.format_footer()
+
+        data = self.output.format_chunk(chunk)
+        if first:
+            data = self.output.format_header(chunk) + data
+
+        return data
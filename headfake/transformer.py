@@ -1,14 +1,18 @@
 import random as rnd
 import re
+from functools import partial, lru_cache
 
 import attr
 
-from datetime import datetime as dt, timezone as tz, timedelta as td
+from datetime import timezone as tz, timedelta as td
 
 import numpy as np
 
+from headfake.util import as_column, iter_rows, date_parser, date_formatter, format_datetime64, \
+    date_format_directives, has_time_directives, DerivedAttributes
+
 @attr.s
-class Transformer:
+class Transformer(DerivedAttributes):
     """
     Logic for transforming field row values. For example, changing string case, randomising insertion of errors.
     Multiple transformers can be specified for each field.
@@ -16,6 +20,30 @@ class Transformer:
     def transform(self, field, row, value):
         pass
 
+    def transform_batch(self, field, columns, values):
+        """
+        Transforms a whole column of values, as generated in a batch. The columns generated so far are provided as a
+        dictionary of arrays. By default 'transform' is called for each value, but it can be over-ridden to transform
+        the values in one go (e.g. with numpy).
+        """
+        return as_column([
+            self.transform(field, row, value) for row, value in zip(iter_rows(columns, len(values)), values.tolist())
+        ])
+
+
+def as_str_values(values):
+    """
+    Returns the values as a numpy string array if they are all strings, otherwise None.
+    """
+    if values.dtype.kind == "U":
+        return values
+
+    if values.dtype == object and all(isinstance(value, str) for value in values):
+        return values.astype(str)
+
+    return None
+
+
 class UpperCase(Transformer):
     """
     Converts value to upper case.
@@ -24,6 +52,10 @@ class UpperCase(Transformer):
     def transform(self, field, row, value):
         return str(value).upper()
 
+    def transform_batch(self, field, columns, values):
+        # str.upper mapped over the values is faster than np.char.upper, which works character by character
+        return as_column(list(map(str.upper, map(str, values.tolist()))))
+
 
 @attr.s(kw_only=True)
 class IntermittentBlanks(Transformer):
@@ -39,6 +71,11 @@ class IntermittentBlanks(Transformer):
 
         return value
 
+    def transform_batch(self, field, columns, values):
+        values = values.astype(object)
+        values[np.random.random(len(values)) < self.blank_probability] = self.blank_value
+        return values
+
 @attr.s(kw_only=True)
 class RegexSubstitute(Transformer):
     """
@@ -46,9 +83,19 @@ class RegexSubstitute(Transformer):
     """
     pattern = attr.ib()
     replace = attr.ib()
+    _regex = attr.ib(init=False)
+    _derived_attributes = ("_regex",)
+
+    @_regex.default
+    def _default_regex(self):
+        return re.compile(self.pattern)
 
     def transform(self, field, row, value):
-        return re.sub(self.pattern, self.replace, value)
+        return self._regex.sub(self.replace, value)
+
+    def transform_batch(self, field, columns, values):
+        sub = partial(self._regex.sub, self.replace)
+        return as_column([sub(value) for value in values.tolist()])
 
 
 @attr.s(kw_only=True)
@@ -61,6 +108,20 @@ class Truncate(Transformer):
     def transform(self, field, row, value):
         return value[:int(self.length)]
 
+    def transform_batch(self, field, columns, values):
+        length = int(self.length)
+
+        str_values = as_str_values(values)
+        if str_values is None or length < 0:
+            # negative lengths drop characters from the end, which astype cannot do
+            return super().transform_batch(field, columns, values)
+
+        if length == 0:
+            # "U0" would mean a string of any length to numpy
+            return np.full(len(str_values), "")
+
+        return str_values.astype("U%d" % length)
+
 
 @attr.s(kw_only=True)
 class Padding(Transformer):
@@ -82,6 +143,18 @@ class Padding(Transformer):
         else:
             return value
 
+    def transform_batch(self, field, columns, values):
+        methods = {
+            'left': np.char.ljust,
+            'right': np.char.rjust,
+        }
+        pad = methods.get(self.align)
+        str_values = as_str_values(values)
+        if not pad or str_values is None:
+            return super().transform_batch(field, columns, values)
+
+        return pad(str_values, self.length, str(self.fill))
+
 
 @attr.s(kw_only=True)
 class SplitPiece(Transformer):
@@ -102,58 +175,132 @@ class SplitPiece(Transformer):
 
         return pieces[self.index]
 
+    def transform_batch(self, field, columns, values):
+        str_values = as_str_values(values)
+        if str_values is None or self.index < 0:
+            return super().transform_batch(field, columns, values)
+
+        # partition off one piece at a time, keeping track of which values have enough separators
+        found = np.ones(len(str_values), dtype=bool)
+        for i in range(self.index):
+            pieces = np.char.partition(str_values, self.separator)
+            found &= pieces[:, 1] == self.separator
+            str_values = pieces[:, 2]
+
+        pieces = np.char.partition(str_values, self.separator)
+        return np.where(found, pieces[:, 0], "")
+
+
+DATE_MEMO_SIZE = 65536
+
 
 @attr.s(kw_only=True)
 class ReformatDateTime(Transformer):
     """
     Reformats a string date into a different format. For example it could take an ISO formatted (e.g. YYYY-MM-DD) date
     string and convert it into UK locale (e.g. DD/MM/YYYY) in a single transformation.
+
+    Reformatted values are memoised (up to 'memo_size' distinct values).
     """
     source_format = attr.ib()
     target_format = attr.ib()
+    memo_size = attr.ib(default=DATE_MEMO_SIZE)
     _error_class = ValueError
+    _reformat = attr.ib(init=False)
+    _derived_attributes = ("_reformat",)
+
+    @_reformat.default
+    def _default_reformat(self):
+        parse = date_parser(self.source_format)
+        format = date_formatter(self.target_format)
+        return lru_cache(maxsize=self.memo_size)(lambda value: format(parse(value)))
 
     def transform(self, field, row, value):
-        source_dt = dt.strptime(value, self.source_format)
-        return source_dt.strftime(self.target_format)
+        return self._reformat(value)
+
+    def transform_batch(self, field, columns, values):
+        return as_column(list(map(self._reformat, values.tolist())))
 
 
 @attr.s(kw_only=True)
 class ConvertStrToDate(Transformer):
     """
     Converts a string value with a specified date 'format' into a date object
+
+    Converted values are memoised (up to 'memo_size' distinct values).
     """
     format = attr.ib()
+    memo_size = attr.ib(default=DATE_MEMO_SIZE)
     _error_class = ValueError
+    _convert = attr.ib(init=False)
+    _derived_attributes = ("_convert",)
+
+    @_convert.default
+    def _default_convert(self):
+        parse = date_parser(self.format)
+        return lru_cache(maxsize=self.memo_size)(lambda value: parse(value).date())
 
     def transform(self, field, row, value):
-        source_dt = dt.strptime(value, self.format)
-        return source_dt.date()
+        return self._convert(value)
+
+    def transform_batch(self, field, columns, values):
+        return as_column(list(map(self._convert, values.tolist())))
 
 @attr.s(kw_only=True)
 class FormatDateTime(Transformer):
     """
     Formats a date/datetime object as a string with the specified date/datetime 'format'.
+
+    Formatted values are memoised (up to 'memo_size' distinct values) and batches of numpy datetime64 values are
+    formatted in bulk.
     """
     format = attr.ib()
+    memo_size = attr.ib(default=DATE_MEMO_SIZE)
     _error_class = ValueError
+    _format = attr.ib(init=False)
+    _derived_attributes = ("_format",)
+
+    @_format.default
+    def _default_format(self):
+        format = date_formatter(self.format)
+
+        # equal datetimes in different timezones format differently, so include the timezone in the memo key
+        memo_format = lru_cache(maxsize=self.memo_size)(lambda value, tzinfo: format(value))
+        return lambda value: memo_format(value, getattr(value, "tzinfo", None))
 
     def transform(self, field, row, value):
-        return value.strftime(self.format)
+        return self._format(value)
+
+    def transform_batch(self, field, columns, values):
+        if values.dtype.kind == "M":
+            return format_datetime64(values, self.format)
+
+        return as_column(list(map(self._format, values.tolist())))
 
 
 @attr.s(kw_only=True)
 class ConvertStrToDateTime(Transformer):
     """
     Converts a string value with a specified datetime 'format' into a datetime object
+
+    Converted values are memoised (up to 'memo_size' distinct values).
     """
     format = attr.ib()
+    memo_size = attr.ib(default=DATE_MEMO_SIZE)
     _error_class = ValueError
+    _convert = attr.ib(init=False)
+    _derived_attributes = ("_convert",)
+
+    @_convert.default
+    def _default_convert(self):
+        parse = date_parser(self.format)
+        return lru_cache(maxsize=self.memo_size)(lambda value: parse(value).replace(tzinfo=tz.utc))
 
     def transform(self, field, row, value):
-        source_dt = dt.strptime(value, self.format)
-        source_dt = source_dt.replace(tzinfo=tz.utc)
-        return source_dt
+        return self._convert(value)
+
+    def transform_batch(self, field, columns, values):
+        return as_column(list(map(self._convert, values.tolist())))
 
 @attr.s(kw_only=True)
 class ConvertToNumber(Transformer):
@@ -208,3 +355,43 @@ class GetProperty(Transformer):
     def transform(self, field, row, value):
         return getattr(value, self.prop_name)
 
+
+def _fuse_date_conversion(converter, formatter):
+    """
+    Gets a single ReformatDateTime which does the same as converting a string into a date/datetime and formatting it
+    again, or None if the pair cannot be fused.
+    """
+    if type(converter) not in (ConvertStrToDate, ConvertStrToDateTime) or type(formatter) is not FormatDateTime:
+        return None
+
+    if type(converter) is ConvertStrToDate and has_time_directives(formatter.format):
+        # the converted date has no time so formatting it gives midnight, unlike the parsed datetime
+        return None
+
+    if type(converter) is ConvertStrToDateTime and date_format_directives(formatter.format) & {"z", "Z"}:
+        # the converted datetime is in UTC so formatting it gives an offset, unlike the parsed (naive) datetime
+        return None
+
+    return ReformatDateTime(source_format=converter.format, target_format=formatter.format,
+                            memo_size=formatter.memo_size)
+
+
+def fuse_transformers(transformers):
+    """
+    Fuses adjacent transformers which convert a string to a date/datetime and then format it again into a single
+    ReformatDateTime, so that values do not go string to date to string within each row.
+    :param transformers: list of transformers (or None)
+    :return: list of transformers with adjacent conversions fused
+    """
+    if not transformers:
+        return transformers
+
+    fused = [transformers[0]]
+    for transformer in transformers[1:]:
+        reformat = _fuse_date_conversion(fused[-1], transformer)
+        if reformat:
+            fused[-1] = reformat
+        else:
+            fused.append(transformer)
+
+    return fused
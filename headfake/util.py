@@ -5,11 +5,17 @@ import re
 import errno
 import os
 
+from datetime import datetime as dt
+
+from functools import partial
 from importlib import import_module
 from inspect import getsourcefile
 
 from pathlib import Path
 
+import attr
+import numpy as np
+
 field_count = 0
 
 def create_package_class(package_name):
@@ -65,7 +71,7 @@ def create_class_tree(name, params):
             handle_missing_keyword(ex, class_name, sub_params)
 
     if isinstance(params, list):
-        return [create_class_tree(p.get("name"), p) for p in params]
+        return [create_class_tree(p.get("name") if isinstance(p, dict) else None, p) for p in params]
 
     return params
 
@@ -82,7 +88,7 @@ def calculate_age(start_date: "datetime.date", end_date: "datetime.date"):
         # raised when birth date is February 29
         # and the current year is not a leap year
     except ValueError:
-        birthday = start_date.replace(year=start_date.year,
+        birthday = start_date.replace(year=end_date.year,
                                       month=start_date.month + 1, day=1)
 
     if birthday > end_date:
@@ -91,6 +97,190 @@ def calculate_age(start_date: "datetime.date", end_date: "datetime.date"):
     return end_date.year - start_date.year
 
 
+def calculate_ages(start_dates, end_dates):
+    """
+    Vectorised version of calculate_age which calculates ages in years for arrays of dates (or datetime64 values).
+    Either argument can also be a single date.
+
+    Rather than building each birthday, the end month/day is compared with the start month/day. As with
+    calculate_age, a February 29 birthday falls on March 1 in years which are not leap years.
+    :param start_dates: Array of dates for start
+    :param end_dates: Array of dates for end
+    :return: numpy array of integer ages
+    """
+    start_dates = np.asarray(start_dates, dtype="datetime64[D]")
+    end_dates = np.asarray(end_dates, dtype="datetime64[D]")
+
+    start_years, start_month_days = _split_year_month_day(start_dates)
+    end_years, end_month_days = _split_year_month_day(end_dates)
+
+    is_end_leap_year = (end_years % 4 == 0) & ((end_years % 100 != 0) | (end_years % 400 == 0))
+    birthdays = np.where((start_month_days == 229) & ~is_end_leap_year, 301, start_month_days)
+
+    return end_years - start_years - (end_month_days < birthdays)
+
+
+def _split_year_month_day(dates):
+    """
+    Splits datetime64[D] values into years and month/day numbers (e.g. 1231 for December 31).
+    """
+    years = dates.astype("datetime64[Y]")
+    months = dates.astype("datetime64[M]")
+
+    month_nos = (months - years).astype(np.int64) + 1
+    day_nos = (dates - months).astype(np.int64) + 1
+
+    return years.astype(np.int64) + 1970, month_nos * 100 + day_nos
+
+
+FIXED_WIDTH_DATE_DIRECTIVES = {
+    "%Y": ("year", 4),
+    "%m": ("month", 2),
+    "%d": ("day", 2),
+    "%H": ("hour", 2),
+    "%M": ("minute", 2),
+    "%S": ("second", 2)
+}
+
+
+def compile_date_format(date_format):
+    """
+    Compiles a date format made up only of fixed width numeric directives (e.g. "%Y-%m-%d" or "%d/%m/%Y %H:%M") and
+    literal characters into the positions of each part.
+    :param date_format: strftime/strptime style date format
+    :return: tuple of (list of (attribute name, start, end), list of (position, literal character), length) or None if
+    the format contains other directives
+    """
+    directives = []
+    literals = []
+    pos = 0
+    for token in re.findall("%.|[^%]", date_format):
+        if token.startswith("%"):
+            if token not in FIXED_WIDTH_DATE_DIRECTIVES:
+                return None
+
+            name, width = FIXED_WIDTH_DATE_DIRECTIVES[token]
+            directives.append((name, pos, pos + width))
+            pos += width
+        else:
+            literals.append((pos, token))
+            pos += 1
+
+    return directives, literals, pos
+
+
+TIME_DATE_DIRECTIVES = set("HIMSfpXcTrRz")
+
+
+def date_format_directives(date_format):
+    """
+    Gets the directives used in a date format (e.g. {"Y", "m", "d"} for "%Y-%m-%d").
+    :param date_format: strftime/strptime style date format
+    :return: set of directive characters
+    """
+    return {token[1] for token in re.findall("%.|[^%]", date_format) if token.startswith("%") and token != "%%"}
+
+
+def has_time_directives(date_format):
+    """
+    Checks whether a date format includes any part of the time (or timezone offset) so the date on its own is not
+    enough to format it.
+    :param date_format: strftime/strptime style date format
+    :return: True if the format uses time directives
+    """
+    return bool(date_format_directives(date_format) & TIME_DATE_DIRECTIVES)
+
+
+def parse_date(date_format, value):
+    """
+    Parses a date string using datetime.strptime (with the arguments the other way around so it can be partially
+    applied).
+    """
+    return dt.strptime(value, date_format)
+
+
+def date_parser(date_format):
+    """
+    Creates a function which parses date strings with the given format into datetime objects. Common fixed width
+    formats (e.g. ISO "%Y-%m-%d" or UK "%d/%m/%Y") are parsed by slicing the string, anything else (or any string not
+    in exactly the expected shape) is parsed using datetime.strptime.
+    :param date_format: strptime style date format
+    :return: function taking a string and returning a datetime
+    """
+    compiled = compile_date_format(date_format)
+    if not compiled:
+        return partial(parse_date, date_format)
+
+    directives, literals, length = compiled
+
+    def parse(value):
+        if len(value) != length or any(value[pos] != char for pos, char in literals) or \
+                not all(value[start:end].isdigit() for name, start, end in directives):
+            return dt.strptime(value, date_format)
+
+        parts = {"year": 1900, "month": 1, "day": 1}
+        parts.update((name, int(value[start:end])) for name, start, end in directives)
+        try:
+            return dt(**parts)
+        except ValueError:
+            # out of range values, let strptime raise its usual error
+            return dt.strptime(value, date_format)
+
+    return parse
+
+
+def format_date(date_format, value):
+    """
+    Formats a date using strftime (with the arguments the other way around so it can be partially applied).
+    """
+    return value.strftime(date_format)
+
+
+def date_formatter(date_format):
+    """
+    Creates a function which formats date/datetime objects as strings with the given format. Common fixed width formats
+    are formatted using string interpolation, anything else uses strftime.
+    :param date_format: strftime style date format
+    :return: function taking a date/datetime and returning a string
+    """
+    compiled = compile_date_format(date_format)
+    if not compiled:
+        return partial(format_date, date_format)
+
+    directives, literals, length = compiled
+    template = re.sub("%[YmdHMS]", lambda m: "%%0%dd" % FIXED_WIDTH_DATE_DIRECTIVES[m.group()][1],
+                      date_format.replace("%%", "%%%%"))
+    names = [name for name, start, end in directives]
+
+    def format_value(value):
+        # strftime does not zero-pad years before 1000 on all platforms
+        if value.year < 1000:
+            return value.strftime(date_format)
+
+        return template % tuple(getattr(value, name, 0) for name in names)
+
+    return format_value
+
+
+def format_datetime64(values, date_format):
+    """
+    Formats an array of numpy datetime64 values as strings, formatting each distinct value only once. ISO dates are
+    formatted directly by numpy.
+    :param values: datetime64 array
+    :param date_format: strftime style date format
+    :return: numpy object array of strings
+    """
+    if date_format == "%Y-%m-%d" and len(values) and values.min() >= np.datetime64("1000-01-01") and \
+            values.max() < np.datetime64("10000-01-01"):
+        return np.datetime_as_string(values, unit="D").astype(object)
+
+    unique_values, inverse = np.unique(values, return_inverse=True)
+    format = date_formatter(date_format)
+    formatted = as_column([format(value) for value in unique_values.tolist()])
+
+    return formatted[inverse.reshape(-1)]
+
+
 def locate_file(file):
     """
     Locates a file either from the given path or in the package resources
@@ -114,6 +304,22 @@ def locate_file(file):
     raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), str(file))
 
 
+def import_optional(module_name, extra):
+    """
+    Imports a module from an optional dependency, with a more informative error if it is not installed.
+    :param module_name: Name of the module to import (e.g. "pyarrow.parquet")
+    :param extra: Name of the headfake extra which installs the dependency (e.g. "parquet")
+    :return: the imported module
+    """
+    try:
+        return import_module(module_name)
+    except ImportError as ex:
+        raise ImportError(
+            f"The optional module '{module_name}' is needed for this feature. It can be installed using "
+            f"'pip install headfake[{extra}]'"
+        ) from ex
+
+
 def handle_missing_keyword(ex, class_name, params):
     """
     Used to provides more informative error when a keyword is missing from parameters.
@@ -137,7 +343,115 @@ def handle_missing_keyword(ex, class_name, params):
     raise ex
 
 
+def as_column(values):
+    """
+    Converts a list of generated values into a one-dimensional numpy object array. Unlike np.array, nested values
+    (e.g. lists) are kept as single elements rather than being expanded into extra dimensions.
+    :param values: List of values
+    :return: numpy array with dtype object
+    """
+    try:
+        return np.fromiter(values, dtype=object, count=len(values))
+    except ValueError:
+        # numpy < 1.23 is unable to create object arrays using fromiter
+        column = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            column[i] = value
+
+        return column
+
+
+def iter_rows(columns, size):
+    """
+    Iterates over a dictionary of column arrays (as used for batch generation) as one row dictionary per index. Values
+    are converted to native Python types (e.g. numpy datetime64 to date) so they match those seen by row-based
+    generation.
+    :param columns: Dictionary of column name to array of values
+    :param size: Number of rows
+    :return: generator of row dictionaries
+    """
+    if isinstance(columns, BatchColumns) and columns.size == size:
+        return iter(columns.rows())
+
+    names = list(columns.keys())
+    values = [as_list(col) for col in columns.values()]
+
+    return ({name: vals[i] for name, vals in zip(names, values)} for i in range(size))
+
+
+def as_list(values):
+    """
+    Converts an array of column values into a list of native Python values.
+    """
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
+class BatchColumns(dict):
+    """
+    Dictionary of column arrays used for batch generation (see Fieldset), which also keeps the row dictionaries used by
+    fields which generate values row by row. The rows are built the first time they are needed and updated in place
+    with the columns added (or replaced) since, rather than built again from every column for each field.
+    """
+
+    def __init__(self, size, *args, **kwargs):
+        """
+        :param size: Number of rows
+        """
+        super().__init__(*args, **kwargs)
+        self.size = size
+        self._rows = None
+        self._row_columns = {}
+
+    def rows(self):
+        """
+        Gets the row dictionaries, updated with the current columns.
+        :return: list of row dictionaries
+        """
+        if self._rows is None:
+            self._rows = [{} for _ in range(self.size)]
+
+        for name, values in self.items():
+            if self._row_columns.get(name) is values:
+                continue
+
+            for row, value in zip(self._rows, as_list(values)):
+                row[name] = value
+
+            self._row_columns[name] = values
+
+        return self._rows
+
+
 def new_field_name():
     global field_count
     field_count+=1
-    return "field_" + str(field_count)
\ No newline at end of file
+    return "field_" + str(field_count)
+
+
+class DerivedAttributes:
+    """
+    Mixin for attrs classes with attributes which are derived from their other attributes by an attrs default (e.g.
+    compiled regular expressions, memoised functions, Faker instances and scipy distributions), named in
+    _derived_attributes. These are left out when the object is pickled and rebuilt the first time they are used after
+    it is unpickled, so pickles stay small, do not need the derived objects to be picklable and do not carry copies of
+    their random state.
+    """
+    _derived_attributes = ()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._derived_attributes:
+            state.pop(name, None)
+
+        return state
+
+    def __getattr__(self, name):
+        # only called when the attribute is missing, i.e. a derived attribute which has not been rebuilt since unpickling
+        if name in type(self)._derived_attributes:
+            default = attr.fields_dict(type(self))[name].default
+            value = default.factory(self) if default.takes_self else default.factory()
+            setattr(self, name, value)
+            return value
+
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
@@ -2,8 +2,10 @@ from headfake import field, Fieldset, HeadFake
 import pytest
 from unittest import mock
 import datetime
+import numpy as np
 
 from headfake.field import LookupField
+from headfake.transformer import Transformer
 
 row = {}
 
@@ -37,6 +39,47 @@ def test_ConcatField_joins_multiple_fields_together(monkeypatch):
     assert concat.next_value(row) == "X Y Z"
 
 
+def test_ConcatField_joins_batches_of_field_values_together():
+    fields = [field.ConstantField(value="X"), field.LookupField(field="code"), field.ConstantField(value="Z")]
+    concat = field.ConcatField(fields=fields, glue="-")
+
+    values = concat.next_batch({"code": np.array(["A", "B", "C"])}, 3)
+    assert list(values) == ["X-A-Z", "X-B-Z", "X-C-Z"]
+
+
+def test_ConcatField_batch_uses_error_value_for_rows_which_are_not_strings():
+    concat = field.ConcatField(fields=[field.LookupField(field="code"), field.ConstantField(value="Z")],
+                               error_value="ERROR")
+
+    values = concat.next_batch({"code": np.array(["A", 1, "C"], dtype=object)}, 3)
+    assert list(values) == ["AZ", "ERROR", "CZ"]
+
+
+def test_ConcatField_batch_generates_ids_once_when_rows_use_error_value():
+    id_field = field.IdField(generator=field.IncrementIdGenerator(length=3))
+    concat = field.ConcatField(fields=[id_field, field.LookupField(field="code")], error_value="ERROR")
+
+    values = concat.next_batch({"code": np.array(["A", 1, "C"], dtype=object)}, 3)
+    assert list(values) == ["001A", "ERROR", "003C"]
+    assert id_field.next_value({}) == "004"
+
+
+class FailingTransformer(Transformer):
+    def transform(self, field, row, value):
+        if value == "002":
+            raise ValueError("Invalid value")
+
+        return value + "!"
+
+
+def test_Field_batch_only_uses_error_value_for_rows_which_transformers_fail_on():
+    id_field = field.IdField(generator=field.IncrementIdGenerator(length=3))
+    concat = field.ConcatField(fields=[id_field], transformers=[FailingTransformer()], error_value="ERROR")
+
+    assert list(concat.next_batch({}, 3)) == ["001!", "ERROR", "003!"]
+    assert id_field.next_value({}) == "004"
+
+
 import operator
 
 def test_IfElseField_handles_simple_setup():
@@ -95,6 +138,38 @@ def test_IfElseField_handles_nested_setup():
     assert gender_if_else.next_value({"gender":"F","marital_status": "S"}) == "MISS"
     assert gender_if_else.next_value({"gender": "F", "marital_status": "M"}) == "MRS"
 
+def test_IfElseField_generates_batch_of_nested_values_only_for_matching_rows():
+    ms_if_else = field.IfElseField(
+        condition=field.Condition(field="marital_status", operator=operator.eq, value="M"),
+        true_value="MRS",
+        false_value=field.IdField(prefix="MISS", generator=field.IncrementIdGenerator(length=3))
+    )
+
+    gender_if_else = field.IfElseField(
+        condition=field.Condition(field="gender", operator=operator.eq, value="M"),
+        true_value="MR",
+        false_value=ms_if_else
+    )
+
+    values = gender_if_else.next_batch({
+        "gender": np.array(["M", "F", "F", "M", "F"]),
+        "marital_status": np.array(["M", "S", "M", "S", "S"])
+    }, 5)
+
+    assert list(values) == ["MR", "MISS001", "MRS", "MR", "MISS002"]
+
+
+def test_Condition_evaluates_batch_with_builtin_and_custom_operators():
+    columns = {"age": np.array([5, 18, 40])}
+
+    assert list(field.Condition(field="age", operator=operator.ge, value=18).is_true_batch(columns, 3)) == \
+           [False, True, True]
+    assert list(field.Condition(field="age", operator=lambda a, b: a % b == 0, value=5).is_true_batch(columns, 3)) == \
+           [True, False, True]
+    assert list(field.Condition(field="missing", operator=operator.eq, value="M").is_true_batch(columns, 3)) == \
+           [False, False, False]
+
+
 def test_IfElseField_handles_non_if_else_logic():
     fset = Fieldset(fields={"marital_status": "M"})
     HeadFake.set_seed(5)
@@ -227,6 +302,35 @@ def test_RepeatField_nested_generates_multiple_joined_list_of_values():
     assert gender_field.next_value({}) == "M,F,M|M,M,F,F,M|F,M,M,M,M,M|M,F,M,M,F"
     assert gender_field.next_value({}) == "M,M,F|F,M,M|F,F,M,M,F,M|F,M,M,M,M,M|F,M,M|F,M,M"
 
+def test_RepeatField_generates_batch_of_joined_values_using_row_values():
+    np.random.seed(124)
+    repeat_field = field.RepeatField(
+        field=field.LookupField(field="code"),
+        min_repeats=0,
+        max_repeats=4,
+        glue=","
+    )
+
+    values = repeat_field.next_batch({"code": np.array(["A", "B", "C", "D"])}, 4)
+    num_repeats = [len(value.split(",")) if value else 0 for value in values]
+
+    assert list(values) == [",".join([code] * num) for code, num in zip("ABCD", num_repeats)]
+    assert 0 in num_repeats
+
+
+def test_RepeatField_generates_batch_of_lists_of_values():
+    np.random.seed(124)
+    repeat_field = field.RepeatField(
+        field=field.GenderField(male_value="M", female_value="F", male_probability=0.6),
+        min_repeats=3,
+        max_repeats=7
+    )
+
+    values = repeat_field.next_batch({}, 10)
+
+    assert len(values) == 10
+    assert all(3 <= len(value) < 7 and set(value) <= {"M", "F"} for value in values)
+
 MOCK_NORM_NUM1 = 3.131313
 
 def test_NumberField_generates_random_number_with_no_formatting(monkeypatch):
@@ -489,6 +593,71 @@ def test_OperationField_uses_function_to_combine_values_and_returns_none_for_inv
 
 
 
+def test_OperationField_adds_batches_of_dates_and_timedeltas_using_numpy():
+    operation = field.OperationField(operator="operator.add", first_value=LookupField(field="admission_date"),
+                                     second_value=LookupField(field="length_of_stay"))
+
+    values = operation.next_batch({
+        "admission_date": np.array(["2020-03-10", "2020-12-30"], dtype="datetime64[D]"),
+        "length_of_stay": np.array([datetime.timedelta(days=5), datetime.timedelta(days=2.5)], dtype=object)
+    }, 2)
+
+    assert values.tolist() == [datetime.date(2020, 3, 15), datetime.date(2021, 1, 1)]
+
+
+def test_OperationField_adds_typed_dates_of_other_fields_in_fieldset_using_numpy(monkeypatch):
+    monkeypatch.setattr(field.OperationField, "_combine_by_row", mock.Mock(side_effect=AssertionError("not vectorised")))
+
+    fset = Fieldset(fields={
+        "admission_date": field.DateField(distribution="scipy.stats.norm", sd=10, mean=datetime.date(2020, 3, 1),
+                                          format="%d/%m/%Y"),
+        "discharge_date": field.OperationField(operator="operator.add",
+                                               first_value=LookupField(field="admission_date"),
+                                               second_value=datetime.timedelta(days=3))
+    })
+
+    data = fset.generate_data(5)
+
+    for admission_date, discharge_date in zip(data.admission_date, data.discharge_date):
+        admission_date = datetime.datetime.strptime(admission_date, "%d/%m/%Y").date()
+        assert discharge_date == admission_date + datetime.timedelta(days=3)
+
+
+def test_OperationField_batch_uses_function_for_each_value_and_error_value_for_invalid_combinations():
+    operation = field.OperationField(operator=lambda a, b: a * 10 + b, first_value=LookupField(field="tens"),
+                                     second_value=6)
+    assert operation.next_batch({"tens": np.array([3, 4])}, 2).tolist() == [36, 46]
+
+    operation = field.OperationField(operator="operator.sub", first_value=LookupField(field="value"), second_value=6,
+                                     error_value="NA")
+    assert operation.next_batch({"value": np.array([35, "35"], dtype=object)}, 2).tolist() == [29, "NA"]
+
+
+@pytest.mark.parametrize("operator,first_value,second_value", [
+    ("operator.truediv", 1, 0),
+    ("operator.floordiv", 1, 0),
+    ("operator.mod", 1, 0),
+    ("operator.pow", 2, -1),
+    ("operator.pow", 10, 20),
+    ("operator.mul", 2 ** 62, 4),
+    ("operator.add", 2 ** 62, 2 ** 62),
+    ("operator.truediv", 3, 2)
+])
+def test_OperationField_batch_matches_python_operator_for_division_by_zero_negative_powers_and_overflow(
+        operator, first_value, second_value):
+    operation = field.OperationField(operator=operator, first_value=LookupField(field="value"),
+                                     second_value=second_value, error_value="ERR")
+
+    expected = operation.next_value({"value": first_value})
+    assert operation.next_batch({"value": np.array([first_value, first_value])}, 2).tolist() == [expected] * 2
+
+    operation = field.OperationField(operator=operator, first_value=LookupField(field="value"),
+                                     second_value=second_value)
+    if second_value == 0:
+        with pytest.raises(ZeroDivisionError):
+            operation.next_batch({"value": np.array([first_value])}, 1)
+
+
 def test_LookupField_gets_value_generated_from_different_field():
     lookup = field.LookupField(field="age_at_onset")
 
@@ -92,6 +92,54 @@ def test_AgeField_calculates_correct_age_using_to_and_from_values_as_fields():
     assert age.next_value({}) == 37
     assert age.next_value({}) == 46
 
+def test_AgeField_calculates_batch_of_ages_from_string_field_and_constant_date():
+    age = field.AgeField(from_value=LookupField(field="dob"), to_value="01/03/2021", from_format="%d/%m/%Y",
+                         to_format="%d/%m/%Y")
+    dobs = np.array(["05/03/1953", "01/03/1953", "29/02/2000", "05/03/1953"], dtype=object)
+
+    assert age.next_batch({"dob": dobs}, 4).tolist() == [67, 68, 21, 67]
+
+def test_AgeField_calculates_batch_of_ages_from_typed_date_columns():
+    age = field.AgeField(from_value=LookupField(field="dob"), to_value=LookupField(field="today"))
+    columns = {
+        "dob": np.array(["1953-03-05", "2000-02-29"], dtype="datetime64[D]"),
+        "today": np.array(["2010-05-04", "2001-02-28"], dtype="datetime64[D]")
+    }
+
+    assert age.next_batch(columns, 2).tolist() == [57, 0]
+
+
+def test_DateOfBirthField_typed_batch_is_formatted_as_next_value(monkeypatch):
+    n = mock.Mock()
+
+    monkeypatch.setattr("scipy.stats.norm",n)
+
+    n.return_value.rvs.return_value=25.3
+    dob = field.DateOfBirthField(distribution = "scipy.stats.norm", min=0, max=105, mean=45, sd=13, date_format="%d/%m/%Y")
+    assert dob.has_typed_values()
+
+    dobs = dob.next_typed_batch({}, 2)
+    assert dobs.dtype == np.dtype("datetime64[D]")
+    assert dob.format_batch(dobs).tolist() == [dob.next_value(row)] * 2
+
+
+def test_DeceasedField_and_AgeField_use_typed_date_of_birth_from_hidden_field():
+    from headfake.fieldset import Fieldset
+    from headfake import HeadFake
+
+    dob = field.DateOfBirthField(distribution = "scipy.stats.norm", min=20, max=80, mean=45, sd=13, date_format="%d/%m/%Y", hidden=True)
+    age = field.AgeField(from_value=LookupField(field="dob"), to_value=datetime.date.today(), from_format="%d/%m/%Y")
+    deceased = field.DeceasedField(dob_field="dob", risk_of_death={"0-100":"1000000"}, date_format="%Y-%m-%d")
+    fieldset = Fieldset(fields={"dob":dob, "age":age, "deceased":deceased})
+
+    HeadFake.set_seed(5)
+    data = fieldset.generate_data(20)
+
+    assert list(data.columns) == ["age", "deceased"]
+    assert data.age.between(19, 80).all()
+    assert (data.deceased == 0).all()
+
+
 def test_DeceasedField_simulates_death_based_on_risks_and_returns_additional_fields():
     from headfake.fieldset import Fieldset
     from headfake import HeadFake
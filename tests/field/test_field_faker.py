@@ -1,6 +1,8 @@
 from headfake import field, Fieldset
 from unittest import mock
 import datetime
+import numpy as np
+import pytest
 
 from tests.field.test_field_common import MALE_VALUE, FEMALE_VALUE, MALE_NAME, FEMALE_NAME, MALE_SURNAME, \
     FEMALE_SURNAME, MALE_NAME2, FEMALE_NAME2, ADDRESS_LINE_1, ADDRESS_LINE_2, ADDRESS_LINE_3, ADDRESS_POSTCODE, \
@@ -162,6 +164,97 @@ def test_AddressField_outputs_address(monkeypatch):
     assert field.AddressField(line_no=2).next_value(row) == ADDRESS_LINE_2
     assert field.AddressField(line_no=3).next_value(row) == ADDRESS_LINE_3
 
+def test_AddressLinesField_outputs_all_lines_and_postcode_from_single_address(monkeypatch):
+    f = mock.Mock()
+    f.return_value.street_address.return_value = ADDRESS_LINE_1 + "\n" + ADDRESS_LINE_2
+    f.return_value.city.return_value = ADDRESS_LINE_3
+    f.return_value.postcode.return_value = ADDRESS_POSTCODE
+
+    monkeypatch.setattr("faker.Faker", f)
+
+    addr = field.AddressLinesField(name="address", line_fields=["addr1", "addr2", "addr3", "addr4"],
+                                   postcode_field="postcode")
+    fset = Fieldset(fields={"address": addr})
+
+    assert fset.field_names == ["address", "addr1", "addr2", "addr3", "addr4", "postcode"]
+    assert addr.next_value(row) == {
+        "address": ADDRESS_LINE_1 + ", " + ADDRESS_LINE_2 + ", " + ADDRESS_LINE_3,
+        "addr1": ADDRESS_LINE_1,
+        "addr2": ADDRESS_LINE_2,
+        "addr3": ADDRESS_LINE_3,
+        "addr4": "",
+        "postcode": ADDRESS_POSTCODE
+    }
+    f.return_value.secondary_address.assert_not_called()
+
+
+def test_AddressLinesField_folds_surplus_lines_into_last_line_and_transforms_them(monkeypatch):
+    from headfake.transformer import UpperCase
+
+    f = mock.Mock()
+    f.return_value.street_address.return_value = "flat 1\nthe drive"
+    f.return_value.city.return_value = "somewhereton"
+
+    monkeypatch.setattr("faker.Faker", f)
+
+    addr = field.AddressLinesField(name="address", line_fields=["addr1", "addr2"], separator=" ",
+                                   transformers=[UpperCase()])
+
+    assert addr.next_value(row) == {
+        "address": "FLAT 1 THE DRIVE SOMEWHERETON",
+        "addr1": "FLAT 1",
+        "addr2": "THE DRIVE SOMEWHERETON"
+    }
+
+
+def test_AddressLinesField_looks_up_postcode_from_map_file_field():
+    map_field = field.MapFileField(mapping_file="examples/test_data/patients.txt", key_field="main_pat_id")
+    addr = field.AddressLinesField(name="address", line_fields=["addr1", "addr2", "addr3"],
+                                   postcode_field="pat_postcode", map_file_field="identifier",
+                                   postcode_lookup_field="postcode")
+    Fieldset(fields={"identifier": map_field, "address": addr})
+
+    assert addr.generate_after is True
+    assert addr.next_value({"identifier": "S1000000"})["pat_postcode"] == "E9T 2ST"
+
+
+def test_AddressLinesField_generates_batches_of_lines_and_postcodes(monkeypatch):
+    from headfake.transformer import UpperCase
+
+    f = mock.Mock()
+    f.return_value.street_address.side_effect = ["flat 1\nthe drive", "2 high st", "flat 2\nthe drive"]
+    f.return_value.city.return_value = "somewhereton"
+    f.return_value.postcode.side_effect = ["ab1 2cd", "ab3 4cd", "ab5 6cd"]
+
+    monkeypatch.setattr("faker.Faker", f)
+
+    addr = field.AddressLinesField(name="address", line_fields=["addr1", "addr2"], separator=" ",
+                                   postcode_field="postcode", transformers=[UpperCase()])
+    values = addr.next_batch({}, 3)
+
+    assert {name: list(column) for name, column in values.items()} == {
+        "address": ["FLAT 1 THE DRIVE SOMEWHERETON", "2 HIGH ST SOMEWHERETON", "FLAT 2 THE DRIVE SOMEWHERETON"],
+        "addr1": ["FLAT 1", "2 HIGH ST", "FLAT 2"],
+        "addr2": ["THE DRIVE SOMEWHERETON", "SOMEWHERETON", "THE DRIVE SOMEWHERETON"],
+        "postcode": ["AB1 2CD", "AB3 4CD", "AB5 6CD"]
+    }
+
+
+def test_AddressLinesField_raises_error_naming_field_when_map_file_key_is_not_found():
+    map_field = field.MapFileField(mapping_file="examples/test_data/patients.txt", key_field="main_pat_id")
+    addr = field.AddressLinesField(name="address", line_fields=["addr1"], postcode_field="pat_postcode",
+                                   map_file_field="identifier", postcode_lookup_field="postcode")
+    Fieldset(fields={"identifier": map_field, "address": addr})
+
+    assert list(addr.next_batch({"identifier": np.array(["S1000000"])}, 1)["pat_postcode"]) == ["E9T 2ST"]
+
+    with pytest.raises(ValueError, match="'identifier' not found for the postcode of field 'address'"):
+        addr.next_value({})
+
+    with pytest.raises(ValueError, match="Key 'S0' of map file field 'identifier'"):
+        addr.next_batch({"identifier": np.array(["S1000000", "S0"])}, 2)
+
+
 def test_PostcodeField_outputs_postcode(monkeypatch):
     f = mock.Mock()
     f.return_value.postcode.return_value = ADDRESS_POSTCODE
@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+
+from headfake import HeadFake
+from headfake.cache import TemplateCache
+
+
+def test_cached_template_generates_same_data_as_compiled_template(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = TemplateCache(tmpdir)
+
+        expected = HeadFake.from_yaml("examples/patients.yaml", seed=3).generate(20)
+        HeadFake.from_yaml("examples/patients.yaml", cache=cache, seed=3)
+
+        def fail(*args):
+            raise AssertionError("template should not be compiled")
+
+        monkeypatch.setattr("headfake.headfake.create_class_tree", fail)
+        data = HeadFake.from_yaml("examples/patients.yaml", cache=cache, seed=3).generate(20)
+
+    pd.testing.assert_frame_equal(data, expected)
+
+
+def test_TemplateCache_ignores_entry_when_referenced_file_changes():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = TemplateCache(os.path.join(tmpdir, "cache"))
+        mapping_file = os.path.join(tmpdir, "mapping.csv")
+
+        with open(mapping_file, "w") as fh:
+            fh.write("key,value\n1,A\n")
+
+        cache.put("abc", {"fieldset": None}, [mapping_file])
+        assert cache.get("abc") == {"fieldset": None}
+
+        with open(mapping_file, "w") as fh:
+            fh.write("key,value\n1,B\n")
+
+        assert cache.get("abc") is None
+
+
+def test_TemplateCache_removes_least_recently_used_entries():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = TemplateCache(tmpdir, max_entries=2)
+
+        cache.put("first", {"no": 1})
+        cache.put("second", {"no": 2})
+
+        # make sure the entries have different access times whatever the resolution of the file system
+        os.utime(os.path.join(tmpdir, "first.pickle"), (1, 1))
+        os.utime(os.path.join(tmpdir, "second.pickle"), (2, 2))
+        assert cache.get("first") == {"no": 1}
+
+        cache.put("third", {"no": 3})
+
+        assert cache.get("second") is None
+        assert cache.get("first") == {"no": 1}
+        assert cache.get("third") == {"no": 3}
+
+
+def test_TemplateCache_does_not_store_unpicklable_entries():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = TemplateCache(tmpdir)
+
+        assert cache.put("abc", {"fn": lambda: None}) is False
+        assert cache.get("abc") is None
+
+
+def test_template_passes_constructor_arguments_through_and_keys_cache_on_them(monkeypatch):
+    init = HeadFake.__init__
+    received = []
+
+    def record_init(self, params, seed=None, **kwargs):
+        received.append(kwargs)
+        init(self, params, seed=seed)
+
+    monkeypatch.setattr(HeadFake, "__init__", record_init)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = TemplateCache(tmpdir)
+
+        HeadFake.from_yaml("examples/patients.yaml", cache=cache, seed=3, option="a")
+        HeadFake.from_yaml("examples/patients.yaml", cache=cache, seed=3, option="b")
+        HeadFake.from_yaml("examples/patients.yaml", cache=cache, seed=3, option="a")
+
+    assert received == [{"option": "a"}, {"option": "b"}]
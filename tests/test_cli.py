@@ -1,8 +1,13 @@
 import attr
 import csv
+import json
 import os
+import subprocess
+import sys
 import tempfile
+import time
 
+from headfake import HeadFake
 from headfake.cli import Command
 
 @attr.s
@@ -75,3 +80,112 @@ def test_generate_admission_data_from_json_template():
         assert len(lines) == 20
 
         os.unlink(tmp.name)
+
+
+def test_json_template_is_loaded_as_json(monkeypatch):
+    loaded = []
+    from_json = HeadFake.from_json
+
+    def load_json(filename, **kwargs):
+        loaded.append(filename)
+        return from_json(filename, **kwargs)
+
+    monkeypatch.setattr(HeadFake, "from_json", load_json)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        Command.run(Args(template="examples/admission.json", no_rows=5,
+                         output_file=os.path.join(tmpdir, "admission.csv")).as_list())
+
+    assert loaded == ["examples/admission.json"]
+
+
+def test_generate_jsonl_data_with_format_inferred_from_output_file():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "screening.jsonl")
+
+        Command.run(["--output-file", path, "--no-rows", "20", "examples/screening.yaml"])
+
+        with open(path) as fh:
+            lines = [json.loads(line) for line in fh]
+
+    assert len(lines) == 20
+    assert "spell_id" in lines[0]
+
+
+# a run may take at most this many times as long as importing the dependencies it cannot avoid (pandas, numpy and
+# yaml), so the check scales with the speed of the machine and only fails if headfake itself adds a comparable cost
+CLI_RUN_BUDGET = 2.0
+
+SMALL_TEMPLATE = """
+fieldset:
+  class: headfake.Fieldset
+  fields:
+    - name: id
+      class: headfake.field.IdField
+      prefix: P
+      generator:
+        class: headfake.field.IncrementIdGenerator
+        length: 6
+    - name: gender
+      class: headfake.field.OptionValueField
+      probabilities:
+        M: 0.5
+        F: 0.5
+"""
+
+TIMED_SCRIPT = """
+import sys
+from headfake.cli import Command
+Command.run([sys.argv[1], "-n", "10", "-o", sys.argv[2]])
+"""
+
+RUN_SCRIPT = """
+import json, sys
+from headfake.cli import Command
+loaded_by_import = sorted(name for name in ("pandas", "scipy", "faker") if name in sys.modules)
+
+Command.run([sys.argv[1], "-n", "10", "-o", sys.argv[2]])
+loaded_by_run = sorted(name for name in ("scipy", "faker") if name in sys.modules)
+
+from headfake import HeadFake
+HeadFake.set_seed(7)
+names = [HeadFake.create_faker().name()]
+HeadFake.set_seed(7)
+names.append(HeadFake.create_faker().name())
+
+print(json.dumps({"loaded_by_import": loaded_by_import, "loaded_by_run": loaded_by_run, "names": names}))
+"""
+
+
+def run_python(code, *args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]))
+
+    start = time.perf_counter()
+    stdout = subprocess.run([sys.executable, "-c", code, *args], env=env, check=True, stdout=subprocess.PIPE).stdout
+    return time.perf_counter() - start, stdout
+
+
+def test_cli_run_is_fast_and_leaves_unused_dependencies_unloaded():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        template = os.path.join(tmpdir, "small.yaml")
+        with open(template, "w") as fh:
+            fh.write(SMALL_TEMPLATE)
+
+        output_file = os.path.join(tmpdir, "small.csv")
+        _, stdout = run_python(RUN_SCRIPT, template, output_file)
+        result = json.loads(stdout)
+
+        with open(output_file) as fh:
+            assert len(fh.readlines()) == 11
+
+        # the quickest of several runs, to leave out delays from other processes on the machine
+        run_time = min(run_python(TIMED_SCRIPT, template, output_file)[0] for _ in range(3))
+        dependency_time = min(run_python("import pandas, numpy, yaml")[0] for _ in range(3))
+
+    assert result["loaded_by_import"] == []
+    assert result["loaded_by_run"] == []
+    # a seed set before faker is imported is applied once it is
+    assert result["names"][0] == result["names"][1]
+
+    assert run_time < dependency_time * CLI_RUN_BUDGET
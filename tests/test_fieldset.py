@@ -1,5 +1,16 @@
+import asyncio
+import io
+import pickle
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import faker.generator
+import numpy as np
+import pandas as pd
+
 from headfake import HeadFake, Fieldset
-from headfake.field import IdField
+from headfake.field import ConcatField, ConstantField, IdField, IncrementIdGenerator, LookupField
+from headfake.transformer import UpperCase
 
 
 def test_Fieldset_can_accept_list_of_fields_as_input():
@@ -82,3 +93,110 @@ def test_Fieldset_can_accept_a_dictionary_of_fields_as_input():
     assert isinstance(hf.fieldset.field_map, dict)
     assert isinstance(hf.fieldset.field_map["spell_id"],IdField)
     assert hf.fieldset.field_map["spell_id"].name == "spell_id"
+
+
+def test_Fieldset_generates_data_from_field_batches_without_hidden_fields():
+    fset = Fieldset(fields={
+        "prefix": ConstantField(value="p", hidden=True),
+        "code": ConcatField(fields=[LookupField(field="prefix"), IdField(generator=IncrementIdGenerator(length=3))], final_transformers=[UpperCase()])
+    })
+
+    data = fset.generate_data(3)
+    assert list(data.columns) == ["code"]
+    assert list(data.code) == ["P001", "P002", "P003"]
+
+
+def test_Fieldset_generates_data_in_chunks_which_continue_from_each_other():
+    fset = Fieldset(fields={"id": IdField(generator=IncrementIdGenerator(length=3))})
+
+    chunks = list(fset.generate_chunks(5, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [list(chunk.index) for chunk in chunks] == [[0, 1], [2, 3], [4]]
+    assert [list(chunk.id) for chunk in chunks] == [["001", "002"], ["003", "004"], ["005"]]
+
+
+def test_HeadFake_generates_chunks_asynchronously_without_blocking_event_loop():
+    expected = pd.concat(HeadFake.from_yaml("examples/patients.yaml", seed=4).generate_chunks(300, 100))
+    hf = HeadFake.from_yaml("examples/patients.yaml", seed=4)
+
+    async def run():
+        ticks = 0
+        done = asyncio.Event()
+
+        async def tick():
+            nonlocal ticks
+            while not done.is_set():
+                ticks += 1
+                await asyncio.sleep(0)
+
+        ticker = asyncio.ensure_future(tick())
+        chunks = [chunk async for chunk in hf.agenerate_chunks(300, chunk_size=100)]
+        done.set()
+        await ticker
+        return chunks, ticks
+
+    chunks, ticks = asyncio.run(run())
+
+    assert [len(chunk) for chunk in chunks] == [100, 100, 100]
+    pd.testing.assert_frame_equal(pd.concat(chunks), expected)
+    assert ticks > 3
+
+
+def test_HeadFake_stops_generating_chunks_asynchronously_when_closed():
+    hf = HeadFake.from_python({"fieldset": Fieldset(fields={"id": IdField()})})
+    generated = []
+
+    def generate_chunks(num_rows, chunk_size):
+        for chunk_no in range(num_rows // chunk_size):
+            generated.append(chunk_no)
+            yield chunk_no
+
+    hf.generate_chunks = generate_chunks
+
+    async def run():
+        chunks = hf.agenerate_chunks(1000, chunk_size=10, executor=executor)
+        first = await chunks.__anext__()
+        await chunks.aclose()
+        return first
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert asyncio.run(run()) == 0
+
+    # only the first chunk and the one prefetched while it was consumed are generated
+    assert generated in ([0], [0, 1])
+
+
+class RecordingUnpickler(pickle.Unpickler):
+    """Unpickler recording the top-level packages of the classes and functions it loads"""
+
+    def __init__(self, file):
+        super().__init__(file)
+        self.packages = set()
+
+    def find_class(self, module, name):
+        self.packages.add(module.split(".")[0])
+        return super().find_class(module, name)
+
+
+def pickled_packages(data):
+    unpickler = RecordingUnpickler(io.BytesIO(data))
+    unpickler.load()
+    return unpickler.packages
+
+
+def test_Fieldset_is_pickled_without_derived_attributes_and_generates_same_data():
+    hf = HeadFake.from_yaml("examples/patients.yaml", seed=5)
+    data = pickle.dumps(hf.fieldset)
+
+    # Faker instances and scipy distributions are rebuilt rather than pickled
+    assert not {"faker", "scipy"} & pickled_packages(data)
+
+    states = random.getstate(), np.random.get_state(), faker.generator.random.getstate()
+
+    def generate(fieldset):
+        random.setstate(states[0])
+        np.random.set_state(states[1])
+        faker.generator.random.setstate(states[2])
+        return fieldset.generate_data(20)
+
+    pd.testing.assert_frame_equal(generate(pickle.loads(data)), generate(hf.fieldset))
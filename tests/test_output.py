@@ -0,0 +1,694 @@
+import bz2
+import concurrent.futures
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+
+import attr
+import pandas as pd
+import pytest
+
+from headfake import Fieldset, HeadFake, output
+from headfake.field import ConstantField, DateOfBirthField
+from headfake.transformer import IntermittentBlanks
+
+
+@attr.s
+class Options:
+    output_file = attr.ib(default=None)
+    compress = attr.ib(default=None)
+    parquet_compression = attr.ib(default=None)
+    table = attr.ib(default=None)
+    if_exists = attr.ib(default=None)
+    index = attr.ib(default=None)
+    keep_empty_strings = attr.ib(default=False)
+    partition_rows = attr.ib(default=None)
+    partition_by = attr.ib(default=None)
+    partition_count = attr.ib(default=None)
+    max_partitions = attr.ib(default=None)
+    workers = attr.ib(default=None)
+    hl7_mapping = attr.ib(default=None)
+    hl7_event = attr.ib(default=None)
+    hl7_framing = attr.ib(default=None)
+    fixed_width_layout = attr.ib(default=None)
+    preallocate = attr.ib(default=False)
+    no_rows = attr.ib(default=None)
+
+
+def test_CsvFileOutput_streams_chunks_with_one_header_and_no_index():
+    chunks = [
+        pd.DataFrame({"id": ["001", "002"], "address": ["1 High St,\nLeicester", 'The "Old" House'], "flag": [1, 0]}),
+        pd.DataFrame({"id": ["003"], "address": [""], "flag": [1]}, index=[2]),
+        pd.DataFrame({"id": ["004"], "address": [None], "flag": [0.5]}, index=[3])
+    ]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.csv")
+        output.CsvFileOutput(Options(output_file=path)).write_chunks(iter(chunks))
+
+        with open(path, "rb") as fh:
+            data = fh.read()
+
+    expected = chunks[0].to_csv(index=False) + "".join(chunk.to_csv(index=False, header=False) for chunk in chunks[1:])
+    assert data == expected.encode("utf-8")
+
+
+def test_StreamOutput_writes_header_from_fieldset_when_no_rows_are_generated(capsysbinary):
+    fieldset = Fieldset(fields={"id": ConstantField(value=1), "name": ConstantField(value="A")})
+
+    csv_output = output.CsvFileOutput(Options())
+    csv_output.init_from_fieldset(fieldset)
+    csv_output.write_chunks(iter([]))
+
+    binary_output = output.PgCopyBinaryOutput(Options())
+    binary_output.init_from_fieldset(fieldset)
+    binary_output.write_chunks(iter([]))
+
+    assert capsysbinary.readouterr().out == ("id,name" + os.linesep).encode() + binary_output.signature + b"\xff\xff"
+
+
+def test_StdoutOutput_writes_csv_to_stdout(capsysbinary):
+    dataframe = pd.DataFrame({"id": ["001", "002"], "name": ["SMITH", "JONES"]})
+
+    output.StdoutOutput(Options(output_file="ignored.csv")).write(dataframe)
+
+    assert capsysbinary.readouterr().out == dataframe.to_csv(index=False).encode("utf-8")
+
+
+def test_ParquetFileOutput_writes_each_chunk_as_a_row_group():
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    chunks = [
+        pd.DataFrame({
+            "id": ["001", "002"],
+            "gender": pd.Categorical(["M", "F"], categories=["M", "F"]),
+            "dob": [datetime.date(1980, 1, 2), datetime.date(1990, 3, 4)],
+            "dod": [None, None],
+            "age": [40, 30]
+        }),
+        pd.DataFrame({
+            "id": ["003"],
+            "gender": pd.Categorical(["F"], categories=["M", "F"]),
+            "dob": [datetime.date(2000, 5, 6)],
+            "dod": ["2020-01-01"],
+            "age": [20]
+        }, index=[2])
+    ]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.parquet")
+        output.ParquetFileOutput(Options(output_file=path, parquet_compression="gzip")).write_chunks(iter(chunks))
+
+        parquet_file = pq.ParquetFile(path)
+        assert parquet_file.num_row_groups == 2
+        assert parquet_file.metadata.row_group(0).column(0).compression == "GZIP"
+
+        schema = parquet_file.schema_arrow
+        assert str(schema.field("gender").type) == "dictionary<values=string, indices=int32, ordered=0>"
+        assert str(schema.field("dob").type) == "date32[day]"
+        assert str(schema.field("dod").type) == "string"
+
+        table = parquet_file.read().to_pydict()
+        assert table["id"] == ["001", "002", "003"]
+        assert table["dod"] == [None, None, "2020-01-01"]
+        assert table["age"] == [40, 30, 20]
+
+
+def test_ParquetFileOutput_stores_dates_and_fields_which_can_be_blank_from_fieldset():
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    fieldset = Fieldset(fields={
+        "dob": DateOfBirthField(distribution="scipy.stats.norm", mean=40, sd=10, min=18, max=90,
+                                date_format="%d/%m/%Y"),
+        "count": ConstantField(value=5, transformers=[IntermittentBlanks(blank_probability=0.5)])
+    })
+    hf = HeadFake.from_python({"fieldset": fieldset}, seed=3)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.parquet")
+        hf.write(output.ParquetFileOutput(Options(output_file=path)), num_rows=20, chunk_size=2)
+
+        schema = pq.read_schema(path)
+        assert str(schema.field("dob").type) == "date32[day]"
+        assert str(schema.field("count").type) == "string"
+        assert set(pq.read_table(path).to_pydict()["count"]) == {"5", ""}
+
+        empty_path = os.path.join(tmpdir, "empty.parquet")
+        hf.write(output.ParquetFileOutput(Options(output_file=empty_path)), num_rows=0)
+
+        table = pq.read_table(empty_path)
+        assert table.column_names == ["dob", "count"]
+        assert table.num_rows == 0
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_JsonLinesOutput_writes_one_json_object_per_row(monkeypatch, use_orjson):
+    if use_orjson:
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setitem(sys.modules, "orjson", None)
+
+    output.json_encoder.cache_clear()
+
+    chunks = [
+        pd.DataFrame({"id": ["001", "002"], "dob": [datetime.date(1980, 1, 2), None], "score": [1.5, float("nan")]}),
+        pd.DataFrame({"id": ["003"], "dob": [datetime.date(1990, 3, 4)], "score": [2.0]}, index=[2])
+    ]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.jsonl")
+        output.JsonLinesOutput(Options(output_file=path)).write_chunks(iter(chunks))
+
+        with open(path) as fh:
+            lines = fh.read().splitlines()
+
+    output.json_encoder.cache_clear()
+
+    assert [json.loads(line) for line in lines] == [
+        {"id": "001", "dob": "1980-01-02", "score": 1.5},
+        {"id": "002", "dob": None, "score": None},
+        {"id": "003", "dob": "1990-03-04", "score": 2.0}
+    ]
+
+
+def test_infer_format_uses_output_file_extension():
+    assert output.infer_format("data.JSONL") == "jsonl"
+    assert output.infer_format("data.ndjson") == "jsonl"
+    assert output.infer_format("data.parquet") == "parquet"
+    assert output.infer_format("data.txt") == "csv"
+    assert output.infer_format(None) == "csv"
+
+
+@pytest.mark.parametrize("extension,compression", [(".gz", "gzip"), (".bz2", "bz2"), (".zst", "zstd")])
+def test_CsvFileOutput_compresses_output_based_on_file_extension(extension, compression):
+    if compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        decompress = lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    else:
+        decompress = (gzip if compression == "gzip" else bz2).decompress
+
+    chunks = [pd.DataFrame({"id": ["001", "002"], "name": ["SMITH", "JONES"]}), pd.DataFrame({"id": ["003"], "name": ["BROWN"]})]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.csv" + extension)
+        csv_output = output.CsvFileOutput(Options(output_file=path))
+        assert csv_output.compression == compression
+
+        csv_output.write_chunks(iter(chunks))
+
+        with open(path, "rb") as fh:
+            data = decompress(fh.read())
+
+    assert data == b"id,name\n001,SMITH\n002,JONES\n003,BROWN\n"
+
+
+def test_CompressedWriter_raises_errors_from_compression_thread():
+    class FailingHandle:
+        def write(self, data):
+            raise OSError("disk full")
+
+        def flush(self):
+            pass
+
+    writer = output.CompressedWriter(FailingHandle(), "bz2", queue_size=1)
+
+    with pytest.raises(OSError, match="disk full"):
+        for _ in range(1000):
+            writer.write(os.urandom(100000))
+
+        writer.close()
+
+
+def test_SqliteOutput_loads_chunks_into_typed_table_and_indexes_it():
+    chunks = [
+        pd.DataFrame({"id": ["001", "002"], "dob": [datetime.date(1980, 1, 2), None], "age": [40, 30], "score": [1.5, float("nan")]}),
+        pd.DataFrame({"id": ["003"], "dob": [datetime.date(1990, 3, 4)], "age": [20], "score": [2.0]}, index=[2])
+    ]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.db")
+        output.SqliteOutput(Options(output_file=path, table="patients", index=["id"])).write_chunks(iter(chunks))
+
+        connection = sqlite3.connect(path)
+        columns = connection.execute("PRAGMA table_info(patients)").fetchall()
+        rows = connection.execute("SELECT * FROM patients").fetchall()
+        indexes = connection.execute("PRAGMA index_list(patients)").fetchall()
+        connection.close()
+
+    assert [(column[1], column[2]) for column in columns] == [("id", "TEXT"), ("dob", "TEXT"), ("age", "INTEGER"), ("score", "REAL")]
+    assert rows == [("001", "1980-01-02", 40, 1.5), ("002", None, 30, None), ("003", "1990-03-04", 20, 2.0)]
+    assert [index[1] for index in indexes] == ["patients_id_idx"]
+
+
+def test_SqliteOutput_appends_to_indexed_table_and_creates_table_when_no_rows_are_generated():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.db")
+        options = Options(output_file=path, table="t", if_exists="append", index=["a"])
+
+        for _ in range(2):
+            output.SqliteOutput(options).write_chunks(iter([pd.DataFrame({"a": [1, 2]})]))
+
+        empty = output.SqliteOutput(Options(output_file=path, table="empty", index=["a"]))
+        empty.init_from_fieldset(Fieldset(fields={"a": ConstantField(value=1), "b": ConstantField(value=2)}))
+        empty.write_chunks(iter([]))
+
+        connection = sqlite3.connect(path)
+        count = connection.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+        columns = connection.execute("PRAGMA table_info(empty)").fetchall()
+        indexes = connection.execute("PRAGMA index_list(empty)").fetchall()
+        connection.close()
+
+    assert count == 4
+    assert [(column[1], column[2]) for column in columns] == [("a", "TEXT"), ("b", "TEXT")]
+    assert [index[1] for index in indexes] == ["empty_a_idx"]
+
+
+def test_SqliteOutput_rolls_back_load_if_generation_fails():
+    def chunks():
+        yield pd.DataFrame({"id": ["001"]})
+        raise ValueError("generation failed")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.db")
+
+        with pytest.raises(ValueError):
+            output.SqliteOutput(Options(output_file=path)).write_chunks(chunks())
+
+        connection = sqlite3.connect(path)
+        tables = connection.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        connection.close()
+
+    assert tables == []
+
+
+def test_PgCopyOutput_escapes_values_and_writes_missing_and_empty_values_as_null(capsysbinary):
+    dataframe = pd.DataFrame({
+        "name": ["TAB\tBED", "BACK\\SLASH", "", None],
+        "age": [40, 30, 20, 10],
+        "score": [1.5, float("nan"), 2.0, 3.0],
+        "dob": [datetime.date(1980, 1, 2), None, datetime.date(2000, 5, 6), None]
+    })
+
+    output.PgCopyOutput(Options()).write(dataframe)
+    output.PgCopyOutput(Options(keep_empty_strings=True)).write(dataframe.iloc[2:3])
+
+    assert capsysbinary.readouterr().out == (
+        b"TAB\\tBED\t40\t1.5\t1980-01-02\n"
+        b"BACK\\\\SLASH\t30\t\\N\t\\N\n"
+        b"\\N\t20\t2.0\t2000-05-06\n"
+        b"\\N\t10\t3.0\t\\N\n"
+        b"\t20\t2.0\t2000-05-06\n"
+    )
+
+
+def test_PgCopyBinaryOutput_writes_typed_binary_tuples(capsysbinary):
+    dataframe = pd.DataFrame({
+        "name": ["SMITH", ""],
+        "age": [40, 30],
+        "dob": [datetime.date(2000, 1, 3), None]
+    })
+
+    output.PgCopyBinaryOutput(Options()).write(dataframe)
+
+    assert capsysbinary.readouterr().out == (
+        b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0) +
+        struct.pack(">h", 3) + struct.pack(">i", 5) + b"SMITH" + struct.pack(">iq", 8, 40) + struct.pack(">ii", 4, 2) +
+        struct.pack(">h", 3) + struct.pack(">i", -1) + struct.pack(">iq", 8, 30) + struct.pack(">i", -1) +
+        struct.pack(">h", -1)
+    )
+
+
+class RecordingOutput(output.ChunkedOutput):
+    def __init__(self, fail_on=None):
+        self.chunks = []
+        self.aborted = False
+        self.closed = False
+        self.fail_on = fail_on
+
+    def write_chunk(self, dataframe):
+        if len(self.chunks) == self.fail_on:
+            raise OSError("disk full")
+
+        self.chunks.append(dataframe)
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+
+def test_BackgroundWriter_writes_all_chunks_in_order():
+    chunks = [pd.DataFrame({"id": [i]}) for i in range(10)]
+    recording = RecordingOutput()
+
+    output.BackgroundWriter(recording, queue_size=1).write_chunks(iter(chunks))
+
+    assert [chunk.id[0] for chunk in recording.chunks] == list(range(10))
+    assert recording.closed and not recording.aborted
+
+
+def test_BackgroundWriter_stops_generation_when_writing_fails():
+    generated = []
+
+    def chunks():
+        for i in range(100):
+            generated.append(i)
+            yield pd.DataFrame({"id": [i]})
+
+    recording = RecordingOutput(fail_on=2)
+
+    with pytest.raises(OSError, match="disk full"):
+        output.BackgroundWriter(recording, queue_size=1).write_chunks(chunks())
+
+    assert recording.aborted
+    assert len(generated) < 100
+
+
+def test_BackgroundWriter_aborts_output_when_generation_fails():
+    def chunks():
+        yield pd.DataFrame({"id": [1]})
+        raise ValueError("generation failed")
+
+    recording = RecordingOutput()
+
+    with pytest.raises(ValueError, match="generation failed"):
+        output.BackgroundWriter(recording).write_chunks(chunks())
+
+    assert recording.aborted and not recording.closed
+    assert len(recording.chunks) == 1
+
+
+def test_PartitionedOutput_splits_output_into_files_by_row_count_with_manifest():
+    chunks = [pd.DataFrame({"id": ["001", "002", "003"]}), pd.DataFrame({"id": ["004", "005"]}, index=[3, 4])]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.csv")
+        options = Options(output_file=path, partition_rows=2)
+        output.PartitionedOutput(options, output.CsvFileOutput).write_chunks(iter(chunks))
+
+        files = {name: open(os.path.join(tmpdir, name)).read() for name in os.listdir(tmpdir) if name.endswith(".csv")}
+        with open(os.path.join(tmpdir, "data.manifest.json")) as fh:
+            manifest = json.load(fh)
+
+    assert files == {
+        "data-00000.csv": "id\n001\n002\n",
+        "data-00001.csv": "id\n003\n004\n",
+        "data-00002.csv": "id\n005\n"
+    }
+    assert manifest["total_rows"] == 5
+    assert manifest["files"] == [
+        {"file": "data-00000.csv", "partition": 0, "rows": 2},
+        {"file": "data-00001.csv", "partition": 1, "rows": 2},
+        {"file": "data-00002.csv", "partition": 2, "rows": 1}
+    ]
+
+
+def test_PartitionedOutput_splits_output_into_files_by_field_value_or_hash():
+    chunks = [pd.DataFrame({"id": ["001", "002", "003"], "gender": ["M", "F", "M"]}), pd.DataFrame({"id": ["004"], "gender": ["F"]}, index=[3])]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.jsonl.gz")
+        output.PartitionedOutput(Options(output_file=path, partition_by="gender"), output.JsonLinesOutput).write_chunks(iter(chunks))
+
+        with gzip.open(os.path.join(tmpdir, "data-gender=F.jsonl.gz")) as fh:
+            assert [json.loads(line)["id"] for line in fh] == ["002", "004"]
+
+        with open(os.path.join(tmpdir, "data.manifest.json")) as fh:
+            assert {(f["partition"], f["rows"]) for f in json.load(fh)["files"]} == {("M", 2), ("F", 2)}
+
+        path = os.path.join(tmpdir, "hashed.csv")
+        output.PartitionedOutput(Options(output_file=path, partition_by="id", partition_count=3), output.CsvFileOutput).write_chunks(iter(chunks))
+
+        with open(os.path.join(tmpdir, "hashed.manifest.json")) as fh:
+            manifest = json.load(fh)
+
+    assert manifest["total_rows"] == 4
+    assert all(f["file"].startswith("hashed-id-0000") for f in manifest["files"])
+
+
+def test_PartitionedOutput_gives_values_with_same_safe_name_or_missing_values_their_own_files():
+    chunks = [pd.DataFrame({"v": [1, 2, 3, 4], "g": ["a/b", "a_b", "a/b", None]})]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "out.csv")
+        output.PartitionedOutput(Options(output_file=path, partition_by="g"), output.CsvFileOutput).write_chunks(iter(chunks))
+
+        with open(os.path.join(tmpdir, "out.manifest.json")) as fh:
+            manifest = json.load(fh, parse_constant=lambda constant: pytest.fail(f"invalid JSON {constant}"))
+
+        files = {f["partition"]: open(os.path.join(tmpdir, f["file"])).read() for f in manifest["files"]}
+
+    assert len({f["file"] for f in manifest["files"]}) == 3
+    assert files == {"a/b": "v,g\n1,a/b\n3,a/b\n", "a_b": "v,g\n2,a_b\n", None: "v,g\n4,\n"}
+
+
+def test_PartitionedOutput_limits_number_of_partitions_open_at_once():
+    chunks = [pd.DataFrame({"id": [f"{i:03d}" for i in range(5)]})]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.csv")
+
+        with pytest.raises(ValueError, match="Field 'id' has more than 3 values to partition by"):
+            output.PartitionedOutput(Options(output_file=path, partition_by="id", max_partitions=3),
+                                     output.CsvFileOutput).write_chunks(iter(chunks))
+
+        with pytest.raises(ValueError, match="partition_count"):
+            output.PartitionedOutput(Options(output_file=path, partition_by="id", partition_count=4, max_partitions=3),
+                                     output.CsvFileOutput)
+
+        output.PartitionedOutput(Options(output_file=path, partition_by="id", partition_count=3, max_partitions=3),
+                                 output.CsvFileOutput).write_chunks(iter(chunks))
+
+        with open(os.path.join(tmpdir, "data.manifest.json")) as fh:
+            assert json.load(fh)["total_rows"] == 5
+
+
+@pytest.mark.parametrize("output_class", [output.CsvFileOutput, output.JsonLinesOutput, output.PgCopyBinaryOutput])
+def test_StreamOutput_formats_chunks_in_worker_processes_in_order(output_class):
+    chunks = [pd.DataFrame({"id": [f"{i:03d}", f"{i:03d}b"], "no": [i, i]}, index=[i * 2, i * 2 + 1]) for i in range(12)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = []
+        for workers in (1, 3):
+            path = os.path.join(tmpdir, f"data{workers}")
+            output_class(Options(output_file=path, workers=workers)).write_chunks(iter(chunks))
+
+            with open(path, "rb") as fh:
+                data.append(fh.read())
+
+    assert data[0] == data[1]
+
+
+class FailingFooterOutput(output.CsvFileOutput):
+    def format_footer(self):
+        raise OSError("No space left on device")
+
+
+def test_StreamOutput_releases_file_and_workers_when_closing_fails(monkeypatch):
+    pools = []
+
+    def create_process_pool(workers):
+        pools.append(concurrent.futures.ThreadPoolExecutor(workers))
+        return pools[-1]
+
+    monkeypatch.setattr(output, "create_process_pool", create_process_pool)
+    chunks = [pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3]}, index=[2])]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        failing_output = FailingFooterOutput(Options(output_file=os.path.join(tmpdir, "data.csv"), workers=2))
+
+        with pytest.raises(OSError, match="No space left on device"):
+            failing_output.write_chunks(iter(chunks))
+
+    assert failing_output._handle is None and failing_output._executor is None
+    assert pools[0]._shutdown
+
+
+def test_PartitionedOutput_shares_one_pool_of_workers_between_partitions(monkeypatch):
+    pools = []
+
+    def create_process_pool(workers):
+        pools.append(concurrent.futures.ThreadPoolExecutor(workers))
+        return pools[-1]
+
+    monkeypatch.setattr(output, "create_process_pool", create_process_pool)
+    chunks = [pd.DataFrame({"id": [1, 2, 3, 4], "g": ["a", "b", "c", "a"]})]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "data.csv")
+        options = Options(output_file=path, partition_by="g", workers=2)
+        output.PartitionedOutput(options, output.CsvFileOutput).write_chunks(iter(chunks))
+
+        with open(os.path.join(tmpdir, "data-g=a.csv")) as fh:
+            assert fh.read() == "id,g\n1,a\n4,a\n"
+
+    assert len(pools) == 1
+    assert pools[0]._shutdown
+
+
+def test_FhirPatientOutput_maps_fields_onto_patient_resources_by_type(capsysbinary):
+    from headfake import Fieldset, field
+
+    fieldset = Fieldset(fields={
+        "pat_id": field.IdField(generator=field.IncrementIdGenerator(length=3)),
+        "nhs_no": field.NhsNoField(),
+        "gender": field.GenderField(male_value="1", female_value="2"),
+        "forename": field.FirstNameField(gender_field="gender"),
+        "surname": field.LastNameField(gender_field="gender"),
+        "dob": field.DateOfBirthField(distribution="scipy.stats.norm", min=0, max=105, mean=45, sd=13, date_format="%d/%m/%Y"),
+        "deceased": field.DeceasedField(dob_field="dob", deceased_date_field="dod", risk_of_death={"0-100": "2"}, date_format="%d/%m/%Y"),
+        "addr1": field.AddressField(line_no=1),
+        "addr2": field.AddressField(line_no=2),
+        "postcode": field.PostcodeField()
+    })
+
+    dataframe = pd.DataFrame({
+        "pat_id": ["001", "002"],
+        "nhs_no": ["943 476 5919", ""],
+        "gender": ["1", "2"],
+        "forename": ["JOHN", "JANE"],
+        "surname": ["SMITH", "JONES"],
+        "dob": ["05/03/1953", "29/02/2000"],
+        "addr1": ["1 HIGH ST", "2 LOW RD"],
+        "addr2": ["", "FLAT 2"],
+        "postcode": ["LE1 7RH", "LE2 1AA"],
+        "deceased": [1, 0],
+        "dod": ["04/05/2010", ""]
+    })
+
+    fhir_output = output.FhirPatientOutput(Options())
+    fhir_output.init_from_fieldset(fieldset)
+    fhir_output.write(dataframe)
+
+    resources = [json.loads(line) for line in capsysbinary.readouterr().out.splitlines()]
+    assert resources == [
+        {
+            "resourceType": "Patient",
+            "id": "001",
+            "identifier": [{"system": "https://fhir.nhs.uk/Id/nhs-number", "value": "9434765919"}],
+            "name": [{"use": "official", "family": "SMITH", "given": ["JOHN"]}],
+            "gender": "male",
+            "birthDate": "1953-03-05",
+            "deceasedDateTime": "2010-05-04",
+            "address": [{"use": "home", "line": ["1 HIGH ST"], "postalCode": "LE1 7RH"}]
+        },
+        {
+            "resourceType": "Patient",
+            "id": "002",
+            "name": [{"use": "official", "family": "JONES", "given": ["JANE"]}],
+            "gender": "female",
+            "birthDate": "2000-02-29",
+            "deceasedBoolean": False,
+            "address": [{"use": "home", "line": ["2 LOW RD", "FLAT 2"], "postalCode": "LE2 1AA"}]
+        }
+    ]
+
+
+def test_Hl7AdtOutput_binds_columns_to_pid_segment_and_escapes_values(capsysbinary):
+    from headfake import Fieldset, field
+
+    fieldset = Fieldset(fields={
+        "pat_id": field.IdField(generator=field.IncrementIdGenerator(length=3)),
+        "nhs_no": field.NhsNoField(),
+        "gender": field.GenderField(male_value="1", female_value="2"),
+        "forename": field.FirstNameField(gender_field="gender"),
+        "surname": field.LastNameField(gender_field="gender"),
+        "dob": field.DateOfBirthField(distribution="scipy.stats.norm", min=0, max=105, mean=45, sd=13, date_format="%d/%m/%Y"),
+        "addr1": field.AddressField(line_no=1),
+        "postcode": field.PostcodeField()
+    })
+
+    dataframe = pd.DataFrame({
+        "pat_id": ["001", "002"],
+        "nhs_no": ["943 476 5919", ""],
+        "gender": ["1", "2"],
+        "forename": ["JOHN", "JANE"],
+        "surname": ["SMITH", "O|BRIEN^JONES"],
+        "dob": ["05/03/1953", "29/02/2000"],
+        "addr1": ["1 HIGH ST", "2 LOW RD & CO"],
+        "postcode": ["LE1 7RH", "LE2 1AA"],
+        "tel": ["0116 123", None]
+    }, index=[4, 5])
+
+    hl7_output = output.Hl7AdtOutput(Options(hl7_mapping={"phone": "tel"}, hl7_event="A08", hl7_framing="mllp"))
+    hl7_output.init_from_fieldset(fieldset)
+    hl7_output.write(dataframe)
+
+    data = capsysbinary.readouterr().out.decode("utf-8")
+    messages = data.split("\x1c\r")
+    assert messages[-1] == ""
+
+    segments = [message.lstrip("\x0b").rstrip("\r").split("\r") for message in messages[:-1]]
+    timestamp = hl7_output.timestamp
+    assert segments[0] == [
+        f"MSH|^~\\&|HEADFAKE|HEADFAKE|||{timestamp}||ADT^A08^ADT_A01|5|P|2.5",
+        f"EVN|A08|{timestamp}",
+        "PID|1||001^^^HEADFAKE^MR~9434765919^^^NHS^NH||SMITH^JOHN||19530305|M|||1 HIGH ST^^^^LE1 7RH||0116 123",
+        "PV1|1|O"
+    ]
+    assert segments[1][2] == "PID|1||002^^^HEADFAKE^MR||O\\F\\BRIEN\\S\\JONES^JANE||20000229|F|||2 LOW RD \\T\\ CO^^^^LE2 1AA||"
+
+
+FIXED_WIDTH_LAYOUT = [
+    {"field": "id", "width": 4},
+    {"field": "age", "width": 3, "align": "right", "fill": "0"},
+    {"field": "filler", "width": 2},
+    {"field": "name", "width": 5}
+]
+
+
+def test_FixedWidthOutput_pads_and_truncates_columns(capsysbinary):
+    dataframe = pd.DataFrame({"id": ["1", "22222"], "age": [5, 123], "name": ["ZOË", None]})
+
+    output.FixedWidthOutput(Options(fixed_width_layout=FIXED_WIDTH_LAYOUT)).write(dataframe)
+
+    end = os.linesep.encode()
+    # widths are in bytes, so multi-byte characters take up more than one place
+    assert capsysbinary.readouterr().out == b"1   005  ZO\xc3\x8b " + end + b"2222123       " + end
+
+
+def test_FixedWidthOutput_truncates_multi_byte_characters_on_character_boundaries(capsysbinary):
+    layout = [{"field": "name", "width": 3, "align": "right"}, {"field": "town", "width": 4}]
+    dataframe = pd.DataFrame({"name": ["Ë", "ZOË"], "town": ["ÅÅÅ", "A"]})
+
+    output.FixedWidthOutput(Options(fixed_width_layout=layout)).write(dataframe)
+
+    end = os.linesep.encode()
+    records = capsysbinary.readouterr().out.split(end)[:-1]
+    assert records == [b" \xc3\x8b\xc3\x85\xc3\x85", b" ZOA   "]
+    assert all(len(record) == 7 and record.decode("utf-8") for record in records)
+
+
+def test_FixedWidthOutput_writes_preallocated_file_through_memory_map():
+    chunks = [pd.DataFrame({"id": ["1", "2"], "age": [5, 12], "name": ["SMITH", "JONES"]}),
+              pd.DataFrame({"id": ["3"], "age": [40], "name": ["BROWN"]}, index=[2])]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = []
+        for preallocate in (False, True):
+            path = os.path.join(tmpdir, f"data{preallocate}.txt")
+            options = Options(output_file=path, fixed_width_layout=FIXED_WIDTH_LAYOUT, preallocate=preallocate, no_rows=10)
+            output.FixedWidthOutput(options).write_chunks(iter(chunks))
+
+            with open(path, "rb") as fh:
+                data.append(fh.read())
+
+    assert data[0] == data[1]
+    assert len(data[1]) == 3 * (14 + len(os.linesep))
+
+
+def test_FixedWidthOutput_fails_when_preallocated_file_is_too_small():
+    dataframe = pd.DataFrame({"id": ["1", "2"], "age": [5, 12], "name": ["SMITH", "JONES"]})
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        options = Options(output_file=os.path.join(tmpdir, "data.txt"), fixed_width_layout=FIXED_WIDTH_LAYOUT,
+                          preallocate=True, no_rows=1)
+
+        with pytest.raises(ValueError):
+            output.FixedWidthOutput(options).write(dataframe)
@@ -0,0 +1,97 @@
+import asyncio
+import csv
+import io
+import json
+
+import pandas as pd
+import pytest
+
+from headfake import HeadFake
+from headfake.server import GenerationServer
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = GenerationServer(["examples/patients.yaml"], chunk_size=7, max_rows=100, max_chunk_size=10)
+    yield server
+    server.close()
+
+
+async def request(port, target):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    line = await reader.readline()
+    while line != b"\r\n":
+        name, value = line.decode("latin-1").split(":", 1)
+        headers[name.lower()] = value.strip()
+        line = await reader.readline()
+
+    if headers.get("transfer-encoding") == "chunked":
+        body = b""
+        size = int(await reader.readline(), 16)
+        while size:
+            body += await reader.readexactly(size)
+            await reader.readline()
+            size = int(await reader.readline(), 16)
+        await reader.readline()
+    else:
+        body = await reader.readexactly(int(headers["content-length"]))
+
+    writer.close()
+    return status, body
+
+
+def serve(server, *targets):
+    async def run():
+        async with await server.start(port=0) as listener:
+            port = listener.sockets[0].getsockname()[1]
+            return await asyncio.gather(*(request(port, target) for target in targets))
+
+    return asyncio.run(run())
+
+
+def test_GenerationServer_streams_rows_of_template(server):
+    [(status, body)] = serve(server, "/generate?template=patients&rows=20&seed=5")
+
+    assert status == 200
+    rows = list(csv.DictReader(io.StringIO(body.decode("utf-8"))))
+    assert len(rows) == 20
+
+    expected = pd.concat(HeadFake.from_yaml("examples/patients.yaml", seed=5).generate_chunks(20, 7))
+    assert [row["last_name"] for row in rows] == list(expected["last_name"])
+
+
+def test_GenerationServer_generates_same_data_for_concurrent_requests_with_same_seed(server):
+    responses = serve(server, *["/generate?template=patients&rows=30&seed=2&format=jsonl"] * 3)
+
+    assert [status for status, _ in responses] == [200] * 3
+    assert responses[0][1] == responses[1][1] == responses[2][1]
+    assert len(responses[0][1].splitlines()) == 30
+    assert json.loads(responses[0][1].splitlines()[0])["main_pat_id"] == "P1000000"
+
+
+def test_GenerationServer_creates_jobs_with_requested_chunk_size_and_format(server):
+    job = server._create_job({"template": "patients", "rows": "30", "chunk_size": "10", "format": "pgcopy"})
+
+    assert job._chunk_size == 10
+    assert server._content_type(job.output) == "text/plain; charset=utf-8"
+
+
+def test_GenerationServer_rejects_invalid_requests(server):
+    responses = serve(server, "/generate?template=unknown", "/generate?template=patients&rows=101",
+                      "/generate?template=patients&format=parquet", "/unknown",
+                      "/generate?template=patients&chunk_size=0", "/generate?template=patients&chunk_size=11")
+
+    assert [status for status, _ in responses] == [400, 400, 400, 404, 400, 400]
+    assert responses[0][1] == b"Unknown template 'unknown'\n"
+
+
+def test_GenerationServer_lists_templates(server):
+    [(status, body)] = serve(server, "/templates")
+
+    assert status == 200
+    assert json.loads(body) == ["examples/patients.yaml", "patients"]
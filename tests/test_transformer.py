@@ -4,6 +4,7 @@ from headfake.field import ConstantField, LastNameField, GenderField, TextField,
 from headfake.fieldset import Fieldset
 from datetime import datetime, date, timezone as tz, timedelta as td
 import numpy as np
+import pickle
 import pytest
 import random
 
@@ -114,6 +115,120 @@ def test_FormatDateTime_returns_string_from_date_and_datetime_and_handles_errors
     assert dfield.next_value({"timestamp":datetime(day=4,month=3,year=2021, hour=12, minute=42, tzinfo=tz.utc)}) == "2021-03-04"
     assert dfield.next_value({"timestamp": date(day=31,month=12,year=1956)}) == "1956-12-31"
 
+
+def test_vectorised_string_transformers_match_transform_for_each_value():
+    values = np.array(["a;b;c", "", "de;f", "ghi"], dtype=object)
+    transformers = [
+        T.UpperCase(),
+        T.Truncate(length=2),
+        T.Padding(length=4, fill="0", align="right"),
+        T.SplitPiece(separator=";", index=1),
+        T.SplitPiece(separator=";", index=0),
+        T.RegexSubstitute(pattern="[aeiou]", replace="*")
+    ]
+
+    for transformer in transformers:
+        expected = [transformer.transform(None, {}, value) for value in values]
+        assert transformer.transform_batch(None, {}, values).tolist() == expected
+
+
+@pytest.mark.parametrize("length", [0, -1, 2, 10])
+def test_Truncate_transform_batch_matches_transform_for_any_length(length):
+    values = np.array(["hello", "", "ab"], dtype=object)
+    truncate = T.Truncate(length=length)
+
+    assert truncate.transform_batch(None, {}, values).tolist() == [truncate.transform(None, {}, value) for value in values]
+
+
+def test_transform_batch_falls_back_to_transform_for_non_string_values():
+    values = np.array(["abc", ["x", "y", "z"]], dtype=object)
+
+    assert T.Truncate(length=2).transform_batch(None, {}, values).tolist() == ["ab", ["x", "y"]]
+
+
+def test_IntermittentBlanks_transform_batch_blanks_values_using_single_random_mask():
+    np.random.seed(123)
+    values = T.IntermittentBlanks(blank_probability=0.3, blank_value="").transform_batch(None, {}, np.full(1000, 5))
+
+    assert set(values.tolist()) == {5, ""}
+    assert 250 < values.tolist().count("") < 350
+
+
+def test_field_batch_raises_transformer_error_for_row_which_fails():
+    dfield = LookupField(field="date", transformers=[
+        T.ReformatDateTime(source_format="%Y-%m-%d", target_format="%d/%m/%Y")
+    ])
+
+    with pytest.raises(headfake.error.TransformerError, match="03/04/21"):
+        dfield.next_batch({"date": np.array(["2021-03-04", "03/04/21"], dtype=object)}, 2)
+
+
+def test_date_transformers_memoise_values_and_match_strptime_and_strftime():
+    reformat = T.ReformatDateTime(source_format="%d/%m/%Y", target_format="%Y-%m-%d", memo_size=2)
+    values = np.array(["04/03/2021", "4/3/2021", "04/03/2021", "31/12/1956"], dtype=object)
+
+    assert reformat.transform_batch(None, {}, values).tolist() == ["2021-03-04", "2021-03-04", "2021-03-04",
+                                                                  "1956-12-31"]
+    assert reformat._reformat.cache_info().maxsize == 2
+
+    to_date = T.ConvertStrToDate(format="%d %b %Y")
+    assert to_date.transform(None, {}, "04 Mar 2021") == date(2021, 3, 4)
+
+    with pytest.raises(ValueError):
+        T.ConvertStrToDate(format="%Y-%m-%d").transform(None, {}, "2021-02-30")
+
+
+def test_FormatDateTime_formats_datetime64_batches_and_distinguishes_timezones():
+    format_dt = T.FormatDateTime(format="%d/%m/%Y %H:%M")
+    values = np.array(["2021-03-04T12:42", "0999-01-02T00:00", "2021-03-04T12:42"], dtype="datetime64[m]")
+
+    assert format_dt.transform_batch(None, {}, values).tolist() == [
+        value.strftime("%d/%m/%Y %H:%M") for value in values.tolist()
+    ]
+
+    dates = values.astype("datetime64[D]")
+    assert T.FormatDateTime(format="%Y-%m-%d").transform_batch(None, {}, dates).tolist() == [
+        value.strftime("%Y-%m-%d") for value in dates.tolist()
+    ]
+    assert T.FormatDateTime(format="%Y-%m-%d").transform_batch(None, {}, dates[[0, 2]]).tolist() == [
+        "2021-03-04", "2021-03-04"
+    ]
+
+    utc_time = datetime(2021, 3, 4, 12, tzinfo=tz.utc)
+    format_tz = T.FormatDateTime(format="%H:%M %z")
+    assert format_tz.transform(None, {}, utc_time) == "12:00 +0000"
+    assert format_tz.transform(None, {}, utc_time.astimezone(tz(td(hours=1)))) == "13:00 +0100"
+
+
+def test_adjacent_date_conversion_and_formatting_transformers_are_fused():
+    fld = ConstantField(value="2020-03-04", transformers=[T.ConvertStrToDate(format="%Y-%m-%d"), T.FormatDateTime(format="%d/%m/%Y"), T.UpperCase()])
+    assert [type(t) for t in fld.transformers] == [T.ReformatDateTime, T.UpperCase]
+    assert fld.next_value({}) == "04/03/2020"
+
+    fld = ConstantField(value="2020-03-04 10:20", transformers=[T.ConvertStrToDate(format="%Y-%m-%d %H:%M"), T.FormatDateTime(format="%d/%m/%Y %H:%M")])
+    assert [type(t) for t in fld.transformers] == [T.ConvertStrToDate, T.FormatDateTime]
+    assert fld.next_value({}) == "04/03/2020 00:00"
+
+    fld = ConstantField(value="2020-03-04 10:20", transformers=[T.ConvertStrToDateTime(format="%Y-%m-%d %H:%M"), T.FormatDateTime(format="%H:%M %z")])
+    assert [type(t) for t in fld.transformers] == [T.ConvertStrToDateTime, T.FormatDateTime]
+    assert fld.next_value({}) == "10:20 +0000"
+
+
+def test_transformers_with_memoised_functions_are_pickled_without_them():
+    transformers = [T.ConvertStrToDate(format="%d/%m/%Y"), T.FormatDateTime(format="%Y%m%d"),
+                    T.RegexSubstitute(pattern="[0-9]", replace="#")]
+
+    for t, value in zip(transformers, ["01/02/2020", date(2020, 2, 1), "AB12"]):
+        t.transform(None, {}, value)
+
+    copies = pickle.loads(pickle.dumps(transformers))
+
+    assert all(t._derived_attributes[0] not in t.__dict__ for t in copies)
+    assert copies[0].transform(None, {}, "01/02/2020") == date(2020, 2, 1)
+    assert copies[1].transform(None, {}, date(2020, 2, 1)) == "20200201"
+    assert copies[2].transform(None, {}, "AB12") == "AB##"
+
+
 def test_IntermittentBlanks_returns_empty_strings_and_values():
     random.seed(123)
     tfield = LookupField(field="my_value", transformers=[
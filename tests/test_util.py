@@ -1,6 +1,9 @@
 import pytest
 
-from headfake.util import create_class_tree
+import datetime
+import numpy as np
+
+from headfake.util import create_class_tree, calculate_age, calculate_ages, iter_rows, BatchColumns
 from headfake.field import TextField, IfElseField, ConstantField
 from headfake.fieldset import Fieldset
 
@@ -16,6 +19,12 @@ def test_class_tree_from_field_list_with_constant_is_created_correctly():
 
     assert tree == [{"name":"discharge_date", "value":"2020-03-15"}]
 
+def test_class_tree_from_list_of_scalars_is_created_correctly():
+
+    tree = create_class_tree(None, {"line_fields": ["addr1", "addr2"]})
+
+    assert tree == {"line_fields": ["addr1", "addr2"]}
+
 def test_nested_class_tree_with_constant_is_created_correctly():
 
     tree = create_class_tree(None, {"fieldset":{"fields":[{"name":"discharge_date", "value":"2020-03-15"},{"name":"comment","class":"headfake.field.TextField", "max_length":50}],"class":"headfake.fieldset.Fieldset"}})
@@ -47,3 +56,35 @@ def test_class_tree_with_dictionary_with_incorrect_class_raises_exception():
             }
         })
 
+
+
+def test_calculate_age_treats_february_29_birthday_as_march_1_in_non_leap_years():
+    dob = datetime.date(2000, 2, 29)
+
+    assert calculate_age(dob, datetime.date(2001, 2, 28)) == 0
+    assert calculate_age(dob, datetime.date(2001, 3, 1)) == 1
+    assert calculate_age(dob, datetime.date(2004, 2, 29)) == 4
+
+def test_calculate_ages_matches_calculate_age_for_arrays_of_dates():
+    start_dates = [datetime.date(1953, 3, 5), datetime.date(2000, 2, 29), datetime.date(2000, 2, 29),
+                   datetime.date(1999, 12, 31)]
+    end_dates = [datetime.date(2010, 5, 4), datetime.date(2001, 2, 28), datetime.date(2004, 2, 28),
+                 datetime.date(2000, 12, 31)]
+
+    assert calculate_ages(start_dates, end_dates).tolist() == [
+        calculate_age(start, end) for start, end in zip(start_dates, end_dates)
+    ] == [57, 0, 3, 1]
+
+
+def test_iter_rows_updates_rows_of_batch_columns_in_place_as_columns_are_added():
+    columns = BatchColumns(2, {"a": np.array([1, 2])})
+
+    rows = list(iter_rows(columns, 2))
+    assert rows == [{"a": 1}, {"a": 2}]
+
+    columns["b"] = np.array(["x", "y"])
+    columns["a"] = np.array([3, 4])
+
+    assert list(iter_rows(columns, 2)) == [{"a": 3, "b": "x"}, {"a": 4, "b": "y"}]
+    assert all(new is old for new, old in zip(iter_rows(columns, 2), rows))
+    assert list(iter_rows(dict(columns), 2)) == rows